@@ -1,25 +1,45 @@
 import os
-from datetime import datetime, date
-from flask import Flask, render_template, redirect, url_for, flash, request, send_file, abort, session
+from datetime import datetime
+import click
+from flask import (Flask, Response, render_template, redirect, url_for, flash, request, send_file, abort, session,
+                   jsonify, stream_with_context)
 from werkzeug.utils import secure_filename
-from models import db, User, DocumentTemplate, GeneratedDocument
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy.orm import contains_eager
+from models import db, User, DocumentTemplate, GeneratedDocument, GenerationJob
 from forms import LoginForm, TemplateForm
-from utils import create_pdf_from_template, secure_unique_filename
+from executor import job_for, render_one
+from batch import BatchError, parse_rows, generate_batch, generate_merged, build_zip
+import jobs
+import storage
+from pagination import paginate_desc
+import search
+import stats
+import metrics
+import database
+from provision import provision
+import retention
+import docmeta
+import delivery
+import auth
+import export
+from template_cache import template_cache
 from config import Config
 import json
 
 
-def create_app():
+def create_app(config_overrides=None):
     app = Flask(__name__)
     app.config.from_object(Config)
+    if config_overrides:
+        app.config.update(config_overrides)
     Config.init_app(app)
+    if app.config["PROXY_COUNT"]:
+        # За nginx адрес клиента (для лимитов входа) приходит в X-Forwarded-For
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_COUNT"], x_proto=app.config["PROXY_COUNT"])
 
-    db.init_app(app)
-
-    # ---------- Jinja2 фильтр для получения шаблона по ID ----------
-    @app.template_filter('get_template')
-    def get_template(template_id):
-        return DocumentTemplate.query.get(template_id)
+    database.init_app(app)
+    metrics.init_app(app)
 
     # ---------- Вспомогательные функции ----------
     def require_login():
@@ -28,107 +48,36 @@ def create_app():
             return False
         return True
 
-    # ---------- Функция добавления демо шаблонов ----------
-    def _add_demo_templates():
-        templates_data = [
-            {
-                "name": "Справка об обучении",
-                "description": "Официальная справка для студентов",
-                "template_text": """Справка
-
-Настоящая справка выдана {{ ФИО_студента }} в том, что он(а) является студентом(кой) {{ факультет }} факультета {{ университет }} с {{ дата_поступления }} по настоящее время.
-
-Курс: {{ курс }}
-Форма обучения: {{ форма_обучения }}
-
-Подпись: {{ подпись }}
-"""
-            },
-            {
-                "name": "Благодарственное письмо",
-                "description": "Для преподавателей и сотрудников",
-                "template_text": """Благодарственное письмо
-
-Выражаем искреннюю благодарность {{ ФИО }} за активное участие в организации {{ мероприятие }} и вклад в развитие образовательного процесса.
-
-Желаем дальнейших успехов и профессионального роста!
-
-{{ должность_подписи }}
-{{ ФИО_подписи }}
-{{ дата }}
-"""
-            },
-            {
-                "name": "Приказ о зачислении",
-                "description": "Приказ ректора",
-                "template_text": """ПРИКАЗ
-
-{{ университет }}
-{{ дата }}
-
-О зачислении
-
-Зачислить на {{ курс }} курс {{ факультет }} факультета следующих студентов:
-
-1. {{ ФИО_студента }} — {{ специальность }}
-
-Основание: Приказ Минобрнауки №{{ номер_приказа }}
-
-Ректор: {{ подпись_ректора }}
-"""
-            }
-        ]
-        for t in templates_data:
-            tpl = DocumentTemplate(
-                name=t["name"],
-                description=t["description"],
-                template_text=t["template_text"],
-                created_at=datetime.utcnow(),
-                last_modified=datetime.utcnow()
-            )
-            db.session.add(tpl)
-        db.session.commit()
-
-    # ---------- Создание БД и тестовых данных ----------
-    with app.app_context():
-        db.create_all()
-
-        # Создаём админа, если нет
-        if not User.query.filter_by(username="admin").first():
-            admin = User(username="admin")
-            admin_pass = os.environ.get("ADMIN_PASSWORD", "admin")
-            admin.set_password(admin_pass)
-            db.session.add(admin)
-            db.session.commit()
-            print(f"✅ Админ создан. Логин: admin, Пароль: {admin_pass}")
-
-        # Добавляем тестовые шаблоны (если нет)
-        if DocumentTemplate.query.count() == 0:
-            _add_demo_templates()
-            print("✅ Демо-шаблоны добавлены.")
+    # ---------- Подготовка базы (в продакшене — командой flask provision) ----------
+    if app.config["AUTO_PROVISION"]:
+        with app.app_context():
+            provision(seed_demo=app.config["SEED_DEMO"])
 
     # ---------- Маршруты ----------
     @app.route("/")
     def index():
-        templates = DocumentTemplate.query.all()
-        generated_count = GeneratedDocument.query.count()
-        today_count = GeneratedDocument.query.filter(
-            GeneratedDocument.created_at >= date.today()
-        ).count()
+        summary = stats.summary()
         return render_template("index.html",
-                               templates=templates,
-                               generated_count=generated_count,
-                               today_count=today_count)
+                               templates_count=summary["templates"],
+                               generated_count=summary["documents"],
+                               today_count=summary["today"],
+                               stats=summary)
 
     @app.route("/login", methods=["GET", "POST"])
     def login():
         form = LoginForm()
         if form.validate_on_submit():
-            user = User.query.filter_by(username=form.username.data).first()
-            if user and user.check_password(form.password.data):
-                session['user_id'] = user.id
+            result = auth.authenticate(form.username.data, form.password.data, request.remote_addr)
+            if result.outcome == "ok":
+                session['user_id'] = result.user.id
                 flash("Вход выполнен успешно.", "success")
                 return redirect(url_for("templates_list"))
+            if result.outcome == "throttled":
+                flash(f"Слишком много неудачных попыток. Повторите через {result.retry_after} с.", "danger")
+                return render_template("login.html", form=form), 429, {"Retry-After": str(result.retry_after)}
+            if result.outcome == "busy":
+                flash("Сервер занят, повторите вход через несколько секунд.", "warning")
+                return render_template("login.html", form=form), 503, {"Retry-After": str(result.retry_after)}
             flash("Неверный логин или пароль.", "danger")
         return render_template("login.html", form=form)
 
@@ -144,11 +93,18 @@ def create_app():
         if not require_login():
             return redirect(url_for("login"))
         q = request.args.get('q', '').strip()
-        query = DocumentTemplate.query
-        if q:
-            query = query.filter(DocumentTemplate.name.contains(q))
-        items = query.order_by(DocumentTemplate.id.desc()).all()
-        return render_template("templates_list.html", templates=items, search_query=q)
+        cursor = request.args.get('after')
+        if q and search.is_available():
+            page = search.search_templates(q, cursor=cursor, per_page=Config.PER_PAGE)
+        else:
+            query = DocumentTemplate.query
+            if q:
+                query = query.filter(DocumentTemplate.name.contains(q))
+            field, value = request.args.get('field'), request.args.get('value')
+            if field and value is not None:
+                query = query.filter(docmeta.template_has_field(DocumentTemplate.id, field, value))
+            page = paginate_desc(query, DocumentTemplate.id, cursor=cursor, per_page=Config.PER_PAGE)
+        return render_template("templates_list.html", templates=page.items, page=page, search_query=q)
 
     @app.route("/templates/create", methods=["GET", "POST"])
     @app.route("/templates/<int:tpl_id>/edit", methods=["GET", "POST"])
@@ -164,9 +120,11 @@ def create_app():
             tpl.name = form.name.data
             tpl.description = form.description.data
             tpl.template_text = form.template_text.data
+            tpl.retention_days = form.retention_days.data
             tpl.last_modified = datetime.utcnow()
             db.session.add(tpl)
             db.session.commit()
+            template_cache.invalidate(tpl.id)
             flash("Шаблон сохранён.", "success")
             return redirect(url_for("templates_list"))
         return render_template("template_edit.html", form=form, tpl=tpl)
@@ -176,9 +134,18 @@ def create_app():
         if not require_login():
             return redirect(url_for("login"))
         tpl = DocumentTemplate.query.get_or_404(tpl_id)
+        files = (db.session.query(GeneratedDocument.filename, GeneratedDocument.signature_file)
+                 .filter_by(template_id=tpl.id).distinct().all())
         GeneratedDocument.query.filter_by(template_id=tpl.id).delete()
         db.session.delete(tpl)
         db.session.commit()
+        template_cache.invalidate(tpl_id)
+        stats.invalidate()
+        # Файлы удаляются, только если на них не ссылаются документы других шаблонов
+        for filename in {f for f, _ in files}:
+            storage.release_pdf(filename)
+        for signature_file in {sig for _, sig in files if sig}:
+            storage.release_signature(signature_file)
         flash("Шаблон и связанные документы удалены.", "warning")
         return redirect(url_for("templates_list"))
 
@@ -197,79 +164,268 @@ def create_app():
                 flash(f"Не заполнены обязательные поля: {', '.join(missing)}", "danger")
                 return render_template("template_generate.html", tpl=tpl, variables=variables, data=data)
 
-            signature_path = None
-            uploaded = request.files.get('signature')
-            if uploaded and uploaded.filename:
-                filename = secure_unique_filename(uploaded.filename)
-                saved = Config.SIGN_FOLDER / filename
-                uploaded.save(saved)
-                signature_path = str(saved)
-
             try:
-                pdf_buffer = create_pdf_from_template(tpl.template_text, data, signature_path)
-            except Exception as e:
-                flash(f"Ошибка генерации PDF: {str(e)}", "danger")
+                signature_path = storage.store_signature(request.files.get('signature'))
+            except storage.SignatureError as e:
+                flash(str(e), "danger")
                 return render_template("template_generate.html", tpl=tpl, variables=variables, data=data)
 
-            pdf_filename = f"{secure_unique_filename(tpl.name)}.pdf"
+            if request.form.get('background'):
+                job = jobs.enqueue(tpl, [data], signature_path)
+                return redirect(url_for("job_status", job_id=job.id))
+
+            # Одинаковые входные данные дают тот же файл — повторно он не рендерится.
+            # PDF пишется сразу в PDF_FOLDER (через временный файл) и отдаётся с диска
+            content_hash = storage.document_key(tpl, data, signature_path)
+            pdf_filename = storage.pdf_filename_for(content_hash)
             saved_path = Config.PDF_FOLDER / pdf_filename
-            with open(saved_path, "wb") as out:
-                out.write(pdf_buffer.getvalue())
-
-            gd = GeneratedDocument(
-                template_id=tpl.id,
-                filename=pdf_filename,
-                created_at=datetime.utcnow(),
-                meta=json.dumps(data, ensure_ascii=False)
-            )
-            db.session.add(gd)
-            db.session.commit()
+
+            def render():
+                with metrics.span("render"):
+                    size = render_one(job_for(tpl, data, signature_path, output_path=saved_path))
+                metrics.pdf_bytes_written.inc(size)
+
+            if not saved_path.exists():
+                try:
+                    render()
+                except Exception as e:
+                    flash(f"Ошибка генерации PDF: {str(e)}", "danger")
+                    return render_template("template_generate.html", tpl=tpl, variables=variables, data=data)
+            else:
+                metrics.documents_deduplicated.inc()
+
+            with metrics.span("db_commit"):
+                database.insert_document({
+                    "template_id": tpl.id,
+                    "filename": pdf_filename,
+                    "created_at": datetime.utcnow(),
+                    "meta": json.dumps(data, ensure_ascii=False),
+                    "content_hash": content_hash,
+                    "signature_file": os.path.basename(signature_path) if signature_path else None,
+                })
+            # Пока записи не было, файл мог удалить release_pdf (удаление другого документа)
+            storage.ensure_pdf(saved_path, render)
+            metrics.documents_generated.inc(source="single")
+            stats.invalidate()
 
             flash("Документ успешно создан!", "success")
-            return send_file(pdf_buffer, mimetype="application/pdf", as_attachment=True, download_name=pdf_filename)
+            return send_file(saved_path, mimetype="application/pdf", as_attachment=True,
+                             download_name=pdf_filename, conditional=True)
 
         return render_template("template_generate.html", tpl=tpl, variables=variables, data={})
 
+    @app.route("/templates/<int:tpl_id>/preview", methods=["POST"])
+    def template_preview(tpl_id):
+        """Вёрстка документа для введённых (в том числе неполных) данных — JSON, без PDF."""
+        # reportlab подгружается при первом предпросмотре, а не при старте приложения
+        from preview import PreviewError, preview_cache
+        if not session.get("user_id"):
+            return jsonify({"error": "Требуется вход в систему."}), 401
+        tpl = DocumentTemplate.query.get_or_404(tpl_id)
+        payload = request.get_json(silent=True)
+        data = payload.get("data", {}) if isinstance(payload, dict) else request.form.to_dict()
+        if not isinstance(data, dict):
+            return jsonify({"error": "Ожидается объект data."}), 400
+        try:
+            result = preview_cache.get(tpl, data)
+        except PreviewError as e:
+            return jsonify({"error": f"Ошибка в шаблоне: {e}"}), 422
+        return jsonify(result)
+
+    @app.route("/templates/<int:tpl_id>/batch", methods=["POST"])
+    def template_batch(tpl_id):
+        if not require_login():
+            return redirect(url_for("login"))
+        tpl = DocumentTemplate.query.get_or_404(tpl_id)
+
+        uploaded = request.files.get('rows_file')
+        if not uploaded or not uploaded.filename:
+            flash("Выберите файл с данными (CSV, XLSX или JSON).", "danger")
+            return redirect(url_for("template_generate", tpl_id=tpl.id))
+        try:
+            rows = parse_rows(uploaded.filename, uploaded.read())
+        except BatchError as e:
+            flash(str(e), "danger")
+            return redirect(url_for("template_generate", tpl_id=tpl.id))
+
+        try:
+            signature_path = storage.store_signature(request.files.get('signature'))
+        except storage.SignatureError as e:
+            flash(str(e), "danger")
+            return redirect(url_for("template_generate", tpl_id=tpl.id))
+        merged = request.form.get('output') == 'merged'
+        if request.form.get('background'):
+            job = jobs.enqueue(tpl, rows, signature_path, merged=merged)
+            return redirect(url_for("job_status", job_id=job.id))
+
+        result = (generate_merged if merged else generate_batch)(tpl, rows, signature_path)
+        stats.invalidate()
+        if not result.documents:
+            details = "; ".join(f"строка {row_no}: {err}" for row_no, err in result.errors[:10])
+            flash(f"Ни один документ не создан. {details}", "danger")
+            return redirect(url_for("template_generate", tpl_id=tpl.id))
+
+        if merged:
+            # Один PDF на все записи; строки с ошибками в него не попали
+            if result.errors:
+                flash(f"Пропущено строк с ошибками: {len(result.errors)}", "warning")
+            _, pdf_filename = result.documents[0]
+            download_name = f"merged_{tpl.id}_{datetime.utcnow():%Y%m%d_%H%M%S}.pdf"
+            return send_file(Config.PDF_FOLDER / pdf_filename, mimetype="application/pdf", as_attachment=True,
+                             download_name=download_name, conditional=True)
+
+        archive = build_zip(result)
+        download_name = f"batch_{tpl.id}_{datetime.utcnow():%Y%m%d_%H%M%S}.zip"
+        return send_file(archive, mimetype="application/zip", as_attachment=True, download_name=download_name)
+
+    # ---------- Фоновые задания ----------
+    @app.route("/jobs/<job_id>")
+    def job_status(job_id):
+        if not require_login():
+            return redirect(url_for("login"))
+        job = GenerationJob.query.get_or_404(job_id)
+        best = request.accept_mimetypes.best_match(["text/html", "application/json"])
+        if best == "application/json" or request.args.get("format") == "json":
+            return jsonify(job.to_dict())
+        return render_template("job_status.html", job=job)
+
+    @app.route("/jobs/<job_id>/result")
+    def job_result(job_id):
+        if not require_login():
+            return redirect(url_for("login"))
+        job = GenerationJob.query.get_or_404(job_id)
+        path = jobs.result_path(job)
+        if job.status != "done" or path is None or not path.exists():
+            abort(404)
+        return send_file(path, as_attachment=True, download_name=f"job_{job.id[:8]}{path.suffix}", conditional=True)
+
     # ---------- Сгенерированные документы ----------
     @app.route("/generated")
     def generated_list():
         if not require_login():
             return redirect(url_for("login"))
         q = request.args.get('q', '').strip()
-        query = GeneratedDocument.query
-        if q:
-            query = query.join(DocumentTemplate).filter(DocumentTemplate.name.contains(q))
-        items = query.order_by(GeneratedDocument.created_at.desc()).all()
-        return render_template("generated_list.html", items=items, search_query=q)
+        cursor = request.args.get('after')
+        if q and search.is_available():
+            # Поиск по названию шаблона и данным документа (ФИО, курс...) по релевантности
+            page = search.search_documents(q, cursor=cursor, per_page=Config.PER_PAGE)
+        else:
+            # Шаблон подгружается тем же запросом (JOIN), без отдельного запроса на строку
+            query = GeneratedDocument.query.options(contains_eager(GeneratedDocument.template)) \
+                .outerjoin(GeneratedDocument.template)
+            if q:
+                query = query.filter(DocumentTemplate.name.contains(q))
+            field, value = request.args.get('field'), request.args.get('value')
+            if field and value is not None:
+                query = query.filter(docmeta.field_equals(GeneratedDocument.id, field, value))
+            page = paginate_desc(query, GeneratedDocument.id, cursor=cursor,
+                                 per_page=Config.PER_PAGE, sort_col=GeneratedDocument.created_at)
+        return render_template("generated_list.html", items=page.items, page=page, search_query=q)
+
+    @app.route("/generated/export")
+    @app.route("/generated/export.<fmt>")
+    def generated_export(fmt=None):
+        """Потоковая выгрузка истории документов в CSV или JSONL с фильтрами (см. export.py)."""
+        if not require_login():
+            return redirect(url_for("login"))
+        fmt = fmt or request.args.get("format", "csv")
+        if fmt not in export.STREAMS:
+            abort(404)
+        try:
+            flt = export.ExportFilter.from_args(request.args)
+        except export.ExportError as e:
+            return jsonify({"error": str(e)}), 400
+        headers = {
+            "Content-Disposition": f"attachment; filename=documents_{datetime.utcnow():%Y%m%d}.{fmt}",
+            # nginx не должен копить ответ целиком перед отправкой клиенту
+            "X-Accel-Buffering": "no",
+        }
+        return Response(stream_with_context(export.STREAMS[fmt](flt)), content_type=export.FORMATS[fmt],
+                        headers=headers)
+
+    @app.route("/reports/fields/<key>")
+    def report_field(key):
+        """Число документов по значениям поля key (например, факультет) за период. По умолчанию — текущий месяц."""
+        if not session.get("user_id"):
+            return jsonify({"error": "Требуется вход в систему."}), 401
+        try:
+            since = datetime.strptime(request.args["since"], "%Y-%m-%d") if "since" in request.args \
+                else docmeta.month_start()
+            until = datetime.strptime(request.args["until"], "%Y-%m-%d") if "until" in request.args else None
+        except ValueError:
+            return jsonify({"error": "Даты ожидаются в формате ГГГГ-ММ-ДД."}), 400
+        rows = docmeta.count_by(key, since=since, until=until,
+                                template_id=request.args.get("template_id", type=int))
+        return jsonify({
+            "key": key,
+            "since": since.date().isoformat(),
+            "until": until.date().isoformat() if until else None,
+            "counts": [{"value": value, "count": count} for value, count in rows],
+        })
 
     @app.route("/generated/<int:doc_id>/download")
     def generated_download(doc_id):
         if not require_login():
             return redirect(url_for("login"))
         doc = GeneratedDocument.query.get_or_404(doc_id)
-        filepath = Config.PDF_FOLDER / doc.filename
-        if not filepath.exists():
+        response = delivery.send_document(doc)
+        if response is None:
             abort(404)
-        return send_file(filepath, as_attachment=True, download_name=doc.filename)
+        return response
 
     @app.route("/generated/<int:doc_id>/delete", methods=["POST"])
     def generated_delete(doc_id):
         if not require_login():
             return redirect(url_for("login"))
         doc = GeneratedDocument.query.get_or_404(doc_id)
-        filepath = Config.PDF_FOLDER / doc.filename
-        if filepath.exists():
-            filepath.unlink()
+        filename, signature_file = doc.filename, doc.signature_file
         db.session.delete(doc)
         db.session.commit()
+        storage.release_pdf(filename)
+        storage.release_signature(signature_file)
+        stats.invalidate()
         flash("Документ удалён.", "warning")
         return redirect(url_for("generated_list"))
 
-    # ---------- Health check ----------
+    # ---------- CLI ----------
+    @app.cli.command("provision")
+    @click.option("--no-demo", is_flag=True, help="Не добавлять демо-шаблоны.")
+    def provision_command(no_demo):
+        """Создаёт и обновляет схему базы, индексы поиска, администратора и демо-шаблоны."""
+        provision(seed_demo=not no_demo, log=click.echo)
+        click.echo("База готова.")
+
+    @app.cli.command("worker")
+    @click.option("--once", is_flag=True, help="Обработать очередь и выйти.")
+    @click.option("--interval", type=float, default=None, help="Пауза между опросами очереди, сек.")
+    def worker_command(once, interval):
+        """Обработчик фоновых заданий генерации."""
+        jobs.run_worker(once=once, interval=interval, log=click.echo)
+
+    @app.cli.command("maintenance")
+    @click.option("--stage", "stages", multiple=True, type=click.Choice(list(retention.STAGES)),
+                  help="Выполнить только указанные этапы (можно несколько раз).")
+    @click.option("--limit", type=int, default=None, help="Не больше N объектов на этап.")
+    @click.option("--dry-run", is_flag=True, help="Только посчитать, ничего не удалять.")
+    def maintenance_command(stages, limit, dry_run):
+        """Срок хранения, удаление файлов без ссылок, архивирование и уплотнение архива."""
+        report = retention.run_maintenance(stages=stages or None, limit=limit, dry_run=dry_run)
+        for key, value in sorted(report.items()):
+            click.echo(f"{key}: {value}")
+        if not report:
+            click.echo("Нечего делать.")
+
+    # ---------- Health check и метрики ----------
     @app.route("/health")
     def health():
         return "OK", 200
 
+    @app.route("/metrics")
+    def metrics_endpoint():
+        if not metrics.enabled:
+            abort(404)
+        return metrics.render_latest(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
     return app
 
 
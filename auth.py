@@ -0,0 +1,178 @@
+# auth.py
+"""
+Проверка пароля при входе. Хеш намеренно дорогой (PBKDF2/scrypt), поэтому:
+
+  * он считается в отдельном пуле из AUTH_WORKERS потоков, а ждать своей
+    очереди могут не больше AUTH_QUEUE_SIZE запросов — остальные сразу
+    получают 503, и всплеск входов не занимает все ядра, нужные рендерингу.
+    hashlib считает PBKDF2 и scrypt без GIL, так что потоки пула работают
+    параллельно с остальными запросами;
+  * до вычисления хеша проверяется лимит неудачных попыток на имя
+    пользователя и на IP (таблица login_throttle, общая для всех воркеров);
+  * после успешного входа хеш, посчитанный другим методом, чем
+    PASSWORD_HASH_METHOD, незаметно пересчитывается.
+
+Для несуществующего пользователя проверяется заранее посчитанный хеш той же
+стоимости, чтобы время ответа не выдавало, есть ли такой логин.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.security import generate_password_hash, check_password_hash
+from config import Config
+from models import db, User, LoginThrottle
+import metrics
+
+LoginResult = namedtuple("LoginResult", ["outcome", "user", "retry_after"])  # ok | invalid | throttled | busy
+
+_executor = None
+_slots = None
+_owner_pid = None
+_lock = threading.Lock()
+_dummy_hashes = {}  # метод -> хеш пустой строки
+
+
+class AuthBusy(Exception):
+    """Пул проверки паролей и его очередь заняты."""
+
+
+def hash_method_prefix(stored_hash):
+    """Метод и параметры хеша werkzeug: «pbkdf2:sha256:600000$соль$хеш» -> «pbkdf2:sha256:600000»."""
+    return stored_hash.split("$", 1)[0]
+
+
+def _pool():
+    """Пул создаётся лениво и заново после fork: потоки мастера в воркер не переходят."""
+    global _executor, _slots, _owner_pid
+    with _lock:
+        if _executor is None or _owner_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=Config.AUTH_WORKERS, thread_name_prefix="auth")
+            _slots = threading.BoundedSemaphore(Config.AUTH_WORKERS + Config.AUTH_QUEUE_SIZE)
+            _owner_pid = os.getpid()
+        return _executor, _slots
+
+
+def _verify(stored_hash, password, submitted_at):
+    """Выполняется в пуле: проверка и, если метод устарел, новый хеш."""
+    started = time.perf_counter()
+    if metrics.enabled:
+        metrics.auth_seconds.observe(started - submitted_at, phase="queue")
+    method = Config.PASSWORD_HASH_METHOD
+    dummy = _dummy_hashes.get(method)
+    if dummy is None:
+        # Один раз на процесс; заодно даёт метод из настроек в том виде, как его пишет werkzeug
+        dummy = _dummy_hashes.setdefault(method, generate_password_hash("", method=method))
+    if stored_hash is None:
+        check_password_hash(dummy, password)
+        ok, new_hash = False, None
+    else:
+        ok = check_password_hash(stored_hash, password)
+        new_hash = None
+        if ok and hash_method_prefix(stored_hash) != hash_method_prefix(dummy):
+            new_hash = generate_password_hash(password, method=method)
+    if metrics.enabled:
+        metrics.auth_seconds.observe(time.perf_counter() - started, phase="hash")
+    return ok, new_hash
+
+
+def verify_password(stored_hash, password):
+    """
+    Проверяет пароль в пуле. Возвращает (совпал, новый_хеш или None).
+    Бросает AuthBusy, если пул и очередь заняты или ответ не пришёл за AUTH_TIMEOUT.
+    """
+    executor, slots = _pool()
+    if not slots.acquire(blocking=False):
+        raise AuthBusy()
+    try:
+        future = executor.submit(_verify, stored_hash, password, time.perf_counter())
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=Config.AUTH_TIMEOUT)
+    except FutureTimeout:
+        raise AuthBusy()
+
+
+# ---------- Лимит неудачных попыток ----------
+
+def _throttle_keys(username, client_ip):
+    keys = {f"user:{(username or '').strip().lower()}"[:200]: Config.LOGIN_MAX_FAILURES}
+    if client_ip:
+        keys[f"ip:{client_ip}"[:200]] = Config.LOGIN_MAX_FAILURES_PER_IP
+    return keys
+
+
+def retry_after(keys, now=None):
+    """Через сколько секунд можно снова пробовать; 0 — лимит не исчерпан."""
+    now = now or datetime.utcnow()
+    window = timedelta(seconds=Config.LOGIN_WINDOW_SECONDS)
+    wait = 0
+    for row in LoginThrottle.query.filter(LoginThrottle.key.in_(list(keys))):
+        if row.failures >= keys[row.key] and row.window_started_at + window > now:
+            wait = max(wait, (row.window_started_at + window - now).total_seconds())
+    return int(wait) + 1 if wait else 0
+
+
+def record_failure(keys, now=None):
+    """Увеличивает счётчики окна; истёкшее окно начинается заново."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=Config.LOGIN_WINDOW_SECONDS)
+    table = LoginThrottle.__table__
+    expired = table.c.window_started_at <= cutoff
+    started = db.literal(now, table.c.window_started_at.type)
+    for key in keys:
+        statement = sqlite_insert(table).values(key=key, failures=1, window_started_at=now)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={
+                "failures": db.case((expired, 1), else_=table.c.failures + 1),
+                "window_started_at": db.case((expired, started), else_=table.c.window_started_at),
+            },
+        )
+        db.session.execute(statement)
+    db.session.commit()
+
+
+def purge_throttles(now=None):
+    """Удаляет записи с истёкшим окном (вызывается из обслуживания, см. retention.py)."""
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=Config.LOGIN_WINDOW_SECONDS)
+    deleted = LoginThrottle.query.filter(LoginThrottle.window_started_at <= cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+# ---------- Вход ----------
+
+def authenticate(username, password, client_ip=None):
+    """Проверяет логин и пароль с учётом лимитов. Возвращает LoginResult."""
+    keys = _throttle_keys(username, client_ip)
+    wait = retry_after(keys)
+    if wait:
+        metrics.logins.inc(outcome="throttled")
+        return LoginResult("throttled", None, wait)
+
+    user = User.query.filter_by(username=username).first()
+    try:
+        ok, new_hash = verify_password(user.password_hash if user else None, password or "")
+    except AuthBusy:
+        metrics.logins.inc(outcome="busy")
+        return LoginResult("busy", None, 1)
+
+    if not ok:
+        record_failure(keys)
+        metrics.logins.inc(outcome="invalid")
+        return LoginResult("invalid", None, 0)
+
+    if new_hash:
+        user.password_hash = new_hash
+    user_key = next(iter(keys))
+    LoginThrottle.query.filter_by(key=user_key).delete()
+    db.session.commit()
+    metrics.logins.inc(outcome="ok")
+    return LoginResult("ok", user, 0)
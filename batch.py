@@ -0,0 +1,285 @@
+# batch.py
+"""
+Пакетная генерация документов: одна загрузка файла со строками данных
+(CSV, XLSX или JSON) — много PDF по одному шаблону.
+"""
+import codecs
+import csv
+import io
+import json
+import tempfile
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from config import Config
+from models import db, GeneratedDocument
+from executor import job_for, render_job, render_many, render_one
+import metrics
+from storage import document_key, ensure_pdf, pdf_filename_for
+
+SUPPORTED_EXTENSIONS = (".csv", ".json", ".xlsx")
+MERGED_META_VALUES = 5  # сколько значений каждой переменной попадает в meta общего PDF
+
+
+class BatchError(Exception):
+    """Файл с данными нельзя разобрать целиком (формат, кодировка, размер)."""
+
+
+class BatchResult:
+    def __init__(self):
+        self.documents = []   # [(номер строки, имя PDF)]
+        self.errors = []      # [(номер строки, текст ошибки)]
+
+    @property
+    def ok_count(self):
+        return len(self.documents)
+
+
+def _decode_csv(raw):
+    # «Юникод (UTF-16)» в Excel сохраняет текст с BOM, без него UTF-16 не отличить от мусора
+    if raw.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encodings = ("utf-16",)
+    else:
+        # Excel под Windows сохраняет CSV в cp1251
+        encodings = ("utf-8-sig", "cp1251")
+    for encoding in encodings:
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    raise BatchError("Не удалось определить кодировку CSV. Сохраните файл в UTF-8.")
+
+
+def _read_csv(raw):
+    text = _decode_csv(raw)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    try:
+        return list(csv.DictReader(io.StringIO(text), dialect=dialect))
+    except csv.Error as e:
+        raise BatchError(f"Некорректный CSV: {e}")
+
+
+def _read_json(raw):
+    try:
+        payload = json.loads(raw.decode("utf-8-sig"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise BatchError(f"Некорректный JSON: {e}")
+    if isinstance(payload, dict):
+        payload = payload.get("rows", [])
+    if not isinstance(payload, list):
+        raise BatchError("JSON должен содержать список объектов или ключ \"rows\".")
+    return payload
+
+
+def _read_xlsx(raw):
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise BatchError("Для загрузки XLSX установите пакет openpyxl или сохраните файл как CSV.")
+    try:
+        wb = load_workbook(io.BytesIO(raw), read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        # Повреждённый файл или другой формат с расширением .xlsx
+        raise BatchError("Файл XLSX повреждён или не является книгой Excel. Сохраните его заново или как CSV.")
+    rows = wb.active.iter_rows(values_only=True)
+    header = next(rows, None)
+    if not header:
+        return []
+    header = [str(h).strip() if h is not None else "" for h in header]
+    return [dict(zip(header, values)) for values in rows]
+
+
+def parse_rows(filename, raw):
+    """Разбирает загруженный файл в список словарей {переменная: значение}."""
+    ext = Path(filename or "").suffix.lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise BatchError("Поддерживаются файлы CSV, XLSX и JSON.")
+    reader = {".csv": _read_csv, ".json": _read_json, ".xlsx": _read_xlsx}[ext]
+    rows = reader(raw)
+    if len(rows) > Config.BATCH_MAX_ROWS:
+        raise BatchError(f"Слишком много строк: {len(rows)} (максимум {Config.BATCH_MAX_ROWS}).")
+    return rows
+
+
+def validate_row(row, variables):
+    """Возвращает (data, ошибка). Значения приводятся к строкам без пробелов по краям."""
+    if not isinstance(row, dict):
+        return None, "строка не является объектом"
+    data = {}
+    for var in variables:
+        value = row.get(var)
+        data[var] = "" if value is None else str(value).strip()
+    missing = [var for var, val in data.items() if not val]
+    if missing:
+        return None, f"не заполнены поля: {', '.join(missing)}"
+    return data, None
+
+
+def generate_batch(tpl, rows, signature_path=None, progress=None):
+    """
+    Генерирует PDF для каждой корректной строки. Ошибки отдельных строк
+    не прерывают пакет. Все записи GeneratedDocument вставляются одним запросом.
+    progress(обработано, всего) вызывается после каждого отрендеренного документа.
+    """
+    result = BatchResult()
+    variables = tpl.get_variables()
+    valid = _validate_rows(rows, variables, result)
+
+    # Одинаковые строки (и уже существующие на диске документы) не рендерятся повторно.
+    # PDF пишутся сразу в PDF_FOLDER, в памяти родительского процесса их нет
+    entries = []
+    to_render = {}
+    for row_no, data in valid:
+        key = document_key(tpl, data, signature_path)
+        entries.append((row_no, data, key))
+        output_path = Config.PDF_FOLDER / pdf_filename_for(key)
+        if key not in to_render and not output_path.exists():
+            to_render[key] = job_for(tpl, data, signature_path, output_path=output_path)
+
+    # Рендеринг идёт через общий исполнитель (inline / потоки / процессы)
+    render_errors = {}
+    done = len(rows) - len(to_render)
+    for job, size, error in render_many(list(to_render.values())):
+        done += 1
+        if progress:
+            progress(done, len(rows))
+        if error is not None:
+            render_errors[Path(job.output_path).stem] = error
+        else:
+            metrics.pdf_bytes_written.inc(size)
+
+    signature_file = Path(signature_path).name if signature_path else None
+    records = []
+    for row_no, data, key in entries:
+        if key in render_errors:
+            result.errors.append((row_no, f"ошибка генерации PDF: {render_errors[key]}"))
+            continue
+        pdf_filename = pdf_filename_for(key)
+        result.documents.append((row_no, pdf_filename))
+        records.append({
+            "template_id": tpl.id,
+            "filename": pdf_filename,
+            "created_at": datetime.utcnow(),
+            "meta": json.dumps(data, ensure_ascii=False),
+            "content_hash": key,
+            "signature_file": signature_file,
+        })
+
+    if records:
+        with metrics.span("db_commit"):
+            db.session.execute(db.insert(GeneratedDocument), records)
+            db.session.commit()
+        # До вставки записей на файлы никто не ссылался, и release_pdf мог их удалить
+        recorded = {key: data for _, data, key in entries if key not in render_errors}
+        for key, data in recorded.items():
+            path = Config.PDF_FOLDER / pdf_filename_for(key)
+            ensure_pdf(path, lambda: render_one(job_for(tpl, data, signature_path, output_path=path)))
+        metrics.documents_generated.inc(len(records), source="batch")
+        metrics.documents_deduplicated.inc(len(records) - len(to_render) + len(render_errors))
+    result.errors.sort()
+    return result
+
+
+def _validate_rows(rows, variables, result):
+    valid = []
+    # Нумерация строк как в таблице: первая строка — заголовок
+    for row_no, row in enumerate(rows, start=2):
+        data, error = validate_row(row, variables)
+        if error:
+            result.errors.append((row_no, error))
+        else:
+            valid.append((row_no, data))
+    return valid
+
+
+def merged_meta(records, variables):
+    """
+    meta общего PDF: число записей и первые MERGED_META_VALUES значений
+    каждой переменной — для поиска. Значения вложены в объект «записи»,
+    поэтому document_meta их не индексирует и отчёты по полям считают
+    только отдельные документы.
+    """
+    summary = {}
+    for var in variables:
+        values = [data[var] for data in records[:MERGED_META_VALUES]]
+        if len(records) > MERGED_META_VALUES:
+            values.append(f"… (+{len(records) - MERGED_META_VALUES})")
+        summary[var] = "; ".join(values)
+    return {"записей": str(len(records)), "записи": summary}
+
+
+def generate_merged(tpl, rows, signature_path=None, progress=None):
+    """
+    Рендерит все корректные строки в один PDF (каждая запись с новой страницы)
+    и сохраняет его как один GeneratedDocument. В result.documents — одна пара
+    (номер первой строки, имя PDF); ошибки строк собираются как в generate_batch.
+    С progress(обработано, всего) документ рендерится в текущем процессе,
+    а не в пуле исполнителя: иначе о ходе работы не узнать до конца рендеринга.
+    """
+    result = BatchResult()
+    variables = tpl.get_variables()
+    valid = _validate_rows(rows, variables, result)
+    if not valid:
+        return result
+
+    records = [data for _, data in valid]
+    # Ключ от списка строк не совпадёт с ключом отдельного документа (там словарь)
+    key = document_key(tpl, records, signature_path)
+    pdf_filename = pdf_filename_for(key)
+    output_path = Config.PDF_FOLDER / pdf_filename
+    skipped = len(rows) - len(records)
+
+    def record_progress(done, _total):
+        progress(skipped + done, len(rows))
+
+    if output_path.exists():
+        metrics.documents_deduplicated.inc()
+    else:
+        try:
+            job = job_for(tpl, records, signature_path, output_path=output_path)
+            size = render_job(job, progress=record_progress) if progress else render_one(job)
+        except Exception as e:
+            result.errors.append((valid[0][0], f"ошибка генерации PDF: {e}"))
+            return result
+        metrics.pdf_bytes_written.inc(size)
+
+    meta = merged_meta(records, variables)
+    with metrics.span("db_commit"):
+        db.session.execute(db.insert(GeneratedDocument), [{
+            "template_id": tpl.id,
+            "filename": pdf_filename,
+            "created_at": datetime.utcnow(),
+            "meta": json.dumps(meta, ensure_ascii=False),
+            "content_hash": key,
+            "signature_file": Path(signature_path).name if signature_path else None,
+        }])
+        db.session.commit()
+    ensure_pdf(output_path, lambda: render_one(job_for(tpl, records, signature_path, output_path=output_path)))
+    metrics.documents_generated.inc(source="merged")
+    result.documents.append((valid[0][0], pdf_filename))
+    result.errors.sort()
+    return result
+
+
+def build_zip(result, archive=None):
+    """
+    Упаковывает PDF пакета (и отчёт об ошибках, если есть) в ZIP.
+    Без archive результат пишется во временный файл и возвращается открытым.
+    """
+    if archive is None:
+        archive = tempfile.SpooledTemporaryFile(max_size=Config.BATCH_SPOOL_MAX_BYTES)
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        for row_no, pdf_filename in result.documents:
+            zf.write(Config.PDF_FOLDER / pdf_filename, arcname=f"{row_no:05d}_{pdf_filename}")
+        if result.errors:
+            report = io.StringIO()
+            writer = csv.writer(report)
+            writer.writerow(["строка", "ошибка"])
+            writer.writerows(result.errors)
+            zf.writestr("errors.csv", report.getvalue().encode("utf-8-sig"))
+    archive.seek(0)
+    return archive
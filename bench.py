@@ -0,0 +1,308 @@
+# bench.py
+"""
+Бенчмарки конвейера генерации PDF.
+
+    python bench.py                       # прогон и сравнение с bench_baseline.json (если есть)
+    python bench.py --quick               # меньше итераций, для быстрой проверки
+    python bench.py --save-baseline       # сохранить текущие результаты как эталон
+    python bench.py --output results.json # записать результаты в JSON
+    python bench.py --in-process          # все сценарии в одном процессе (быстрее)
+
+Для каждого сценария считаются перцентили задержки, документы в секунду
+и память. Каждый сценарий запускается в отдельном процессе, поэтому
+peak_rss_mb — пик RSS именно этого сценария (вместе с запуском приложения).
+С --in-process пик RSS общий для всех сценариев и не записывается;
+вместо него rss_delta_mb — прирост RSS за время сценария (только Linux).
+При сравнении с эталоном сценарий считается регрессией, если медиана
+выросла больше чем на --tolerance (по умолчанию 25%); тогда скрипт
+завершается с кодом 1.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from PIL import Image
+from config import Config
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BASE_DIR / "bench_baseline.json"
+
+SHORT_TEMPLATE = """Справка
+
+Настоящая справка выдана {{ ФИО }} в том, что он(а) является студентом(кой) {{ факультет }} факультета.
+
+Курс: {{ курс }}
+"""
+
+LONG_TEMPLATE = "**Приказ о зачислении**\n\n" + "\n".join(
+    f"{i}. {{{{ ФИО }}}} — зачислить на {{{{ курс }}}} курс {{{{ факультет }}}} факультета "
+    f"на основании решения приёмной комиссии и заявления студента"
+    for i in range(1, 301)
+)
+
+# Бланк: много постоянного текста и пара подстановок — план вёрстки отмеряет его один раз
+STATIC_TEMPLATE = "**Правила внутреннего распорядка**\n\n" + "\n".join(
+    f"{i}. Обучающийся обязан соблюдать требования устава, правила внутреннего распорядка, "
+    f"расписание учебных занятий и бережно относиться к имуществу образовательной организации"
+    for i in range(1, 61)
+) + "\n\nОзнакомлен(а): {{ ФИО }}, {{ факультет }} факультет"
+
+MANY_VARS_TEMPLATE = "\n".join(f"Поле {i}: {{{{ поле_{i} }}}}" for i in range(60))
+
+SAMPLE_DATA = {"ФИО": "Иванов Иван Иванович", "факультет": "информационных технологий", "курс": "1"}
+MANY_VARS_DATA = {f"поле_{i}": f"значение {i}" for i in range(60)}
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса (Linux — КиБ, macOS — байты)."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(usage / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb():
+    """Текущий RSS процесса по /proc/self/statm; None, где /proc нет."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def measure(fn, iterations, docs_per_call=1, warmup=1, isolated=True):
+    for _ in range(warmup):
+        fn()
+    rss_before = current_rss_mb()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    rss_after = current_rss_mb()
+    timings.sort()
+    result = {
+        "iterations": iterations,
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(timings, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "docs_per_sec": round(iterations * docs_per_call / elapsed, 2) if elapsed else 0.0,
+        "rss_delta_mb": round(rss_after - rss_before, 1) if rss_before is not None else None,
+    }
+    if isolated:
+        result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+class BenchEnvironment:
+    """Приложение с базой в памяти и временными папками, чтобы не трогать рабочие данные."""
+
+    def __init__(self):
+        self.tmpdir = Path(tempfile.mkdtemp(prefix="edudoc-bench-"))
+        self._saved = {name: getattr(Config, name)
+                       for name in ("UPLOAD_FOLDER", "SIGN_FOLDER", "PDF_FOLDER", "JOB_FOLDER", "ARCHIVE_FOLDER")}
+        Config.UPLOAD_FOLDER = self.tmpdir / "uploads"
+        Config.SIGN_FOLDER = Config.UPLOAD_FOLDER / "signatures"
+        Config.PDF_FOLDER = Config.UPLOAD_FOLDER / "pdfs"
+        Config.JOB_FOLDER = Config.UPLOAD_FOLDER / "jobs"
+        Config.ARCHIVE_FOLDER = Config.UPLOAD_FOLDER / "archive"
+
+        from app import create_app
+        from models import db, DocumentTemplate
+        self.app = create_app({
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+            "WTF_CSRF_ENABLED": False,
+        })
+        self.client = self.app.test_client()
+        self.client.post("/login", data={"username": "admin", "password": "admin"})
+        with self.app.app_context():
+            tpl = DocumentTemplate(name="Бенчмарк", description="", template_text=SHORT_TEMPLATE)
+            db.session.add(tpl)
+            db.session.commit()
+            self.template_id = tpl.id
+
+        self.signature_path = self.tmpdir / "signature.png"
+        Image.new("RGBA", (1600, 600), (20, 20, 120, 255)).save(self.signature_path)
+
+    def close(self):
+        for name, value in self._saved.items():
+            setattr(Config, name, value)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def _ok(response):
+    """Редирект на /login или ошибка сервера не должны засчитываться как быстрый успех."""
+    status, path = response.status_code, response.request.path
+    response.close()
+    if status != 200:
+        raise RuntimeError(f"{path}: HTTP {status}")
+
+
+def build_scenarios(env, quick=False):
+    """{имя: (функция, итераций, документов за вызов)}; env нужен только при вызове функций."""
+    from types import SimpleNamespace
+    from template_cache import extract_variables, template_cache
+    from utils import create_pdf_from_template
+
+    n = 5 if quick else 30
+    counter = iter(range(10 ** 9))
+
+    def unique(data):
+        # Уникальные данные, чтобы дедупликация по содержимому не подменяла рендеринг
+        return dict(data, ФИО=f"{data.get('ФИО', '')} {next(counter)}")
+
+    def batch_upload(rows):
+        header = "ФИО;факультет;курс"
+        lines = [header] + [f"Студент {next(counter)};ИТ;{i % 4 + 1}" for i in range(rows)]
+        return io.BytesIO("\n".join(lines).encode("utf-8"))
+
+    batch_rows = 20 if quick else 100
+    cached_tpl = SimpleNamespace(id=-1, template_text=LONG_TEMPLATE, last_modified=None)
+    static_tpl = SimpleNamespace(id=-2, template_text=STATIC_TEMPLATE, last_modified=None)
+
+    return {
+        "render_short": (lambda: create_pdf_from_template(SHORT_TEMPLATE, SAMPLE_DATA), n * 3, 1),
+        "render_long": (lambda: create_pdf_from_template(LONG_TEMPLATE, SAMPLE_DATA), n, 1),
+        "render_signature": (lambda: create_pdf_from_template(SHORT_TEMPLATE, SAMPLE_DATA,
+                                                              str(env.signature_path)), n * 3, 1),
+        "render_static": (lambda: create_pdf_from_template(STATIC_TEMPLATE, SAMPLE_DATA), n, 1),
+        "render_static_plan": (lambda: create_pdf_from_template(STATIC_TEMPLATE, SAMPLE_DATA,
+                                                                cached=template_cache.get(static_tpl)), n, 1),
+        "render_many_vars": (lambda: create_pdf_from_template(MANY_VARS_TEMPLATE, MANY_VARS_DATA), n * 3, 1),
+        "variables_uncached": (lambda: extract_variables(LONG_TEMPLATE), n * 20, 1),
+        "variables_cached": (lambda: template_cache.get(cached_tpl).variables, n * 20, 1),
+        "route_single": (lambda: _ok(env.client.post(f"/templates/{env.template_id}/generate",
+                                                     data=unique(SAMPLE_DATA))), n * 2, 1),
+        "route_batch": (lambda: _ok(env.client.post(f"/templates/{env.template_id}/batch",
+                                                    data={"rows_file": (batch_upload(batch_rows), "rows.csv")},
+                                                    content_type="multipart/form-data")),
+                        max(n // 5, 2), batch_rows),
+    }
+
+
+def _print_result(name, r):
+    memory = f"peak RSS {r['peak_rss_mb']} MB" if "peak_rss_mb" in r else f"ΔRSS {r['rss_delta_mb']} MB"
+    print(f"{name:20s} p50 {r['p50_ms']:9.2f} ms  p90 {r['p90_ms']:9.2f} ms  "
+          f"p99 {r['p99_ms']:9.2f} ms  {r['docs_per_sec']:9.2f} docs/s  {memory}", flush=True)
+
+
+def run_scenarios(env, quick=False, only=None, isolated=False):
+    """Сценарии в текущем процессе. isolated — процесс запущен ради одного сценария."""
+    results = {}
+    with env.app.app_context():
+        for name, (fn, iterations, docs_per_call) in build_scenarios(env, quick).items():
+            if only and name not in only:
+                continue
+            results[name] = measure(fn, iterations, docs_per_call, isolated=isolated)
+            _print_result(name, results[name])
+    return results
+
+
+def run_isolated(quick=False, only=None):
+    """Каждый сценарий — в новом процессе, чтобы пиковый RSS относился только к нему."""
+    results = {}
+    for name in build_scenarios(None, quick):
+        if only and name not in only:
+            continue
+        with tempfile.TemporaryDirectory(prefix="edudoc-bench-") as tmp:
+            output = Path(tmp) / "result.json"
+            command = [sys.executable, str(Path(__file__).resolve()), "--child", name, "--output", str(output)]
+            if quick:
+                command.append("--quick")
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            results[name] = json.loads(output.read_text(encoding="utf-8"))
+        _print_result(name, results[name])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Возвращает список регрессий: сценарии, медиана которых выросла больше допуска."""
+    regressions = []
+    for name, current in results.items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if not reference or not reference.get("p50_ms"):
+            continue
+        ratio = current["p50_ms"] / reference["p50_ms"]
+        status = "REGRESSION" if ratio > 1 + tolerance else "ok"
+        print(f"{name:20s} {reference['p50_ms']:9.2f} → {current['p50_ms']:9.2f} ms  ×{ratio:.2f}  {status}")
+        if status != "ok":
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки генерации PDF EduDocHelper")
+    parser.add_argument("--quick", action="store_true", help="меньше итераций")
+    parser.add_argument("--only", nargs="*", help="запустить только указанные сценарии")
+    parser.add_argument("--output", type=Path, help="куда записать результаты (JSON)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="файл эталонных результатов")
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результаты как эталон")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимый рост медианы (0.25 = 25%%)")
+    parser.add_argument("--in-process", action="store_true", help="все сценарии в одном процессе, без пика RSS")
+    parser.add_argument("--child", help=argparse.SUPPRESS)  # один сценарий для run_isolated
+    args = parser.parse_args(argv)
+
+    if args.child:
+        env = BenchEnvironment()
+        try:
+            [result] = run_scenarios(env, quick=args.quick, only=[args.child], isolated=True).values()
+        finally:
+            env.close()
+        args.output.write_text(json.dumps(result), encoding="utf-8")
+        return 0
+
+    if args.in_process:
+        env = BenchEnvironment()
+        try:
+            scenarios = run_scenarios(env, quick=args.quick, only=args.only)
+        finally:
+            env.close()
+    else:
+        scenarios = run_isolated(quick=args.quick, only=args.only)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "quick": args.quick,
+        "isolated": not args.in_process,
+        "render_executor": Config.RENDER_EXECUTOR,
+        "scenarios": scenarios,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Эталон сохранён: {args.baseline}")
+        return 0
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(scenarios, baseline, args.tolerance)
+        if regressions:
+            print(f"Регрессии производительности: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
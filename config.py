@@ -10,11 +10,80 @@ class Config:
     UPLOAD_FOLDER = BASE_DIR / "uploads"
     SIGN_FOLDER = UPLOAD_FOLDER / "signatures"
     PDF_FOLDER = UPLOAD_FOLDER / "pdfs"
+    JOB_FOLDER = UPLOAD_FOLDER / "jobs"
+    ARCHIVE_FOLDER = UPLOAD_FOLDER / "archive"
     INSTANCE_FOLDER = BASE_DIR / "instance"
+    # Подготовка базы при create_app(); в продакшене — 0 и команда `flask provision`
+    AUTO_PROVISION = os.environ.get("AUTO_PROVISION", "1") == "1"
+    SEED_DEMO = os.environ.get("SEED_DEMO", "1") == "1"
+    # Размер страницы в списках шаблонов и документов
+    PER_PAGE = int(os.environ.get("PER_PAGE", 50))
+    # Сколько скомпилированных шаблонов держать в памяти процесса
+    TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", 128))
+    # Сколько предпросмотров (шаблон + введённые данные) помнить
+    PREVIEW_CACHE_SIZE = int(os.environ.get("PREVIEW_CACHE_SIZE", 256))
+    # Разрешение, до которого уменьшаются логотип и подписи перед вставкой в PDF
+    IMAGE_DPI = int(os.environ.get("IMAGE_DPI", 300))
+    # Лимит памяти под декодированные подписи (байты)
+    SIGNATURE_CACHE_MAX_BYTES = int(os.environ.get("SIGNATURE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+    # Ограничения на загружаемую подпись (до обработки)
+    SIGNATURE_MAX_BYTES = int(os.environ.get("SIGNATURE_MAX_BYTES", 20 * 1024 * 1024))
+    SIGNATURE_MAX_PIXELS = int(os.environ.get("SIGNATURE_MAX_PIXELS", 50_000_000))
+    # Пакетная генерация
+    BATCH_MAX_ROWS = int(os.environ.get("BATCH_MAX_ROWS", 5000))
+    BATCH_SPOOL_MAX_BYTES = 16 * 1024 * 1024  # больше — ZIP уходит во временный файл на диске
+    # Исполнитель рендеринга: inline | thread | process (см. executor.py)
+    RENDER_EXECUTOR = os.environ.get("RENDER_EXECUTOR", "inline")
+    RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1))
+    RENDER_MP_CONTEXT = os.environ.get("RENDER_MP_CONTEXT", "spawn")
+    # Дашборд: сколько секунд кешировать сводку и за сколько дней показывать график
+    STATS_CACHE_TTL = int(os.environ.get("STATS_CACHE_TTL", 10))
+    STATS_DAYS = 14
+    # Фоновые задания (см. jobs.py)
+    JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1.0))
+    JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 600))
+    # SQLite: пул соединений на процесс и PRAGMA при подключении (см. database.py)
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_POOL_OVERFLOW = int(os.environ.get("DB_POOL_OVERFLOW", 10))
+    DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+    DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+    DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
+    # Групповая запись документов: одна транзакция на пачку параллельных запросов
+    DB_GROUP_COMMIT = os.environ.get("DB_GROUP_COMMIT", "0") == "1"
+    DB_GROUP_COMMIT_MAX_BATCH = int(os.environ.get("DB_GROUP_COMMIT_MAX_BATCH", 64))
+    DB_GROUP_COMMIT_DELAY_MS = float(os.environ.get("DB_GROUP_COMMIT_DELAY_MS", 2))
+    # Выгрузка истории документов: сколько строк читать из базы за раз
+    EXPORT_BATCH = int(os.environ.get("EXPORT_BATCH", 1000))
+    # Хранение файлов (см. retention.py, команда `flask maintenance`)
+    RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 0))  # 0 — хранить бессрочно
+    ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 90))  # 0 — не архивировать
+    JOB_RESULT_DAYS = int(os.environ.get("JOB_RESULT_DAYS", 7))
+    ORPHAN_GRACE_SECONDS = int(os.environ.get("ORPHAN_GRACE_SECONDS", 3600))
+    MAINTENANCE_BATCH = int(os.environ.get("MAINTENANCE_BATCH", 500))
+    # Скачивание документов (см. delivery.py): срок кеша в браузере и отдача файлов прокси-сервером
+    DOWNLOAD_MAX_AGE = int(os.environ.get("DOWNLOAD_MAX_AGE", 365 * 24 * 3600))
+    SENDFILE_MODE = os.environ.get("SENDFILE_MODE", "")  # "" | x-accel | x-sendfile
+    SENDFILE_PREFIX = os.environ.get("SENDFILE_PREFIX", "/protected/pdfs/")  # internal location nginx
+    # Вход (см. auth.py): метод хеширования паролей, пул проверки и лимит неудачных попыток
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", 2))
+    AUTH_QUEUE_SIZE = int(os.environ.get("AUTH_QUEUE_SIZE", 8))
+    AUTH_TIMEOUT = float(os.environ.get("AUTH_TIMEOUT", 5))
+    LOGIN_WINDOW_SECONDS = int(os.environ.get("LOGIN_WINDOW_SECONDS", 300))
+    LOGIN_MAX_FAILURES = int(os.environ.get("LOGIN_MAX_FAILURES", 5))
+    LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get("LOGIN_MAX_FAILURES_PER_IP", 50))
+    # Число прокси перед приложением: адрес клиента для лимитов берётся из X-Forwarded-For
+    PROXY_COUNT = int(os.environ.get("PROXY_COUNT", 0))
+    # Метрики /metrics и профилирование запросов с заголовком X-Profile: 1 (см. metrics.py)
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+    PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "0") == "1"
+    PROFILE_FOLDER = INSTANCE_FOLDER / "profiles"
+    PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 50))  # старые дампы удаляются
 
     @staticmethod
     def init_app(app):
         # Создаём папки при запуске
-        folders = [Config.INSTANCE_FOLDER, Config.UPLOAD_FOLDER, Config.SIGN_FOLDER, Config.PDF_FOLDER]
+        folders = [Config.INSTANCE_FOLDER, Config.UPLOAD_FOLDER, Config.SIGN_FOLDER, Config.PDF_FOLDER,
+                   Config.JOB_FOLDER, Config.ARCHIVE_FOLDER]
         for folder in folders:
             folder.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
@@ -0,0 +1,176 @@
+# database.py
+"""
+Настройка SQLite для нескольких воркеров gunicorn: WAL (читатели не ждут
+писателя), busy_timeout вместо мгновенного «database is locked», mmap и
+пул соединений на процесс. После fork соединения мастера не используются.
+
+Групповая запись (DB_GROUP_COMMIT=1): записи GeneratedDocument из
+параллельных запросов собирает один поток и вставляет их одной транзакцией,
+так что на пачку документов приходится один fsync и одна блокировка базы.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from config import Config
+from models import db, GeneratedDocument
+
+_engines = []
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def is_memory_database(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(uri):
+    """Параметры create_engine: пул на процесс и таймаут ожидания блокировки для файловой SQLite."""
+    url = make_url(uri)
+    if url.get_backend_name() != "sqlite" or is_memory_database(uri):
+        return {}
+    return {
+        "pool_size": Config.DB_POOL_SIZE,
+        "max_overflow": Config.DB_POOL_OVERFLOW,
+        "pool_timeout": 30,
+        "connect_args": {"timeout": Config.DB_BUSY_TIMEOUT_MS / 1000, "check_same_thread": False},
+    }
+
+
+def sqlite_pragmas(memory=False):
+    pragmas = [
+        ("busy_timeout", Config.DB_BUSY_TIMEOUT_MS),
+        ("synchronous", Config.DB_SYNCHRONOUS),
+        ("temp_store", "MEMORY"),
+    ]
+    if not memory:
+        # WAL и mmap для базы в памяти не применимы
+        pragmas = [("journal_mode", "WAL"), ("mmap_size", Config.DB_MMAP_SIZE)] + pragmas
+    return pragmas
+
+
+def configure_engine(engine):
+    """Вешает на engine установку PRAGMA при каждом новом соединении."""
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = sqlite_pragmas(memory=is_memory_database(str(engine.url)))
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    # Соединения, открытые до установки слушателя, переоткрываются уже с PRAGMA
+    engine.dispose()
+    _engines.append(engine)
+
+
+def init_app(app):
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config["SQLALCHEMY_DATABASE_URI"]))
+    db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine)
+
+
+def dispose_after_fork():
+    """
+    Вызывается в воркере после fork: соединения, унаследованные от мастера,
+    забываются без закрытия (их закроет мастер), воркер откроет свои.
+    """
+    for engine in _engines:
+        engine.dispose(close=False)
+
+
+class GroupCommitWriter:
+    """
+    Поток, вставляющий записи GeneratedDocument пачками. submit() возвращает
+    Future с id вставленной строки; запрос ждёт его, поэтому документ уже
+    в базе, когда пользователь получает ответ.
+    """
+
+    def __init__(self, engine, max_batch=None, max_delay=None):
+        self.engine = engine
+        self.max_batch = max_batch or Config.DB_GROUP_COMMIT_MAX_BATCH
+        self.max_delay = (Config.DB_GROUP_COMMIT_DELAY_MS / 1000) if max_delay is None else max_delay
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        future = Future()
+        self._queue.put((record, future))
+        return future
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Остановка: дописываем собранное, затем выходим
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        table = GeneratedDocument.__table__
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                with self.engine.begin() as conn:
+                    ids = [conn.execute(table.insert().values(record)).inserted_primary_key[0]
+                           for record, _ in batch]
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            for (_, future), row_id in zip(batch, ids):
+                future.set_result(row_id)
+
+
+def get_writer():
+    """Общий для процесса писатель; поток стартует при первой записи (то есть уже после fork)."""
+    global _writer
+    engine = db.engine
+    if _writer is None or _writer.engine is not engine:
+        with _writer_lock:
+            if _writer is None or _writer.engine is not engine:
+                if _writer is not None:
+                    _writer.stop()
+                _writer = GroupCommitWriter(engine)
+    return _writer
+
+
+def insert_document(record):
+    """
+    Сохраняет одну запись GeneratedDocument (словарь значений столбцов) и
+    возвращает её id. С DB_GROUP_COMMIT запись уходит в общую транзакцию.
+    """
+    if Config.DB_GROUP_COMMIT:
+        return get_writer().submit(record).result()
+    row_id = db.session.execute(db.insert(GeneratedDocument).values(record)).inserted_primary_key[0]
+    db.session.commit()
+    return row_id
@@ -0,0 +1,63 @@
+# delivery.py
+"""
+Отдача сгенерированных PDF. Содержимое документа не меняется никогда
+(имя файла — хеш входных данных), поэтому ответ кешируется браузером
+надолго: сильный ETag — content_hash, Last-Modified — created_at,
+Cache-Control: private, immutable. Повторный запрос с If-None-Match или
+If-Modified-Since получает 304 до того, как открывается файл или архив.
+
+SENDFILE_MODE=x-accel (nginx) или x-sendfile (Apache, lighttpd) отдаёт
+файлы из PDF_FOLDER силами прокси: воркер gunicorn возвращает только
+заголовки. Документы из архива (retention.py) отдаёт само приложение.
+"""
+from pathlib import Path
+from urllib.parse import quote
+from flask import Response, request, send_file
+from config import Config
+import storage
+
+
+def document_etag(doc):
+    """Сильный ETag документа. У старых записей без content_hash имя файла — тот же хеш."""
+    return doc.content_hash or Path(doc.filename).stem
+
+
+def _cache_headers(response, doc):
+    response.set_etag(document_etag(doc))
+    if doc.created_at:
+        response.last_modified = doc.created_at
+    response.cache_control.public = None
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.max_age = Config.DOWNLOAD_MAX_AGE
+    response.cache_control.immutable = True
+    response.expires = None
+    return response
+
+
+def _proxy_response(doc, path):
+    response = Response(mimetype="application/pdf")
+    response.headers.set("Content-Disposition", "attachment", filename=doc.filename)
+    if Config.SENDFILE_MODE == "x-accel":
+        response.headers["X-Accel-Redirect"] = Config.SENDFILE_PREFIX + quote(doc.filename)
+    else:
+        response.headers["X-Sendfile"] = str(path.resolve())
+    return response
+
+
+def send_document(doc):
+    """Ответ на скачивание документа; None — файла нет ни на диске, ни в архиве."""
+    validators = _cache_headers(Response(status=200), doc)
+    validators.make_conditional(request)
+    if validators.status_code == 304:
+        return validators
+
+    source = storage.open_pdf(doc)
+    if source is None:
+        return None
+    if Config.SENDFILE_MODE and isinstance(source, Path):
+        return _cache_headers(_proxy_response(doc, source), doc)
+    response = send_file(source, mimetype="application/pdf", as_attachment=True,
+                         download_name=doc.filename, etag=document_etag(doc),
+                         last_modified=doc.created_at, conditional=True)
+    return _cache_headers(response, doc)
@@ -0,0 +1,113 @@
+# docmeta.py
+"""
+Структурированные метаданные документов. Поля JSON-строки meta
+раскладываются триггерами в таблицу document_meta (документ, ключ,
+значение), поэтому отчёты вида «документы по факультетам за месяц» и
+фильтры по полю идут по индексам, без чтения и разбора meta в Python.
+
+Вложенные объекты, массивы и null не индексируются; meta, которая не
+является JSON-объектом, пропускается.
+"""
+import json
+from datetime import datetime
+from sqlalchemy import func, text
+from models import db, DocumentTemplate, DocumentMeta
+from template_cache import extract_variables
+
+
+def _meta_object_sql(expr):
+    # json_type от невалидного JSON — ошибка, поэтому проверки вложены, а не через AND
+    return f"CASE WHEN json_valid({expr}) THEN CASE json_type({expr}) WHEN 'object' THEN {expr} END END"
+
+
+def _insert_sql(row):
+    return f"""
+        INSERT INTO document_meta(document_id, key, value, template_id, created_at)
+        SELECT {row}.id, j.key, j.value, {row}.template_id, {row}.created_at
+        FROM json_each({_meta_object_sql(row + '.meta')}) AS j
+        WHERE j.type NOT IN ('object', 'array', 'null');"""
+
+
+SETUP_STATEMENTS = [
+    f"""CREATE TRIGGER IF NOT EXISTS generated_document_meta_ai AFTER INSERT ON generated_document BEGIN
+        {_insert_sql('NEW')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS generated_document_meta_au
+        AFTER UPDATE OF meta, template_id, created_at ON generated_document BEGIN
+        DELETE FROM document_meta WHERE document_id = OLD.id;
+        {_insert_sql('NEW')}
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS generated_document_meta_ad AFTER DELETE ON generated_document BEGIN
+        DELETE FROM document_meta WHERE document_id = OLD.id;
+    END""",
+]
+
+BACKFILL_STATEMENT = (
+    "INSERT INTO document_meta(document_id, key, value, template_id, created_at) "
+    "SELECT d.id, j.key, j.value, d.template_id, d.created_at "
+    f"FROM generated_document AS d, json_each({_meta_object_sql('d.meta')}) AS j "
+    "WHERE j.type NOT IN ('object', 'array', 'null')"
+)
+
+
+def install():
+    """
+    Создаёт триггеры и один раз заполняет document_meta по уже существующим
+    документам. Шаблонам без сохранённого списка переменных он вычисляется.
+    """
+    with db.engine.begin() as conn:
+        for statement in SETUP_STATEMENTS:
+            conn.execute(text(statement))
+        empty = conn.execute(text("SELECT 1 FROM document_meta LIMIT 1")).first() is None
+        if empty and conn.execute(text("SELECT 1 FROM generated_document LIMIT 1")).first():
+            conn.execute(text(BACKFILL_STATEMENT))
+
+    pending = DocumentTemplate.query.filter(DocumentTemplate.variables.is_(None)).all()
+    for tpl in pending:
+        tpl.variables = json.dumps(extract_variables(tpl.template_text), ensure_ascii=False)
+    if pending:
+        db.session.commit()
+    return len(pending)
+
+
+def month_start(day=None):
+    day = day or datetime.utcnow()
+    return datetime(day.year, day.month, 1)
+
+
+def count_by(key, since=None, until=None, template_id=None, limit=None):
+    """
+    Число документов по значениям поля key за период [since, until):
+    [(значение, число), ...] по убыванию числа. Считается по индексу
+    (key, created_at, value).
+    """
+    count = func.count()
+    query = db.session.query(DocumentMeta.value, count).filter(DocumentMeta.key == key)
+    if since is not None:
+        query = query.filter(DocumentMeta.created_at >= since)
+    if until is not None:
+        query = query.filter(DocumentMeta.created_at < until)
+    if template_id is not None:
+        query = query.filter(DocumentMeta.template_id == template_id)
+    query = query.group_by(DocumentMeta.value).order_by(count.desc(), DocumentMeta.value)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def field_equals(document_id_column, key, value):
+    """Условие «у документа поле key равно value» для фильтра запроса по generated_document."""
+    return db.session.query(DocumentMeta.document_id).filter(
+        DocumentMeta.document_id == document_id_column,
+        DocumentMeta.key == key,
+        DocumentMeta.value == value,
+    ).exists()
+
+
+def template_has_field(template_id_column, key, value):
+    """Условие «есть документ шаблона с полем key, равным value» для фильтра запроса по document_template."""
+    return db.session.query(DocumentMeta.document_id).filter(
+        DocumentMeta.template_id == template_id_column,
+        DocumentMeta.key == key,
+        DocumentMeta.value == value,
+    ).exists()
@@ -0,0 +1,137 @@
+# executor.py
+"""
+Исполнитель рендеринга PDF. reportlab работает на чистом Python и упирается
+в процессор, поэтому для больших объёмов рендеринг выносится в пул процессов.
+
+Режимы (Config.RENDER_EXECUTOR):
+    inline  — в текущем потоке запроса (по умолчанию);
+    thread  — пул потоков (полезен, когда много времени уходит на ввод-вывод);
+    process — пул процессов со шрифтами и логотипом, загруженными при старте.
+"""
+import atexit
+import multiprocessing
+import threading
+from collections import namedtuple, deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from types import SimpleNamespace
+from config import Config
+
+RenderJob = namedtuple("RenderJob", ["template_id", "template_text", "last_modified", "data", "signature_path",
+                                     "output_path"], defaults=[None])
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def job_for(tpl, data, signature_path=None, output_path=None):
+    """Собирает RenderJob из DocumentTemplate. Задание не содержит ORM-объектов и пригодно для pickle."""
+    return RenderJob(tpl.id, tpl.template_text, tpl.last_modified, data, signature_path,
+                     str(output_path) if output_path else None)
+
+
+def render_job(job, progress=None):
+    """
+    Рендерит одно задание. С output_path PDF пишется прямо в файл (атомарно)
+    и возвращается его размер — между процессами не передаются байты документа.
+    Без output_path возвращаются байты PDF. Если data — список строк,
+    все записи рендерятся в один общий PDF, а progress(готово, всего)
+    вызывается после каждой записи.
+    """
+    from template_cache import template_cache
+    from utils import create_pdf_from_template, create_merged_pdf, atomic_write
+    tpl = SimpleNamespace(id=job.template_id, template_text=job.template_text, last_modified=job.last_modified)
+    options = {"cached": template_cache.get(tpl)}
+    if isinstance(job.data, list):
+        render = create_merged_pdf
+        options["progress"] = progress
+    else:
+        render = create_pdf_from_template
+    if job.output_path:
+        with atomic_write(job.output_path) as out:
+            render(job.template_text, job.data, job.signature_path, output=out, **options)
+            return out.tell()
+    buffer = render(job.template_text, job.data, job.signature_path, **options)
+    return buffer.getvalue()
+
+
+def _init_worker():
+    from resources import preload
+    preload()
+
+
+class InlineExecutor:
+    """Выполняет задания сразу в вызывающем потоке, сохраняя интерфейс Executor."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def create_executor(kind=None, workers=None):
+    kind = (kind or Config.RENDER_EXECUTOR).lower()
+    workers = workers or Config.RENDER_WORKERS
+    if kind == "inline":
+        return InlineExecutor()
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render", initializer=_init_worker)
+    if kind == "process":
+        ctx = multiprocessing.get_context(Config.RENDER_MP_CONTEXT)
+        return ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker)
+    raise ValueError(f"Неизвестный режим исполнителя: {kind}")
+
+
+def get_executor():
+    """Общий для процесса исполнитель, создаётся при первом обращении."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = create_executor()
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+atexit.register(shutdown_executor)
+
+
+def render_one(job):
+    return get_executor().submit(render_job, job).result()
+
+
+def render_many(jobs, max_pending=None):
+    """
+    Рендерит задания параллельно и отдаёт (job, результат render_job, error) в исходном порядке.
+    Одновременно в работе не больше max_pending заданий, чтобы готовые PDF
+    не копились в памяти быстрее, чем вызывающий код их сохраняет.
+    """
+    executor = get_executor()
+    max_pending = max_pending or Config.RENDER_WORKERS * 2
+    pending = deque()
+
+    def drain_one():
+        job, future = pending.popleft()
+        try:
+            return job, future.result(), None
+        except Exception as e:
+            return job, None, e
+
+    for job in jobs:
+        pending.append((job, executor.submit(render_job, job)))
+        if len(pending) >= max_pending:
+            yield drain_one()
+    while pending:
+        yield drain_one()
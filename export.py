@@ -0,0 +1,138 @@
+# export.py
+"""
+Выгрузка истории сгенерированных документов в CSV и JSONL.
+
+Строки читаются одним запросом с yield_per (EXPORT_BATCH строк за раз) и
+сразу уходят клиенту пачками, поэтому память не зависит от числа
+документов: ни таблица, ни файл выгрузки целиком в памяти не держатся.
+Поля meta раскладываются по столбцам в порядке переменных шаблона
+(DocumentTemplate.variables); заголовок CSV собирается до первой строки
+из переменных всех шаблонов, попадающих в выгрузку.
+"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from config import Config
+from models import db, DocumentTemplate, GeneratedDocument
+from template_cache import extract_variables
+import docmeta
+
+BASE_COLUMNS = ["id", "created_at", "template_id", "template", "filename"]
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+
+
+class ExportError(ValueError):
+    """Некорректные параметры выгрузки."""
+
+
+class ExportFilter:
+    """Отбор документов: шаблон, период [since, until] по дате создания и поле meta."""
+
+    def __init__(self, template_id=None, since=None, until=None, field=None, value=None):
+        self.template_id = template_id
+        self.since = since
+        self.until = until
+        self.field = field
+        self.value = value
+
+    @classmethod
+    def from_args(cls, args):
+        """Из параметров запроса: template_id, since, until (ГГГГ-ММ-ДД, включительно), field, value."""
+        try:
+            since = datetime.strptime(args["since"], "%Y-%m-%d") if args.get("since") else None
+            until = datetime.strptime(args["until"], "%Y-%m-%d") + timedelta(days=1) if args.get("until") else None
+        except ValueError:
+            raise ExportError("Даты ожидаются в формате ГГГГ-ММ-ДД.")
+        template_id = args.get("template_id")
+        if template_id and not template_id.isdigit():
+            raise ExportError("template_id должен быть числом.")
+        return cls(int(template_id) if template_id else None, since, until,
+                   args.get("field") or None, args.get("value"))
+
+    def apply(self, statement):
+        if self.template_id is not None:
+            statement = statement.where(GeneratedDocument.template_id == self.template_id)
+        if self.since is not None:
+            statement = statement.where(GeneratedDocument.created_at >= self.since)
+        if self.until is not None:
+            statement = statement.where(GeneratedDocument.created_at < self.until)
+        if self.field and self.value is not None:
+            statement = statement.where(docmeta.field_equals(GeneratedDocument.id, self.field, self.value))
+        return statement
+
+
+def template_columns(flt):
+    """
+    {id шаблона: (название, [переменные])} для шаблонов выгрузки и общий
+    список столбцов переменных в порядке шаблонов. Читается только
+    document_template, без обхода документов.
+    """
+    query = db.session.query(DocumentTemplate.id, DocumentTemplate.name, DocumentTemplate.variables,
+                             DocumentTemplate.template_text).order_by(DocumentTemplate.id)
+    if flt.template_id is not None:
+        query = query.filter(DocumentTemplate.id == flt.template_id)
+    templates = {}
+    columns = {}
+    for tpl_id, name, variables, template_text in query:
+        names = json.loads(variables) if variables is not None else extract_variables(template_text)
+        templates[tpl_id] = (name, names)
+        columns.update(dict.fromkeys(names))
+    return templates, list(columns)
+
+
+def _documents(flt):
+    statement = flt.apply(
+        select(GeneratedDocument.id, GeneratedDocument.created_at, GeneratedDocument.template_id,
+               GeneratedDocument.filename, GeneratedDocument.meta)
+        .order_by(GeneratedDocument.id)
+    ).execution_options(yield_per=Config.EXPORT_BATCH)
+    return db.session.execute(statement).partitions()
+
+
+def _record(row, templates):
+    name, variables = templates.get(row.template_id, ("", []))
+    try:
+        meta = json.loads(row.meta) if row.meta else {}
+    except json.JSONDecodeError:
+        meta = {}
+    if not isinstance(meta, dict):
+        meta = {}
+    created_at = row.created_at.isoformat(sep=" ", timespec="seconds") if row.created_at else ""
+    return [row.id, created_at, row.template_id, name, row.filename], variables, meta
+
+
+def stream_csv(flt):
+    """CSV в UTF-8 с BOM (открывается в Excel), одна пачка строк — один фрагмент ответа."""
+    templates, columns = template_columns(flt)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(BASE_COLUMNS + columns)
+    yield "\ufeff" + buffer.getvalue()
+    for partition in _documents(flt):
+        buffer.seek(0)
+        buffer.truncate()
+        for row in partition:
+            base, _, meta = _record(row, templates)
+            writer.writerow(base + [meta.get(column, "") for column in columns])
+        yield buffer.getvalue()
+
+
+def stream_jsonl(flt):
+    """JSON Lines: объект на документ, поля meta — в fields по переменным его шаблона."""
+    templates, _ = template_columns(flt)
+    for partition in _documents(flt):
+        lines = []
+        for row in partition:
+            base, variables, meta = _record(row, templates)
+            record = dict(zip(BASE_COLUMNS, base))
+            record["fields"] = {var: meta.get(var, "") for var in variables}
+            lines.append(json.dumps(record, ensure_ascii=False))
+        yield "\n".join(lines) + "\n"
+
+
+STREAMS = {"csv": stream_csv, "jsonl": stream_jsonl}
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, FileField, PasswordField, SubmitField
-from wtforms.validators import DataRequired
+from wtforms import StringField, TextAreaField, FileField, PasswordField, SubmitField, IntegerField
+from wtforms.validators import DataRequired, NumberRange, Optional
 
 class LoginForm(FlaskForm):
     username = StringField("Логин", validators=[DataRequired()])
@@ -11,4 +11,5 @@ class TemplateForm(FlaskForm):
     name = StringField("Название шаблона", validators=[DataRequired()])
     description = TextAreaField("Описание")
     template_text = TextAreaField("Текст шаблона (используйте {{ переменная }})", validators=[DataRequired()])
+    retention_days = IntegerField("Хранить документы, дней", validators=[Optional(), NumberRange(min=1)])
     submit = SubmitField("Сохранить")
\ No newline at end of file
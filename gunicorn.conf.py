@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+# Синхронный воркер, не ответивший за timeout секунд, перезапускается; потоковая
+# выгрузка (/generated/export) миллиона документов идёт около 30 секунд
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# Приложение загружается в мастер-процессе до fork, поэтому шрифты и логотип,
+# загруженные в when_ready, разделяются воркерами (copy-on-write).
+# Сам create_app() reportlab и Pillow не импортирует — их подгружает preload()
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        from resources import preload
+        preload()
+
+
+def post_fork(server, worker):
+    # Соединения SQLite из мастера воркеру не передаются: у каждого свой пул
+    from database import dispose_after_fork
+    dispose_after_fork()
+    # Без preload_app ресурсы загружаются один раз в каждом воркере
+    from resources import preload
+    preload()
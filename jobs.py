@@ -0,0 +1,139 @@
+# jobs.py
+"""
+Фоновая очередь генерации. Задания лежат в таблице generation_job той же
+SQLite-базы, поэтому переживают перезапуск; обработчик запускается командой
+`flask --app "app:create_app()" worker`.
+"""
+import json
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from config import Config
+from models import db, DocumentTemplate, GenerationJob
+from batch import generate_batch, generate_merged, build_zip
+
+# Как часто обработчик сохраняет прогресс (в строках)
+PROGRESS_EVERY = 25
+
+
+def enqueue(tpl, rows, signature_path=None, merged=False):
+    """
+    Ставит задание в очередь и сразу возвращает его (статус queued).
+    merged — все строки в один PDF вместо ZIP с отдельными документами.
+    """
+    job = GenerationJob(
+        id=uuid.uuid4().hex,
+        template_id=tpl.id,
+        status="queued",
+        payload=json.dumps({"rows": rows, "signature_path": signature_path, "merged": merged},
+                           ensure_ascii=False, default=str),
+        total=len(rows),
+        created_at=datetime.utcnow(),
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def result_path(job):
+    return Config.JOB_FOLDER / job.result_filename if job.result_filename else None
+
+
+def requeue_stale():
+    """Возвращает в очередь задания, обработчик которых перестал подавать признаки жизни."""
+    deadline = datetime.utcnow() - timedelta(seconds=Config.JOB_STALE_SECONDS)
+    count = GenerationJob.query.filter(
+        GenerationJob.status == "running",
+        GenerationJob.heartbeat_at < deadline,
+    ).update({"status": "queued", "processed": 0, "failed": 0}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def claim_next():
+    """Атомарно забирает самое старое задание из очереди. None — очередь пуста."""
+    while True:
+        candidate = (db.session.query(GenerationJob.id)
+                     .filter_by(status="queued")
+                     .order_by(GenerationJob.created_at)
+                     .first())
+        if candidate is None:
+            return None
+        now = datetime.utcnow()
+        # Условие status='queued' защищает от гонки между несколькими обработчиками
+        claimed = GenerationJob.query.filter_by(id=candidate.id, status="queued").update(
+            {"status": "running", "started_at": now, "heartbeat_at": now},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(GenerationJob, candidate.id)
+
+
+def run_job(job):
+    """Выполняет задание: рендерит документы и сохраняет PDF или ZIP как результат."""
+    tpl = db.session.get(DocumentTemplate, job.template_id)
+    if tpl is None:
+        _finish(job, "failed", errors=[[0, "шаблон удалён"]])
+        return job
+
+    payload = json.loads(job.payload)
+
+    def progress(done, total):
+        if done == total or done % PROGRESS_EVERY == 0:
+            job.processed = done
+            job.heartbeat_at = datetime.utcnow()
+            db.session.commit()
+
+    merged = payload.get("merged", False)
+    try:
+        if merged:
+            result = generate_merged(tpl, payload["rows"], payload.get("signature_path"), progress=progress)
+        else:
+            result = generate_batch(tpl, payload["rows"], payload.get("signature_path"), progress=progress)
+    except Exception as e:
+        db.session.rollback()
+        _finish(job, "failed", errors=[[0, str(e)]])
+        return job
+
+    if len(result.documents) == 1 and (merged or not result.errors):
+        # Один документ (или общий PDF всех записей) отдаём как PDF, а не как архив
+        _, pdf_filename = result.documents[0]
+        job.result_filename = f"{job.id}.pdf"
+        shutil.copyfile(Config.PDF_FOLDER / pdf_filename, Config.JOB_FOLDER / job.result_filename)
+    elif result.documents:
+        job.result_filename = f"{job.id}.zip"
+        with open(Config.JOB_FOLDER / job.result_filename, "wb") as archive:
+            build_zip(result, archive)
+
+    job.failed = len(result.errors)
+    _finish(job, "done" if result.documents else "failed", errors=result.errors)
+    return job
+
+
+def _finish(job, status, errors=None):
+    job.status = status
+    job.processed = job.total
+    job.errors = json.dumps(errors or [], ensure_ascii=False)
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def run_worker(once=False, interval=None, log=print):
+    """Цикл обработчика: берёт задания из очереди, пока не остановят (или пока есть работа при once)."""
+    interval = interval or Config.JOB_POLL_INTERVAL
+    requeued = requeue_stale()
+    if requeued:
+        log(f"Возвращено в очередь зависших заданий: {requeued}")
+    while True:
+        job = claim_next()
+        if job is None:
+            if once:
+                return
+            time.sleep(interval)
+            requeue_stale()
+            continue
+        log(f"Задание {job.id}: {job.total} строк")
+        run_job(job)
+        log(f"Задание {job.id}: {job.status}, ошибок {job.failed}")
@@ -0,0 +1,277 @@
+# layout.py
+"""
+Вёрстка текста документа без обращения к canvas: строки разбиваются на
+страницы и позиционированные фрагменты (TextRun), которые затем рисует
+utils.draw_layout.
+
+Ширина каждого слова считается один раз по закешированной таблице ширин
+глифов шрифта, а перенос строк идёт за один проход по словам, поэтому
+длинный абзац верстается за линейное время.
+
+Для шаблона без блоков {% %} строится план (compile_plan): строки без
+переменных отмеряются один раз на версию шаблона, при рендере заново
+верстаются только строки с {{ }}.
+"""
+from collections import namedtuple
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+
+TextRun = namedtuple("TextRun", ["x", "y", "text", "font", "size"])
+
+PageGeometry = namedtuple("PageGeometry", [
+    "width", "height", "left_margin", "right_margin", "top_margin", "bottom_margin",
+    "line_height", "logo_offset",
+])
+
+A4_GEOMETRY = PageGeometry(
+    width=A4[0],
+    height=A4[1],
+    left_margin=25 * mm,
+    right_margin=25 * mm,
+    top_margin=A4[1] - 30 * mm,
+    bottom_margin=30 * mm,
+    line_height=6 * mm,
+    logo_offset=60 * mm,  # текст начинается ниже логотипа
+)
+
+BODY_SIZE = 12
+HEADING_SIZE = 14
+
+
+class Page:
+    """Одна страница: фрагменты текста и признак, нужно ли рисовать логотип."""
+    __slots__ = ("runs", "draw_logo")
+
+    def __init__(self, draw_logo):
+        self.runs = []
+        self.draw_logo = draw_logo
+
+
+class GlyphWidths(dict):
+    """Ширины символов шрифта в единицах 1/1000 кегля; символ измеряется при первом появлении."""
+
+    def __init__(self, font_name):
+        super().__init__()
+        self.font_name = font_name
+
+    def __missing__(self, char):
+        width = pdfmetrics.stringWidth(char, self.font_name, 1000)
+        self[char] = width
+        return width
+
+
+_glyph_widths = {}
+
+
+def glyph_widths(font_name):
+    table = _glyph_widths.get(font_name)
+    if table is None:
+        table = _glyph_widths.setdefault(font_name, GlyphWidths(font_name))
+    return table
+
+
+def text_width(text, font_name, size):
+    widths = glyph_widths(font_name)
+    return sum(widths[c] for c in text) * size / 1000
+
+
+def resolve_fonts():
+    """Имена обычного и жирного шрифта: DejaVu, если зарегистрирован, иначе Helvetica."""
+    registered = set(pdfmetrics.getRegisteredFontNames())
+    regular = "DejaVuSans" if "DejaVuSans" in registered else "Helvetica"
+    bold = "DejaVuSans-Bold" if "DejaVuSans-Bold" in registered else "Helvetica-Bold"
+    return regular, bold
+
+
+def break_words(words, font_name, size, max_width):
+    """
+    Жадный перенос: набирает слова в строку, пока она помещается в max_width.
+    Возвращает список строк. Слово шире строки попадает на отдельную строку,
+    а перед ним, как и в прежней вёрстке, остаётся пустая строка.
+    """
+    widths = glyph_widths(font_name)
+    space = widths[" "]
+    limit = max_width * 1000 / size
+    lines = []
+    current = []
+    current_width = 0.0
+    for word in words:
+        word_width = sum(widths[c] for c in word)
+        candidate = current_width + space + word_width if current else word_width
+        if candidate <= limit:
+            current.append(word)
+            current_width = candidate
+        else:
+            lines.append(" ".join(current))
+            current = [word]
+            current_width = word_width
+    if current:
+        lines.append(" ".join(current))
+    return lines
+
+
+# Отмеренная строка: вид (blank | heading | body), готовые фрагменты строк и их x
+MeasuredLine = namedtuple("MeasuredLine", ["kind", "parts", "x"])
+_BLANK = MeasuredLine("blank", (), 0.0)
+
+
+def measure_line(line, regular, bold, max_width, geometry=A4_GEOMETRY):
+    """
+    Строка вида **Текст** — заголовок жирным 14 pt по центру, остальные — 12 pt
+    от левого поля с переносом по словам. Пустая строка — вертикальный отступ.
+    Положение по вертикали здесь не считается: оно зависит от предыдущих строк.
+    """
+    if not line.strip():
+        return _BLANK
+    line = line.strip()
+    if line.startswith("**") and line.endswith("**"):
+        content = line[2:-2]
+        return MeasuredLine("heading", (content,), (geometry.width - text_width(content, bold, HEADING_SIZE)) / 2)
+    if text_width(line, regular, BODY_SIZE) <= max_width:
+        return MeasuredLine("body", (line,), geometry.left_margin)
+    return MeasuredLine("body", tuple(break_words(line.split(), regular, BODY_SIZE, max_width)), geometry.left_margin)
+
+
+class _Flow:
+    """Расстановка отмеренных строк по страницам сверху вниз."""
+
+    def __init__(self, has_logo, geometry, regular, bold):
+        self.g = geometry
+        self.has_logo = has_logo
+        self.regular = regular
+        self.bold = bold
+        self.first_line_y = geometry.top_margin - geometry.logo_offset if has_logo else geometry.top_margin
+        self.pages = [Page(draw_logo=has_logo)]
+        self.y = self.first_line_y
+
+    def new_page(self, draw_logo):
+        self.pages.append(Page(draw_logo=draw_logo and self.has_logo))
+        self.y = self.first_line_y
+
+    def place(self, measured):
+        g = self.g
+        if measured.kind == "blank":
+            self.y -= g.line_height
+            return
+        runs = self.pages[-1].runs
+        if measured.kind == "heading":
+            runs.append(TextRun(measured.x, self.y, measured.parts[0], self.bold, HEADING_SIZE))
+        else:
+            for i, part in enumerate(measured.parts):
+                if i:
+                    self.y -= g.line_height
+                    if self.y < g.bottom_margin:
+                        # Перенос внутри абзаца: место под логотип остаётся пустым
+                        self.new_page(draw_logo=False)
+                        runs = self.pages[-1].runs
+                if part:
+                    runs.append(TextRun(measured.x, self.y, part, self.regular, BODY_SIZE))
+
+        self.y -= g.line_height
+        if self.y < g.bottom_margin:
+            self.new_page(draw_logo=True)
+
+
+def layout_text(rendered, has_logo, geometry=A4_GEOMETRY):
+    """Раскладывает отрендеренный текст по страницам (правила строк — см. measure_line)."""
+    regular, bold = resolve_fonts()
+    max_width = geometry.width - geometry.left_margin - geometry.right_margin
+    flow = _Flow(has_logo, geometry, regular, bold)
+    for line in rendered.splitlines():
+        flow.place(measure_line(line, regular, bold, max_width, geometry))
+    return flow.pages
+
+
+# ---------- План вёрстки версии шаблона ----------
+
+# Разделитель строк с переменными в общем шаблоне плана; в тексте документа не встречается
+_SEPARATOR = "\x00"
+
+
+class LayoutPlan:
+    """
+    Шаблон, разбитый на строки исходного текста. Строки без {{ }} отмерены
+    и разбиты на фрагменты заранее; строки с переменными собраны в один
+    Jinja-шаблон через разделитель и верстаются при каждом рендере.
+    """
+    __slots__ = ("segments", "regular", "bold", "geometry", "environment", "_dynamic")
+
+    def __init__(self, segments, regular, bold, geometry, environment):
+        self.segments = segments  # [(True, MeasuredLine) | (False, исходная строка с {{ }})]
+        self.regular = regular
+        self.bold = bold
+        self.geometry = geometry
+        self.environment = environment
+        self._dynamic = environment.from_string(
+            _SEPARATOR.join(line for is_static, line in segments if not is_static))
+
+    @property
+    def static_lines(self):
+        return sum(1 for is_static, _ in self.segments if is_static)
+
+    def render(self, data):
+        """Рендерит только строки с переменными; результат передаётся в layout_plan."""
+        sources = [line for is_static, line in self.segments if not is_static]
+        parts = self._dynamic.render(**data).split(_SEPARATOR)
+        if len(parts) != len(sources):
+            # Разделитель оказался в самих данных — рендерим строки по одной
+            parts = [self.environment.from_string(line).render(**data) for line in sources]
+        return parts
+
+
+def compile_plan(template_text, environment, geometry=A4_GEOMETRY):
+    """
+    Строит план вёрстки или возвращает None, если шаблон нельзя верстать
+    построчно: в нём есть блоки {% %}, комментарии {# #}, управление
+    пробелами {{- -}} (съедает перевод строки и склеивает соседние строки)
+    или выражение {{ }}, занимающее несколько строк. Такие шаблоны
+    верстаются целиком.
+    """
+    text = template_text or ""
+    if "{%" in text or "{#" in text or "{{-" in text or "-}}" in text or _SEPARATOR in text:
+        return None
+    regular, bold = resolve_fonts()
+    max_width = geometry.width - geometry.left_margin - geometry.right_margin
+    segments = []
+    for line in text.splitlines():
+        if "{{" not in line:
+            segments.append((True, measure_line(line, regular, bold, max_width, geometry)))
+        elif line.rfind("}}") < line.rfind("{{"):
+            return None
+        else:
+            segments.append((False, line))
+    return LayoutPlan(segments, regular, bold, geometry, environment)
+
+
+def plan_for(compiled, template_text, geometry=A4_GEOMETRY):
+    """
+    План для записи template_cache (CompiledTemplate). Хранится в самой
+    записи, поэтому живёт ровно столько, сколько эта версия шаблона, и
+    исчезает вместе с ней при редактировании. None — план неприменим.
+    """
+    key = (*resolve_fonts(), geometry)
+    try:
+        return compiled.plans[key]
+    except KeyError:
+        return compiled.plans.setdefault(key, compile_plan(template_text, compiled.template.environment, geometry))
+
+
+def layout_plan(plan, rendered, has_logo):
+    """
+    Вёрстка по плану и результату plan.render(data): те же страницы, что
+    layout_text(шаблон.render(data)), но заново отмеряются только строки
+    с переменными.
+    """
+    g = plan.geometry
+    max_width = g.width - g.left_margin - g.right_margin
+    flow = _Flow(has_logo, g, plan.regular, plan.bold)
+    dynamic = iter(rendered)
+    for is_static, item in plan.segments:
+        if is_static:
+            flow.place(item)
+            continue
+        # Значение может содержать переводы строк; пустой результат — пустая строка
+        for line in (next(dynamic) + "\n").splitlines():
+            flow.place(measure_line(line, plan.regular, plan.bold, max_width, g))
+    return flow.pages
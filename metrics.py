@@ -0,0 +1,231 @@
+# metrics.py
+"""
+Метрики процесса в формате Prometheus и профилирование отдельных запросов.
+
+span("layout") замеряет этап генерации и пишет длительность в гистограмму
+edudoc_stage_seconds; счётчики считают документы и записанные байты,
+статистика кешей снимается в момент запроса /metrics. Значения живут в
+памяти процесса: каждый воркер gunicorn отдаёт свои, а этапы, выполненные
+в пуле процессов (RENDER_EXECUTOR=process), в них не попадают.
+
+При METRICS_ENABLED=0 span возвращает общий пустой контекст и ничего не
+замеряет. При PROFILE_REQUESTS=1 запрос вошедшего пользователя с заголовком
+X-Profile: 1 выполняется под cProfile, дамп сохраняется в PROFILE_FOLDER
+(хранятся последние PROFILE_MAX_FILES дампов).
+"""
+import cProfile
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from flask import g, request, session
+from config import Config
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_SPAN = nullcontext()
+enabled = Config.METRICS_ENABLED
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not enabled:
+            return
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # ключ меток -> [счётчики по корзинам..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            return series[-1] if series else 0
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', bound))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', '+Inf'))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+stage_seconds = Histogram("edudoc_stage_seconds", "Длительность этапов генерации документа", labels=("stage",))
+request_seconds = Histogram("edudoc_request_seconds", "Длительность обработки запросов", labels=("endpoint",))
+documents_generated = Counter("edudoc_documents_generated_total", "Сохранённые документы", labels=("source",))
+documents_deduplicated = Counter("edudoc_documents_deduplicated_total",
+                                 "Документы, PDF которых уже был на диске и не рендерился")
+pdf_bytes_written = Counter("edudoc_pdf_bytes_written_total", "Байты PDF, записанные на диск")
+
+auth_seconds = Histogram("edudoc_auth_seconds", "Проверка пароля: ожидание в очереди пула и вычисление хеша",
+                         labels=("phase",))
+logins = Counter("edudoc_logins_total", "Попытки входа по результату", labels=("outcome",))
+
+REGISTRY = [stage_seconds, request_seconds, documents_generated, documents_deduplicated, pdf_bytes_written,
+            auth_seconds, logins]
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stage_seconds.observe(time.perf_counter() - self.started, stage=self.stage)
+        return False
+
+
+def span(stage):
+    """Контекст, замеряющий этап stage; при выключенных метриках — пустой."""
+    return _Span(stage) if enabled else _NULL_SPAN
+
+
+def _cache_lines():
+    from template_cache import template_cache
+    from resources import signature_cache
+    from preview import preview_cache
+    lines = []
+    caches = (("template", template_cache), ("signature", signature_cache), ("preview", preview_cache))
+    for cache_name, cache in caches:
+        stats = cache.stats()
+        prefix = f"edudoc_{cache_name}_cache"
+        lines += [
+            f"# TYPE {prefix}_hits_total counter", f"{prefix}_hits_total {stats['hits']}",
+            f"# TYPE {prefix}_misses_total counter", f"{prefix}_misses_total {stats['misses']}",
+            f"# TYPE {prefix}_entries gauge", f"{prefix}_entries {stats['size']}",
+        ]
+        if "bytes" in stats:
+            lines += [f"# TYPE {prefix}_bytes gauge", f"{prefix}_bytes {stats['bytes']}"]
+    return lines
+
+
+def render_latest():
+    """Все метрики процесса в текстовом формате Prometheus 0.0.4."""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.expose()
+    lines += _cache_lines()
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    for metric in REGISTRY:
+        metric.reset()
+
+
+# ---------- Хуки Flask: время запросов и профилирование ----------
+
+def _before_request():
+    if enabled:
+        g._metrics_started = time.perf_counter()
+    # Только для вошедших пользователей: профилирование замедляет запрос и пишет файл
+    if Config.PROFILE_REQUESTS and request.headers.get("X-Profile") == "1" and session.get("user_id"):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # В этом процессе уже работает другой профилировщик
+            return
+        g._profiler = profiler
+
+
+def _prune_profiles():
+    """Оставляет PROFILE_MAX_FILES самых новых дампов."""
+    dumps = []
+    for path in Config.PROFILE_FOLDER.glob("*.prof"):
+        try:
+            dumps.append((path.stat().st_mtime_ns, path))
+        except FileNotFoundError:
+            continue  # удалён другим воркером
+    dumps.sort(reverse=True)
+    for _, old in dumps[Config.PROFILE_MAX_FILES:]:
+        old.unlink(missing_ok=True)
+
+
+def _after_request(response):
+    profiler = g.pop("_profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        Config.PROFILE_FOLDER.mkdir(parents=True, exist_ok=True)
+        dump_name = f"{request.endpoint or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof"
+        profiler.dump_stats(Config.PROFILE_FOLDER / dump_name)
+        _prune_profiles()
+        response.headers["X-Profile-File"] = dump_name
+    started = g.pop("_metrics_started", None)
+    if started is not None:
+        request_seconds.observe(time.perf_counter() - started, endpoint=request.endpoint or "unknown")
+    return response
+
+
+def init_app(app):
+    global enabled
+    enabled = bool(app.config.get("METRICS_ENABLED", Config.METRICS_ENABLED))
+    app.before_request(_before_request)
+    app.after_request(_after_request)
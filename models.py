@@ -2,7 +2,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-import re
+from sqlalchemy import event
+from template_cache import template_cache, extract_variables
+from config import Config
 import json
 
 db = SQLAlchemy()
@@ -14,7 +16,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(200), nullable=False)
 
     def set_password(self, raw):
-        self.password_hash = generate_password_hash(raw)
+        self.password_hash = generate_password_hash(raw, method=Config.PASSWORD_HASH_METHOD)
 
     def check_password(self, raw):
         return check_password_hash(self.password_hash, raw)
@@ -22,6 +24,13 @@ class User(db.Model):
     def __repr__(self):
         return f"<User {self.username}>"
 
+class LoginThrottle(db.Model):
+    """Неудачные попытки входа в текущем окне по ключу «user:<логин>» или «ip:<адрес>» (см. auth.py)."""
+    __tablename__ = 'login_throttle'
+    key = db.Column(db.String(200), primary_key=True)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    window_started_at = db.Column(db.DateTime, nullable=False, index=True)
+
 class DocumentTemplate(db.Model):
     __tablename__ = 'document_template'
     id = db.Column(db.Integer, primary_key=True)
@@ -30,25 +39,51 @@ class DocumentTemplate(db.Model):
     template_text = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_modified = db.Column(db.DateTime, default=datetime.utcnow)
+    # Сколько дней хранить документы этого шаблона; None — Config.RETENTION_DAYS
+    retention_days = db.Column(db.Integer)
+    # JSON-список переменных в порядке первого появления; пересчитывается при сохранении
+    variables = db.Column(db.Text)
 
     def get_variables(self):
         """
-        Извлекает все переменные из шаблона вида {{ имя_переменной }}.
-        Поддерживает кириллицу, латиницу, цифры и подчёркивания.
+        Переменные шаблона вида {{ имя_переменной }} в порядке появления в тексте.
+        Берутся из столбца variables; для несохранённого шаблона — из кеша.
         """
-        pattern = r"\{\{\s*([a-zA-Zа-яА-ЯёЁ0-9_]+)\s*\}\}"
-        return list(set(re.findall(pattern, self.template_text or "")))
+        if self.variables is not None:
+            return json.loads(self.variables)
+        return list(template_cache.get(self).variables)
+
+    def get_compiled(self):
+        """Возвращает скомпилированный Jinja2-шаблон из кеша процесса."""
+        return template_cache.get(self).template
 
     def __repr__(self):
         return f"<DocumentTemplate {self.name}>"
 
+
+@event.listens_for(DocumentTemplate, "before_insert")
+@event.listens_for(DocumentTemplate, "before_update")
+def _store_template_variables(mapper, connection, target):
+    target.variables = json.dumps(extract_variables(target.template_text), ensure_ascii=False)
+
 class GeneratedDocument(db.Model):
     __tablename__ = 'generated_document'
+    __table_args__ = (
+        # Keyset-пагинация списка документов идёт по (created_at, id)
+        db.Index('ix_generated_document_created_at_id', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     template_id = db.Column(db.Integer, db.ForeignKey("document_template.id"), nullable=False)
-    filename = db.Column(db.String(300), nullable=False)
+    filename = db.Column(db.String(300), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     meta = db.Column(db.Text)  # Храним как JSON-строку
+    # Хеш входных данных (версия шаблона + meta + подпись); одинаковые документы делят один файл
+    content_hash = db.Column(db.String(64), index=True)
+    signature_file = db.Column(db.String(300), index=True)
+    # Архив (относительно ARCHIVE_FOLDER), куда перенесён PDF; None — файл в PDF_FOLDER
+    archived_in = db.Column(db.String(200), index=True)
+
+    template = db.relationship("DocumentTemplate", backref=db.backref("documents", lazy="dynamic"))
 
     @property
     def meta_dict(self):
@@ -59,4 +94,72 @@ class GeneratedDocument(db.Model):
             return {}
 
     def __repr__(self):
-        return f"<GeneratedDocument {self.filename}>"
\ No newline at end of file
+        return f"<GeneratedDocument {self.filename}>"
+
+class GenerationJob(db.Model):
+    """Фоновое задание генерации. Очередь хранится в той же SQLite-базе."""
+    __tablename__ = 'generation_job'
+    id = db.Column(db.String(32), primary_key=True)
+    template_id = db.Column(db.Integer, db.ForeignKey("document_template.id"), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="queued", index=True)  # queued | running | done | failed
+    payload = db.Column(db.Text, nullable=False)  # JSON: строки данных и путь к подписи
+    total = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Text)  # JSON: [[номер строки, ошибка], ...]
+    result_filename = db.Column(db.String(300))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "template_id": self.template_id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "failed": self.failed,
+            "progress": round(100 * self.processed / self.total) if self.total else 0,
+            "errors": json.loads(self.errors) if self.errors else [],
+            "has_result": bool(self.result_filename),
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f"<GenerationJob {self.id} {self.status}>"
+
+
+class DocumentMeta(db.Model):
+    """
+    Поля meta документа по одному на строку, для отчётов и фильтров средствами SQL.
+    Поддерживается триггерами (см. docmeta.py); template_id и created_at
+    скопированы из документа, чтобы отчёт за период не требовал JOIN.
+    """
+    __tablename__ = 'document_meta'
+    __table_args__ = (
+        db.Index('ix_document_meta_key_created_at_value', 'key', 'created_at', 'value'),
+        db.Index('ix_document_meta_key_value', 'key', 'value'),
+    )
+    document_id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(200), primary_key=True)
+    value = db.Column(db.Text)
+    template_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime)
+
+
+class DocumentStatsTotal(db.Model):
+    """Число документов по шаблону. Поддерживается триггерами (см. stats.py)."""
+    __tablename__ = 'document_stats_total'
+    template_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DocumentStatsDaily(db.Model):
+    """Число документов по дням (UTC) и шаблонам. Поддерживается триггерами (см. stats.py)."""
+    __tablename__ = 'document_stats_daily'
+    day = db.Column(db.Date, primary_key=True)
+    template_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
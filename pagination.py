@@ -0,0 +1,86 @@
+# pagination.py
+"""
+Keyset-пагинация: следующая страница выбирается условием «меньше последнего
+показанного ключа», а не OFFSET, поэтому стоимость страницы не зависит
+от размера таблицы и номера страницы.
+"""
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+NULL_CURSOR = "null"
+
+
+def encode_cursor(sort_value, row_id, with_sort_value=True):
+    if not with_sort_value:
+        return str(row_id)
+    if sort_value is None:
+        return f"{NULL_CURSOR}_{row_id}"
+    return f"{sort_value.isoformat()}_{row_id}"
+
+
+def decode_cursor(cursor, with_sort_value):
+    """
+    Разбирает курсор в (значение сортировки, id); значение None — курсор
+    внутри строк с NULL. Для некорректного курсора возвращает None (первая страница).
+    """
+    try:
+        if not with_sort_value:
+            return None, int(cursor)
+        raw_value, raw_id = cursor.rsplit("_", 1)
+        if raw_value == NULL_CURSOR:
+            return None, int(raw_id)
+        return datetime.fromisoformat(raw_value), int(raw_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def paginate_desc(query, id_col, cursor=None, per_page=50, sort_col=None):
+    """
+    Страница query в порядке убывания (sort_col, id_col).
+    sort_col — атрибут модели для сортировки (например created_at);
+    без него сортировка только по id. Строки, где sort_col — NULL, идут
+    после всех остальных по убыванию id. Они выбираются отдельным запросом
+    на последней странице, потому что «sort_col IS NULL» внутри OR лишает
+    SQLite поиска по диапазону индекса.
+    """
+    decoded = decode_cursor(cursor, sort_col is not None) if cursor else None
+    if sort_col is None:
+        if decoded is not None:
+            query = query.filter(id_col < decoded[1])
+        rows = query.order_by(id_col.desc()).limit(per_page + 1).all()
+    else:
+        rows = []
+        in_nulls = decoded is not None and decoded[0] is None
+        if not in_nulls:
+            valued = query.filter(sort_col.isnot(None))
+            if decoded is not None:
+                sort_value, last_id = decoded
+                valued = valued.filter(or_(
+                    sort_col < sort_value,
+                    and_(sort_col == sort_value, id_col < last_id),
+                ))
+            rows = valued.order_by(sort_col.desc(), id_col.desc()).limit(per_page + 1).all()
+        if len(rows) <= per_page:
+            nulls = query.filter(sort_col.is_(None))
+            if in_nulls:
+                nulls = nulls.filter(id_col < decoded[1])
+            rows += nulls.order_by(id_col.desc()).limit(per_page + 1 - len(rows)).all()
+
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        sort_value = getattr(last, sort_col.key) if sort_col is not None else None
+        next_cursor = encode_cursor(sort_value, last.id, with_sort_value=sort_col is not None)
+    return KeysetPage(items, next_cursor)
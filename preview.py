@@ -0,0 +1,113 @@
+# preview.py
+"""
+Серверный предпросмотр документа: шаблон рендерится тем же Jinja и
+раскладывается тем же layout_text, что и PDF, но результат — только
+координаты строк (JSON), без canvas, шрифтов в файле и записи на диск.
+
+Результаты запоминаются в LRU по (версия шаблона, хеш данных), поэтому
+повторный ввод тех же значений не рендерится заново.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from jinja2 import TemplateError
+from config import Config
+from layout import A4_GEOMETRY, layout_text, layout_plan, plan_for
+from resources import register_fonts, get_logo
+from template_cache import template_cache
+
+
+class PreviewError(Exception):
+    """Шаблон не удалось отрендерить (синтаксическая ошибка Jinja и т.п.)."""
+
+
+def placeholder(var):
+    return f"[{var}]"
+
+
+def data_hash(data):
+    return hashlib.sha1(json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def build_preview(compiled, data, has_logo, geometry=A4_GEOMETRY, template_text=None):
+    """
+    Рендерит шаблон и раскладывает текст по страницам. Незаполненные
+    переменные показываются как [имя], чтобы было видно, где они окажутся.
+    С template_text статические строки берутся из плана вёрстки версии.
+    """
+    values = {var: data.get(var) or placeholder(var) for var in compiled.variables}
+    plan = plan_for(compiled, template_text, geometry) if template_text is not None else None
+    try:
+        if plan is not None:
+            pages = layout_plan(plan, plan.render(values), has_logo=has_logo)
+        else:
+            pages = layout_text(compiled.template.render(**values), has_logo=has_logo, geometry=geometry)
+    except TemplateError as e:
+        raise PreviewError(str(e))
+    return {
+        "version": compiled.version,
+        "width": geometry.width,
+        "height": geometry.height,
+        "missing": sorted(var for var in compiled.variables if not data.get(var)),
+        "pages": [
+            {
+                "logo": page.draw_logo,
+                "runs": [{"x": round(run.x, 2), "y": round(run.y, 2), "text": run.text,
+                          "size": run.size, "bold": run.font.endswith("Bold")} for run in page.runs],
+            }
+            for page in pages
+        ],
+    }
+
+
+class PreviewCache:
+    """LRU предпросмотров; ключ — (версия шаблона, хеш введённых данных)."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tpl, data):
+        register_fonts()
+        try:
+            compiled = template_cache.get(tpl)
+        except TemplateError as e:
+            raise PreviewError(str(e))
+        data = {var: str(data.get(var) or "").strip() for var in compiled.variables}
+        key = (compiled.version, data_hash(data))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = build_preview(compiled, data, has_logo=get_logo() is not None, template_text=tpl.template_text)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+preview_cache = PreviewCache(maxsize=Config.PREVIEW_CACHE_SIZE)
@@ -0,0 +1,113 @@
+# provision.py
+"""
+Однократная подготовка базы: таблицы, недостающие столбцы и индексы,
+FTS-индексы, триггеры счётчиков и полей документов, администратор и демо-шаблоны.
+
+В продакшене выполняется отдельной командой до запуска воркеров:
+
+    flask --app "app:create_app()" provision
+
+и create_app() при AUTO_PROVISION=0 базу не трогает. Для локального
+запуска и тестов (AUTO_PROVISION=1) подготовка идёт при создании приложения.
+"""
+import os
+from datetime import datetime
+from models import db, User, DocumentTemplate
+from schema import upgrade_schema
+import search
+import stats
+import docmeta
+
+DEMO_TEMPLATES = [
+    {
+        "name": "Справка об обучении",
+        "description": "Официальная справка для студентов",
+        "template_text": """Справка
+
+Настоящая справка выдана {{ ФИО_студента }} в том, что он(а) является студентом(кой) {{ факультет }} факультета {{ университет }} с {{ дата_поступления }} по настоящее время.
+
+Курс: {{ курс }}
+Форма обучения: {{ форма_обучения }}
+
+Подпись: {{ подпись }}
+"""
+    },
+    {
+        "name": "Благодарственное письмо",
+        "description": "Для преподавателей и сотрудников",
+        "template_text": """Благодарственное письмо
+
+Выражаем искреннюю благодарность {{ ФИО }} за активное участие в организации {{ мероприятие }} и вклад в развитие образовательного процесса.
+
+Желаем дальнейших успехов и профессионального роста!
+
+{{ должность_подписи }}
+{{ ФИО_подписи }}
+{{ дата }}
+"""
+    },
+    {
+        "name": "Приказ о зачислении",
+        "description": "Приказ ректора",
+        "template_text": """ПРИКАЗ
+
+{{ университет }}
+{{ дата }}
+
+О зачислении
+
+Зачислить на {{ курс }} курс {{ факультет }} факультета следующих студентов:
+
+1. {{ ФИО_студента }} — {{ специальность }}
+
+Основание: Приказ Минобрнауки №{{ номер_приказа }}
+
+Ректор: {{ подпись_ректора }}
+"""
+    }
+]
+
+
+def ensure_admin(log=print):
+    """Создаёт пользователя admin, если его нет."""
+    if User.query.filter_by(username="admin").first():
+        return False
+    admin = User(username="admin")
+    admin_pass = os.environ.get("ADMIN_PASSWORD", "admin")
+    admin.set_password(admin_pass)
+    db.session.add(admin)
+    db.session.commit()
+    log(f"✅ Админ создан. Логин: admin, Пароль: {admin_pass}")
+    return True
+
+
+def seed_demo_templates(log=print):
+    """Добавляет демо-шаблоны в пустую базу."""
+    if db.session.query(DocumentTemplate.id).first():
+        return False
+    now = datetime.utcnow()
+    for t in DEMO_TEMPLATES:
+        db.session.add(DocumentTemplate(
+            name=t["name"],
+            description=t["description"],
+            template_text=t["template_text"],
+            created_at=now,
+            last_modified=now,
+        ))
+    db.session.commit()
+    log("✅ Демо-шаблоны добавлены.")
+    return True
+
+
+def provision(seed_demo=True, log=print):
+    """Готовит базу к работе. Повторный запуск безопасен: существующее не меняется."""
+    db.create_all()
+    added = upgrade_schema()
+    if added:
+        log(f"Добавлены столбцы: {', '.join(added)}")
+    search.install()
+    stats.install()
+    docmeta.install()
+    ensure_admin(log)
+    if seed_demo:
+        seed_demo_templates(log)
@@ -0,0 +1,170 @@
+# resources.py
+"""
+Реестр ресурсов для генерации PDF: шрифты и изображения загружаются один раз
+на процесс (или на воркер gunicorn) и переиспользуются между запросами.
+"""
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from PIL import Image
+from config import Config
+
+BASE_DIR = Path(__file__).resolve().parent
+FONT_PATH = BASE_DIR / "fonts" / "DejaVuSans.ttf"
+FONT_BOLD_PATH = BASE_DIR / "fonts" / "DejaVuSans-Bold.ttf"
+FONT_ITALIC_PATH = BASE_DIR / "fonts" / "DejaVuSans-Oblique.ttf"
+LOGO_PATH = BASE_DIR / "static" / "img" / "logo.png"
+
+# Размеры, в которых изображения рисуются на странице
+LOGO_BOX = 50 * mm
+SIGNATURE_MAX_WIDTH = 60 * mm
+
+_lock = threading.Lock()
+_fonts_registered = False
+_logo = None
+_logo_loaded = False
+
+
+def register_fonts():
+    """Регистрирует шрифты DejaVu в reportlab. Повторные вызовы ничего не делают."""
+    global _fonts_registered
+    if _fonts_registered:
+        return
+    with _lock:
+        if _fonts_registered:
+            return
+        try:
+            if FONT_PATH.exists():
+                pdfmetrics.registerFont(TTFont("DejaVuSans", str(FONT_PATH)))
+            # fallback к обычному шрифту, если нет жирного или курсива
+            bold = FONT_BOLD_PATH if FONT_BOLD_PATH.exists() else FONT_PATH
+            pdfmetrics.registerFont(TTFont("DejaVuSans-Bold", str(bold)))
+            italic = FONT_ITALIC_PATH if FONT_ITALIC_PATH.exists() else FONT_PATH
+            pdfmetrics.registerFont(TTFont("DejaVuSans-Italic", str(italic)))
+        except Exception as e:
+            print(f"Ошибка загрузки шрифта: {e}")
+        _fonts_registered = True
+
+
+def _downscale(img, max_width_pt, max_height_pt=None):
+    """Уменьшает изображение до разрешения IMAGE_DPI при заданном размере отрисовки."""
+    max_w_px = int(max_width_pt / 72 * Config.IMAGE_DPI)
+    max_h_px = int((max_height_pt or max_width_pt) / 72 * Config.IMAGE_DPI)
+    if img.width > max_w_px or img.height > max_h_px:
+        img = img.copy()
+        img.thumbnail((max_w_px, max_h_px), Image.LANCZOS)
+    return img
+
+
+def get_logo():
+    """Логотип в виде готового ImageReader или None, если файла нет."""
+    global _logo, _logo_loaded
+    if _logo_loaded:
+        return _logo
+    with _lock:
+        if not _logo_loaded:
+            if LOGO_PATH.exists():
+                with Image.open(LOGO_PATH) as img:
+                    img.load()
+                    _logo = ImageReader(_downscale(img, LOGO_BOX))
+            _logo_loaded = True
+    return _logo
+
+
+def signature_draw_size(width_px, height_px):
+    """Размер подписи на странице (пт): пиксель — пункт, но не шире SIGNATURE_MAX_WIDTH."""
+    scale = min(SIGNATURE_MAX_WIDTH / width_px, 1.0)
+    return width_px * scale, height_px * scale
+
+
+class SignatureImage:
+    """Декодированная подпись и её размер на странице (в пунктах)."""
+    __slots__ = ("reader", "draw_width", "draw_height", "nbytes")
+
+    def __init__(self, reader, draw_width, draw_height, nbytes):
+        self.reader = reader
+        self.draw_width = draw_width
+        self.draw_height = draw_height
+        self.nbytes = nbytes
+
+
+class ImageCache:
+    """LRU-кеш декодированных подписей, ограниченный суммарным размером в байтах."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        path = str(path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self._load(path)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self.current_bytes += entry.nbytes
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                self.current_bytes -= old.nbytes
+        return entry
+
+    @staticmethod
+    def _load(path):
+        with Image.open(path) as img:
+            draw_w, draw_h = signature_draw_size(img.width, img.height)
+            if img.format == "JPEG" and _downscale(img, draw_w, draw_h) is img:
+                # Подготовленная подпись (signatures.py): JPEG встраивается в PDF
+                # как есть, без декодирования и повторного сжатия
+                return SignatureImage(ImageReader(path), draw_w, draw_h, os.path.getsize(path))
+            img.load()
+            scaled = _downscale(img, draw_w, draw_h)
+        nbytes = scaled.width * scaled.height * len(scaled.getbands())
+        return SignatureImage(ImageReader(scaled), draw_w, draw_h, nbytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+signature_cache = ImageCache(max_bytes=Config.SIGNATURE_CACHE_MAX_BYTES)
+
+
+def get_signature(path):
+    return signature_cache.get(path)
+
+
+def preload():
+    """Загружает шрифты и логотип заранее (при старте процесса или воркера)."""
+    register_fonts()
+    get_logo()
@@ -0,0 +1,399 @@
+# retention.py
+"""
+Обслуживание хранилища файлов. Запускается командой
+
+    flask --app "app:create_app()" maintenance
+
+по расписанию (cron, systemd timer). Этапы:
+
+    expire  — удаляет документы старше срока хранения (RETENTION_DAYS или
+              retention_days шаблона) вместе с файлами, на которые больше
+              никто не ссылается;
+    orphans — удаляет из PDF_FOLDER, SIGN_FOLDER и JOB_FOLDER файлы без
+              ссылок в базе, результаты старых фоновых заданий и истёкшие
+              счётчики неудачных входов;
+    archive — переносит PDF, к которым давно не обращались, в сжатые
+              ZIP-сегменты ARCHIVE_FOLDER/<год>/<месяц>/<id>.zip;
+    compact — переписывает сегменты одного месяца, выбрасывая файлы, на
+              которые не осталось ссылок, и сливает мелкие сегменты в
+              сегменты до MAINTENANCE_BATCH файлов.
+
+Каждый этап работает пачками по MAINTENANCE_BATCH записей с отдельной
+транзакцией на пачку, поэтому база не блокируется надолго, а PDF_FOLDER
+содержит только «горячие» файлы. Сегменты архива не дописываются, а
+создаются заново целиком (atomic_write), так что их можно читать во время
+обслуживания.
+"""
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from config import Config
+from models import db, DocumentTemplate, GeneratedDocument, GenerationJob
+import storage
+import stats
+import auth
+
+
+class MaintenanceReport(dict):
+    """Счётчики выполненных действий по этапам: {"expired": 3, "orphans": 10, ...}."""
+
+    def add(self, key, count=1):
+        self[key] = self.get(key, 0) + count
+
+
+def _batches(limit):
+    """Размеры пачек так, чтобы суммарно обработать не больше limit (None — без ограничения)."""
+    size = Config.MAINTENANCE_BATCH
+    remaining = limit
+    while remaining is None or remaining > 0:
+        step = size if remaining is None else min(size, remaining)
+        yield step
+        if remaining is not None:
+            remaining -= step
+
+
+def _release(filenames, signature_files, dry_run):
+    released = 0
+    if dry_run:
+        return released
+    for filename in filenames:
+        released += storage.release_pdf(filename)
+    for signature_file in signature_files:
+        storage.release_signature(signature_file)
+    return released
+
+
+# ---------- Срок хранения ----------
+
+def expire_documents(now=None, limit=None, dry_run=False, report=None):
+    """Удаляет документы старше срока хранения своего шаблона."""
+    report = report if report is not None else MaintenanceReport()
+    now = now or datetime.utcnow()
+    policies = {}
+    for tpl_id, days in db.session.query(DocumentTemplate.id, DocumentTemplate.retention_days):
+        days = days or Config.RETENTION_DAYS
+        if days:
+            policies.setdefault(days, []).append(tpl_id)
+
+    for days, template_ids in sorted(policies.items()):
+        cutoff = now - timedelta(days=days)
+        for size in _batches(limit):
+            rows = (db.session.query(GeneratedDocument.id, GeneratedDocument.filename,
+                                     GeneratedDocument.signature_file)
+                    .filter(GeneratedDocument.template_id.in_(template_ids),
+                            GeneratedDocument.created_at < cutoff)
+                    .order_by(GeneratedDocument.id)
+                    .limit(size)
+                    .all())
+            if not rows:
+                break
+            report.add("expired", len(rows))
+            if dry_run:
+                break
+            GeneratedDocument.query.filter(GeneratedDocument.id.in_([r.id for r in rows])) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+            report.add("files_released", _release({r.filename for r in rows},
+                                                  {r.signature_file for r in rows if r.signature_file}, dry_run))
+            if limit is not None:
+                limit -= len(rows)
+    if report.get("expired") and not dry_run:
+        stats.invalidate()
+    return report
+
+
+# ---------- Файлы без ссылок ----------
+
+def _scan(folder, older_than):
+    """Файлы папки, изменённые раньше older_than (время эпохи). os.scandir не строит список заранее."""
+    if not folder.exists():
+        return
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < older_than:
+                yield entry.name
+
+
+def _chunks(names, size):
+    chunk = []
+    for name in names:
+        chunk.append(name)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _unlink(path, dry_run):
+    if dry_run:
+        return True
+    try:
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def collect_orphans(limit=None, dry_run=False, report=None):
+    """
+    Удаляет файлы, на которые не ссылается ни одна запись. Файлы моложе
+    ORPHAN_GRACE_SECONDS не трогаются: их может прямо сейчас писать
+    генерация, ещё не сохранившая запись GeneratedDocument.
+    """
+    report = report if report is not None else MaintenanceReport()
+    older_than = time.time() - Config.ORPHAN_GRACE_SECONDS
+    budget = limit
+
+    def spend(count):
+        nonlocal budget
+        if budget is not None:
+            budget -= count
+        return budget is not None and budget <= 0
+
+    # Недописанные временные файлы atomic_write и PDF без записей
+    for chunk in _chunks(_scan(Config.PDF_FOLDER, older_than), Config.MAINTENANCE_BATCH):
+        referenced = {name for (name,) in db.session.query(GeneratedDocument.filename)
+                      .filter(GeneratedDocument.filename.in_(chunk)).distinct()}
+        removed = 0
+        for name in chunk:
+            if name in referenced:
+                continue
+            if name.startswith(".") or dry_run:
+                removed += _unlink(Config.PDF_FOLDER / name, dry_run)
+            elif storage.release_pdf(name):
+                # release_pdf ещё раз проверяет ссылки: генерация могла переиспользовать файл
+                removed += 1
+        report.add("orphan_pdfs", removed)
+        if spend(removed):
+            return report
+
+    for chunk in _chunks(_scan(Config.SIGN_FOLDER, older_than), Config.MAINTENANCE_BATCH):
+        referenced = {name for (name,) in db.session.query(GeneratedDocument.signature_file)
+                      .filter(GeneratedDocument.signature_file.in_(chunk)).distinct()}
+        removed = 0
+        for name in chunk:
+            if name in referenced:
+                continue
+            if name.startswith(".") or dry_run:
+                removed += _unlink(Config.SIGN_FOLDER / name, dry_run)
+            elif storage.release_signature(name):
+                # release_signature дополнительно проверяет незавершённые задания
+                removed += 1
+        report.add("orphan_signatures", removed)
+        if spend(removed):
+            return report
+
+    # Результаты заданий: файл без задания или задание, завершённое давно
+    job_cutoff = datetime.utcnow() - timedelta(days=Config.JOB_RESULT_DAYS)
+    for chunk in _chunks(_scan(Config.JOB_FOLDER, older_than), Config.MAINTENANCE_BATCH):
+        keep = {name for (name,) in db.session.query(GenerationJob.result_filename)
+                .filter(GenerationJob.result_filename.in_(chunk),
+                        GenerationJob.finished_at >= job_cutoff)}
+        removed = sum(_unlink(Config.JOB_FOLDER / name, dry_run) for name in chunk if name not in keep)
+        report.add("orphan_job_results", removed)
+        if spend(removed):
+            return report
+
+    if not dry_run:
+        # Записи о старых заданиях больше не нужны: их результат удалён выше
+        deleted = GenerationJob.query.filter(
+            GenerationJob.status.in_(("done", "failed")),
+            GenerationJob.finished_at < job_cutoff,
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        report.add("old_jobs", deleted)
+        report.add("login_throttles", auth.purge_throttles())
+    return report
+
+
+# ---------- Архивирование ----------
+
+def _partition(created_at):
+    return f"{created_at:%Y}/{created_at:%m}"
+
+
+def _write_segment(partition, members):
+    """
+    Пишет новый сегмент архива из {имя в архиве: путь к файлу или (ZipFile, ZipInfo)}.
+    Файлы из других сегментов копируются потоком, целиком в память они не читаются.
+    Возвращает путь сегмента относительно ARCHIVE_FOLDER.
+    """
+    from utils import atomic_write
+    relative = f"{partition}/{uuid.uuid4().hex}.zip"
+    target = Config.ARCHIVE_FOLDER / relative
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(target) as out:
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+            for name, source in members.items():
+                if isinstance(source, tuple):
+                    src_zf, info = source
+                    with src_zf.open(info) as src, \
+                            zf.open(name, "w", force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dst:
+                        shutil.copyfileobj(src, dst)
+                else:
+                    zf.write(source, arcname=name)
+        out.flush()
+        os.fsync(out.fileno())
+    return relative
+
+
+def archive_cold(now=None, limit=None, dry_run=False, report=None):
+    """
+    Переносит в архив PDF, все ссылки на которые старше ARCHIVE_AFTER_DAYS.
+    Файлы группируются по месяцу последнего документа; на пачку и месяц —
+    один новый сегмент.
+    """
+    report = report if report is not None else MaintenanceReport()
+    if not Config.ARCHIVE_AFTER_DAYS:
+        return report
+    cutoff = (now or datetime.utcnow()) - timedelta(days=Config.ARCHIVE_AFTER_DAYS)
+    skipped = set()
+
+    for size in _batches(limit):
+        newest = func.max(GeneratedDocument.created_at)
+        query = (db.session.query(GeneratedDocument.filename, newest)
+                 .filter(GeneratedDocument.archived_in.is_(None))
+                 .group_by(GeneratedDocument.filename)
+                 .having(newest < cutoff))
+        if skipped:
+            query = query.filter(GeneratedDocument.filename.notin_(skipped))
+        rows = query.limit(size).all()
+        if not rows:
+            break
+
+        by_partition = {}
+        for filename, created_at in rows:
+            path = Config.PDF_FOLDER / filename
+            if not path.exists():
+                skipped.add(filename)
+                continue
+            by_partition.setdefault(_partition(created_at), {})[filename] = path
+
+        archived = sum(len(members) for members in by_partition.values())
+        report.add("archived", archived)
+        if dry_run:
+            break
+        for partition, members in by_partition.items():
+            segment = _write_segment(partition, members)
+            GeneratedDocument.query.filter(GeneratedDocument.filename.in_(list(members)),
+                                           GeneratedDocument.archived_in.is_(None)) \
+                .update({"archived_in": segment}, synchronize_session=False)
+            db.session.commit()
+            for filename, path in members.items():
+                before = path.stat().st_size
+                # Документ, созданный после выборки, ссылается на горячую копию — она остаётся
+                if storage.release_archived_pdf(filename):
+                    report.add("bytes_moved", before)
+        if not archived and len(rows) < size:
+            break
+    return report
+
+
+def _segment_state(partition, segment):
+    """(имя сегмента, [живые ZipInfo], число мёртвых файлов) — только по оглавлению архива."""
+    name = f"{partition}/{segment.name}"
+    live_names = {filename for (filename,) in db.session.query(GeneratedDocument.filename)
+                  .filter(GeneratedDocument.archived_in == name).distinct()}
+    with zipfile.ZipFile(segment) as zf:
+        infos = zf.infolist()
+    live = [info for info in infos if info.filename in live_names]
+    return name, live, len(infos) - len(live)
+
+
+def _compaction_groups(states, batch):
+    """
+    Группы сегментов для переписывания: сегменты с мёртвыми файлами и мелкие
+    (меньше половины пачки) сегменты, жадно набранные по MAINTENANCE_BATCH
+    живых файлов. Сегмент без мёртвых файлов в одиночку не переписывается.
+    """
+    candidates = [state for state in states if state[2] or len(state[1]) < batch // 2]
+    groups, group, size = [], [], 0
+    for state in candidates:
+        if group and size + len(state[1]) > batch:
+            groups.append(group)
+            group, size = [], 0
+        group.append(state)
+        size += len(state[1])
+    if group:
+        groups.append(group)
+    return [g for g in groups if len(g) > 1 or g[0][2]]
+
+
+def compact_archives(limit=None, dry_run=False, report=None):
+    """
+    Переписывает сегменты архива, выбрасывая файлы, на которые больше не
+    ссылаются документы, и сливает мелкие сегменты одного месяца. Живые
+    файлы определяются по оглавлению сегмента и копируются потоком по
+    одному, поэтому память не зависит от размера месяца. Новый сегмент
+    содержит не больше MAINTENANCE_BATCH файлов; за запуск копируется не
+    больше limit (по умолчанию MAINTENANCE_BATCH) файлов, остальное
+    доделают следующие запуски.
+    """
+    report = report if report is not None else MaintenanceReport()
+    root = Config.ARCHIVE_FOLDER
+    if not root.exists():
+        return report
+    batch = Config.MAINTENANCE_BATCH
+    budget = limit if limit is not None else batch
+    copied_total = 0
+    partitions = sorted({p.parent.relative_to(root).as_posix() for p in root.glob("*/*/*.zip")})
+    for partition in partitions:
+        segments = sorted((root / partition).glob("*.zip"))
+        states = [_segment_state(partition, segment) for segment in segments]
+        for index, group in enumerate(_compaction_groups(states, batch)):
+            copied = len({info.filename for _, live, _ in group for info in live})
+            # Группа, не влезающая в остаток бюджета, ждёт следующего запуска;
+            # первая группа запуска выполняется всегда, иначе работа встанет
+            if copied and copied_total and copied_total + copied > budget:
+                return report
+            copied_total += copied
+            if index == 0:
+                report.add("compacted_partitions")
+            report.add("compacted_segments", len(group))
+            report.add("dropped_members", sum(dead for _, _, dead in group))
+            report.add("copied_members", copied)
+            if not dry_run:
+                _rewrite_group(root, partition, group)
+            if copied_total >= budget:
+                return report
+    return report
+
+
+def _rewrite_group(root, partition, group):
+    names = [name for name, _, _ in group]
+    archives = [zipfile.ZipFile(root / name) for name in names]
+    try:
+        members = {}
+        for zf, (_, live, _) in zip(archives, group):
+            for info in live:
+                members.setdefault(info.filename, (zf, info))
+        segment = _write_segment(partition, members) if members else None
+    finally:
+        for zf in archives:
+            zf.close()
+    GeneratedDocument.query.filter(GeneratedDocument.archived_in.in_(names)) \
+        .update({"archived_in": segment}, synchronize_session=False)
+    db.session.commit()
+    for name in names:
+        (root / name).unlink()
+
+
+STAGES = {
+    "expire": expire_documents,
+    "orphans": collect_orphans,
+    "archive": archive_cold,
+    "compact": compact_archives,
+}
+
+
+def run_maintenance(stages=None, limit=None, dry_run=False):
+    """Выполняет этапы обслуживания по порядку и возвращает общий отчёт."""
+    report = MaintenanceReport()
+    for name in stages or STAGES:
+        STAGES[name](limit=limit, dry_run=dry_run, report=report)
+    return report
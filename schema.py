@@ -0,0 +1,33 @@
+# schema.py
+"""
+Лёгкие миграции для SQLite: db.create_all() создаёт только новые таблицы,
+а недостающие столбцы и индексы в существующих таблицах добавляются здесь.
+"""
+from sqlalchemy import inspect, text
+from models import db
+
+
+def upgrade_schema():
+    """Добавляет в существующие таблицы столбцы и индексы, объявленные в моделях."""
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                # SQLite умеет добавлять только столбцы без ограничений NOT NULL без default
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'))
+                added.append(f"{table.name}.{column.name}")
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    return added
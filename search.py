@@ -0,0 +1,168 @@
+# search.py
+"""
+Полнотекстовый поиск по шаблонам и метаданным документов на SQLite FTS5.
+Индексы template_fts и document_fts поддерживаются триггерами, поэтому
+остаются согласованными при любых INSERT/UPDATE/DELETE, включая массовые.
+Если SQLite собран без FTS5, поиск откатывается к LIKE.
+"""
+import re
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+from models import db, DocumentTemplate, GeneratedDocument
+from pagination import KeysetPage
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# unicode61 приводит кириллицу к нижнему регистру, но «ё» и «е» считает разными буквами
+TOKENIZER = "unicode61 remove_diacritics 2"
+
+
+def _fold_sql(expr):
+    return f"replace(replace(coalesce({expr}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _meta_values_sql(expr):
+    """Значения JSON-объекта meta одной строкой через пробел."""
+    return (f"(SELECT group_concat(value, ' ') FROM json_each("
+            f"CASE WHEN json_valid({expr}) THEN {expr} ELSE '{{}}' END))")
+
+
+def _template_row_sql(prefix):
+    return (f"{prefix}.id, {_fold_sql(prefix + '.name')}, {_fold_sql(prefix + '.description')}, "
+            f"{_fold_sql(prefix + '.template_text')}")
+
+
+def _document_row_sql(prefix):
+    template_name = f"(SELECT name FROM document_template WHERE id = {prefix}.template_id)"
+    return f"{prefix}.id, {_fold_sql(template_name)}, {_fold_sql(_meta_values_sql(prefix + '.meta'))}"
+
+
+SETUP_STATEMENTS = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS template_fts USING fts5("
+    f"name, description, template_text, tokenize='{TOKENIZER}')",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS document_fts USING fts5("
+    f"template_name, meta_text, tokenize='{TOKENIZER}')",
+
+    f"""CREATE TRIGGER IF NOT EXISTS document_template_fts_ai AFTER INSERT ON document_template BEGIN
+        INSERT INTO template_fts(rowid, name, description, template_text) SELECT {_template_row_sql('NEW')};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS document_template_fts_au
+        AFTER UPDATE OF name, description, template_text ON document_template BEGIN
+        DELETE FROM template_fts WHERE rowid = OLD.id;
+        INSERT INTO template_fts(rowid, name, description, template_text) SELECT {_template_row_sql('NEW')};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS document_template_fts_rename
+        AFTER UPDATE OF name ON document_template WHEN OLD.name IS NOT NEW.name BEGIN
+        UPDATE document_fts SET template_name = {_fold_sql('NEW.name')}
+        WHERE rowid IN (SELECT id FROM generated_document WHERE template_id = NEW.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS document_template_fts_ad AFTER DELETE ON document_template BEGIN
+        DELETE FROM template_fts WHERE rowid = OLD.id;
+    END""",
+
+    f"""CREATE TRIGGER IF NOT EXISTS generated_document_fts_ai AFTER INSERT ON generated_document BEGIN
+        INSERT INTO document_fts(rowid, template_name, meta_text) SELECT {_document_row_sql('NEW')};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS generated_document_fts_au
+        AFTER UPDATE OF template_id, meta ON generated_document BEGIN
+        DELETE FROM document_fts WHERE rowid = OLD.id;
+        INSERT INTO document_fts(rowid, template_name, meta_text) SELECT {_document_row_sql('NEW')};
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS generated_document_fts_ad AFTER DELETE ON generated_document BEGIN
+        DELETE FROM document_fts WHERE rowid = OLD.id;
+    END""",
+]
+
+BACKFILL_STATEMENTS = [
+    ("template_fts", "document_template",
+     f"INSERT INTO template_fts(rowid, name, description, template_text) "
+     f"SELECT {_template_row_sql('t')} FROM document_template AS t"),
+    ("document_fts", "generated_document",
+     f"INSERT INTO document_fts(rowid, template_name, meta_text) "
+     f"SELECT {_document_row_sql('d')} FROM generated_document AS d"),
+]
+
+_available = None
+
+
+def install():
+    """Создаёт FTS-таблицы и триггеры; при первом запуске заполняет индекс из существующих данных."""
+    global _available
+    try:
+        with db.engine.begin() as conn:
+            for statement in SETUP_STATEMENTS:
+                conn.execute(text(statement))
+            for fts_table, source_table, backfill in BACKFILL_STATEMENTS:
+                indexed = conn.execute(text(f"SELECT count(*) FROM {fts_table}")).scalar()
+                if not indexed and conn.execute(text(f"SELECT 1 FROM {source_table} LIMIT 1")).first():
+                    conn.execute(text(backfill))
+        _available = True
+    except OperationalError as e:
+        print(f"Полнотекстовый поиск недоступен, используется LIKE: {e}")
+        _available = False
+    return _available
+
+
+def is_available():
+    """
+    Есть ли FTS-индексы. Если install() в этом процессе не вызывался
+    (база подготовлена командой provision), проверяется наличие таблиц.
+    """
+    global _available
+    if _available is None:
+        try:
+            _available = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'template_fts'")
+            ).first() is not None
+        except OperationalError:
+            _available = False
+    return _available
+
+
+def build_match_query(q):
+    """
+    Превращает пользовательский ввод в выражение FTS5: каждое слово — префиксный
+    поиск, слова объединяются через AND. «иван 3 курс» → "иван"* "3"* "курс"*.
+    """
+    tokens = TOKEN_PATTERN.findall(q.replace("ё", "е").replace("Ё", "Е"))
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def _parse_offset(cursor):
+    try:
+        return max(int(cursor), 0) if cursor else 0
+    except ValueError:
+        return 0
+
+
+def _ranked_ids(fts_table, match, offset, limit):
+    rows = db.session.execute(
+        text(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH :match ORDER BY rank LIMIT :limit OFFSET :offset"),
+        {"match": match, "limit": limit, "offset": offset},
+    )
+    return [row[0] for row in rows]
+
+
+def _ranked_page(model, fts_table, q, cursor, per_page, options=()):
+    match = build_match_query(q)
+    if not match:
+        return KeysetPage([], None)
+    offset = _parse_offset(cursor)
+    ids = _ranked_ids(fts_table, match, offset, per_page + 1)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    by_id = {obj.id: obj for obj in model.query.options(*options).filter(model.id.in_(ids)).all()}
+    items = [by_id[i] for i in ids if i in by_id]
+    return KeysetPage(items, str(offset + per_page) if has_next else None)
+
+
+def search_templates(q, cursor=None, per_page=50):
+    """Шаблоны, упорядоченные по релевантности (bm25), страница с курсором-смещением."""
+    return _ranked_page(DocumentTemplate, "template_fts", q, cursor, per_page)
+
+
+def search_documents(q, cursor=None, per_page=50):
+    """Документы по названию шаблона и значениям meta (ФИО, курс и т.п.), по релевантности."""
+    return _ranked_page(GeneratedDocument, "document_fts", q, cursor, per_page,
+                        options=(joinedload(GeneratedDocument.template),))
@@ -0,0 +1,89 @@
+# signatures.py
+"""
+Подготовка загруженной подписи: проверка, поворот по EXIF, обрезка полей,
+заливка прозрачности белым и уменьшение до IMAGE_DPI при ширине 60 мм.
+Хранится только оптимизированная копия: штриховая подпись — PNG с палитрой,
+фотография — JPEG, который reportlab встраивает в PDF без перекодирования.
+"""
+import io
+from PIL import Image, ImageOps, UnidentifiedImageError
+from config import Config
+from resources import signature_draw_size
+from storage import SignatureError
+
+ALLOWED_FORMATS = ("PNG", "JPEG")
+# Пиксели светлее порога считаются фоном при обрезке
+BACKGROUND_THRESHOLD = 235
+TRIM_PADDING = 8
+# Не больше стольких цветов — сохраняем как PNG с палитрой
+PALETTE_COLORS = 64
+JPEG_QUALITY = 85
+
+
+def _open(raw):
+    if len(raw) > Config.SIGNATURE_MAX_BYTES:
+        raise SignatureError(f"Файл подписи больше {Config.SIGNATURE_MAX_BYTES // (1024 * 1024)} МБ.")
+    try:
+        img = Image.open(io.BytesIO(raw))
+        if img.format not in ALLOWED_FORMATS:
+            raise SignatureError("Подпись должна быть в формате PNG или JPEG.")
+        if img.width * img.height > Config.SIGNATURE_MAX_PIXELS:
+            raise SignatureError("Слишком большое изображение подписи.")
+        img.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise SignatureError(f"Не удалось прочитать изображение подписи: {e}")
+    return img
+
+
+def _flatten(img):
+    """Прозрачные области заливаются белым, результат — RGB."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def _trim(img):
+    """Обрезает светлые поля вокруг подписи, оставляя небольшой отступ."""
+    ink = ImageOps.invert(img.convert("L")).point(lambda v: 255 if v > 255 - BACKGROUND_THRESHOLD else 0)
+    bbox = ink.getbbox()
+    if bbox is None:
+        raise SignatureError("На изображении подписи нет ничего, кроме фона.")
+    left, top, right, bottom = bbox
+    return img.crop((max(left - TRIM_PADDING, 0), max(top - TRIM_PADDING, 0),
+                     min(right + TRIM_PADDING, img.width), min(bottom + TRIM_PADDING, img.height)))
+
+
+def _encode(img):
+    """PNG с палитрой для штриховой подписи, JPEG для фотографии. Возвращает (байты, расширение)."""
+    out = io.BytesIO()
+    if img.getcolors(maxcolors=PALETTE_COLORS) is not None or _is_line_art(img):
+        img.quantize(colors=PALETTE_COLORS).save(out, format="PNG", optimize=True)
+        return out.getvalue(), ".png"
+    img.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return out.getvalue(), ".jpg"
+
+
+def _is_line_art(img):
+    # Почти весь кадр — чистый фон: отсканированная или нарисованная подпись
+    histogram = img.convert("L").histogram()
+    background = sum(histogram[BACKGROUND_THRESHOLD:])
+    return background / (img.width * img.height) > 0.9
+
+
+def preprocess(raw):
+    """
+    Готовит подпись к вставке в PDF. Возвращает (байты, расширение).
+    Бросает SignatureError для файлов, которые не являются PNG/JPEG.
+    """
+    img = _open(raw)
+    img = ImageOps.exif_transpose(img)
+    img = _trim(_flatten(img))
+    draw_w, draw_h = signature_draw_size(img.width, img.height)
+    max_w_px = max(int(draw_w / 72 * Config.IMAGE_DPI), 1)
+    max_h_px = max(int(draw_h / 72 * Config.IMAGE_DPI), 1)
+    if img.width > max_w_px or img.height > max_h_px:
+        img.thumbnail((max_w_px, max_h_px), Image.LANCZOS)
+    return _encode(img)
@@ -1,38 +1,114 @@
-// Обновление предпросмотра в реальном времени
-function updatePreview() {
-    // Получаем исходный шаблон из скрытого элемента или из data-атрибута
-    const previewEl = document.getElementById('preview');
-    if (!previewEl) return;
+// Предпросмотр документа на странице генерации.
+// Вёрстку считает сервер (/templates/<id>/preview) — тем же Jinja и переносом
+// строк, что и PDF. Запрос уходит через PREVIEW_DELAY мс после последнего
+// нажатия клавиши; незавершённый предыдущий запрос отменяется.
+const PREVIEW_DELAY = 300;
 
-    let text = previewEl.dataset.original || previewEl.textContent;
+let previewTimer = null;
+let previewRequest = null;
+
+function collectPreviewData() {
+    const data = {};
+    document.querySelectorAll('#generateForm input[type="text"][name]').forEach(input => {
+        data[input.name] = input.value;
+    });
+    return data;
+}
 
-    // Находим все переменные на странице (по name)
-    const inputs = document.querySelectorAll('input[name], textarea[name]');
-    inputs.forEach(input => {
-        const varName = input.name;
-        const value = input.value || "(пусто)";
-        // Экранируем для регулярки
+// Запасной вариант без сервера: подстановка значений в текст шаблона
+function renderPlainPreview(previewEl, data) {
+    let text = previewEl.dataset.original;
+    Object.entries(data).forEach(([varName, value]) => {
         const escapedVar = varName.replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
         const regex = new RegExp(`{{\\s*${escapedVar}\\s*}}`, 'g');
-        text = text.replace(regex, value);
+        text = text.replace(regex, value || "(пусто)");
     });
-
+    previewEl.classList.remove('preview-layout');
     previewEl.textContent = text;
 }
 
-// Инициализация при загрузке страницы
-document.addEventListener('DOMContentLoaded', function () {
-    // Сохраняем оригинальный текст шаблона
+// Страницы рисуются блоками с пропорциями A4, строки — по координатам из вёрстки PDF
+function renderLayoutPreview(previewEl, layout) {
+    previewEl.classList.add('preview-layout');
+    previewEl.replaceChildren();
+    const scale = previewEl.clientWidth / layout.width;
+    layout.pages.forEach(page => {
+        const pageEl = document.createElement('div');
+        pageEl.className = 'preview-page';
+        pageEl.style.height = `${layout.height * scale}px`;
+        if (page.logo) {
+            const logoEl = document.createElement('div');
+            logoEl.className = 'preview-logo';
+            pageEl.appendChild(logoEl);
+        }
+        page.runs.forEach(run => {
+            const runEl = document.createElement('span');
+            runEl.className = 'preview-run' + (run.bold ? ' fw-bold' : '');
+            runEl.style.left = `${run.x * scale}px`;
+            runEl.style.top = `${(layout.height - run.y - run.size) * scale}px`;
+            runEl.style.fontSize = `${run.size * scale}px`;
+            runEl.textContent = run.text;
+            pageEl.appendChild(runEl);
+        });
+        previewEl.appendChild(pageEl);
+    });
+}
+
+function setPreviewStatus(text, kind) {
+    const statusEl = document.getElementById('previewStatus');
+    if (!statusEl) return;
+    statusEl.textContent = text;
+    statusEl.className = `badge bg-${kind}`;
+}
+
+function updatePreview() {
     const previewEl = document.getElementById('preview');
-    if (previewEl) {
-        previewEl.dataset.original = previewEl.textContent;
-        // Сразу обновляем, если есть данные
-        updatePreview();
+    if (!previewEl) return;
+    const data = collectPreviewData();
+    const url = previewEl.dataset.previewUrl;
+    if (!url || !window.fetch) {
+        renderPlainPreview(previewEl, data);
+        return;
     }
 
-    // Вешаем обработчики на все поля ввода на странице генерации
-    const inputs = document.querySelectorAll('input[name], textarea[name]');
-    inputs.forEach(input => {
-        input.addEventListener('input', updatePreview);
+    if (previewRequest) previewRequest.abort();
+    previewRequest = new AbortController();
+    setPreviewStatus('Обновление…', 'secondary');
+    fetch(url, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json', 'Accept': 'application/json'},
+        body: JSON.stringify({data}),
+        signal: previewRequest.signal,
+    })
+        .then(response => response.json().then(body => ({ok: response.ok, body})))
+        .then(({ok, body}) => {
+            if (!ok) {
+                setPreviewStatus(body.error || 'Ошибка предпросмотра', 'danger');
+                return;
+            }
+            renderLayoutPreview(previewEl, body);
+            setPreviewStatus(body.missing.length ? `Не заполнено: ${body.missing.length}` : 'Готово',
+                             body.missing.length ? 'warning' : 'success');
+        })
+        .catch(error => {
+            if (error.name === 'AbortError') return;
+            renderPlainPreview(previewEl, data);
+            setPreviewStatus('Упрощённый предпросмотр', 'secondary');
+        });
+}
+
+function schedulePreview() {
+    clearTimeout(previewTimer);
+    previewTimer = setTimeout(updatePreview, PREVIEW_DELAY);
+}
+
+document.addEventListener('DOMContentLoaded', function () {
+    const previewEl = document.getElementById('preview');
+    if (!previewEl) return;
+    previewEl.dataset.original = previewEl.textContent;
+
+    document.querySelectorAll('#generateForm input[type="text"][name]').forEach(input => {
+        input.addEventListener('input', schedulePreview);
     });
-});
\ No newline at end of file
+    updatePreview();
+});
@@ -0,0 +1,112 @@
+# stats.py
+"""
+Счётчики для главной страницы. Таблицы document_stats_total и
+document_stats_daily обновляются триггерами при каждой вставке и удалении
+документа, поэтому дашборд не сканирует generated_document. Поверх них —
+короткий кеш в памяти процесса.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, text
+from config import Config
+from models import db, DocumentTemplate, DocumentStatsTotal, DocumentStatsDaily
+
+_DAY_SQL = "coalesce(date({0}.created_at), date('now'))"
+
+
+def _increment_sql(row):
+    return f"""
+        INSERT INTO document_stats_total(template_id, count) VALUES ({row}.template_id, 1)
+            ON CONFLICT(template_id) DO UPDATE SET count = count + 1;
+        INSERT INTO document_stats_daily(day, template_id, count) VALUES ({_DAY_SQL.format(row)}, {row}.template_id, 1)
+            ON CONFLICT(day, template_id) DO UPDATE SET count = count + 1;"""
+
+
+def _decrement_sql(row):
+    return f"""
+        UPDATE document_stats_total SET count = count - 1 WHERE template_id = {row}.template_id;
+        DELETE FROM document_stats_total WHERE template_id = {row}.template_id AND count <= 0;
+        UPDATE document_stats_daily SET count = count - 1
+            WHERE day = {_DAY_SQL.format(row)} AND template_id = {row}.template_id;
+        DELETE FROM document_stats_daily
+            WHERE day = {_DAY_SQL.format(row)} AND template_id = {row}.template_id AND count <= 0;"""
+
+
+SETUP_STATEMENTS = [
+    f"""CREATE TRIGGER IF NOT EXISTS generated_document_stats_ai AFTER INSERT ON generated_document BEGIN
+        {_increment_sql('NEW')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS generated_document_stats_ad AFTER DELETE ON generated_document BEGIN
+        {_decrement_sql('OLD')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS generated_document_stats_au
+        AFTER UPDATE OF template_id, created_at ON generated_document BEGIN
+        {_decrement_sql('OLD')}
+        {_increment_sql('NEW')}
+    END""",
+]
+
+BACKFILL_STATEMENTS = [
+    "INSERT INTO document_stats_total(template_id, count) "
+    "SELECT template_id, count(*) FROM generated_document GROUP BY template_id",
+    f"INSERT INTO document_stats_daily(day, template_id, count) "
+    f"SELECT {_DAY_SQL.format('d')}, d.template_id, count(*) FROM generated_document AS d GROUP BY 1, 2",
+]
+
+_cache = {"expires": 0.0, "value": None}
+_cache_lock = threading.Lock()
+
+
+def install():
+    """Создаёт триггеры; если счётчики пусты, а документы есть — пересчитывает их один раз."""
+    with db.engine.begin() as conn:
+        for statement in SETUP_STATEMENTS:
+            conn.execute(text(statement))
+        empty = conn.execute(text("SELECT 1 FROM document_stats_total LIMIT 1")).first() is None
+        if empty and conn.execute(text("SELECT 1 FROM generated_document LIMIT 1")).first():
+            for statement in BACKFILL_STATEMENTS:
+                conn.execute(text(statement))
+
+
+def invalidate():
+    with _cache_lock:
+        _cache["expires"] = 0.0
+
+
+def _collect(days):
+    today = datetime.utcnow().date()
+    since = today - timedelta(days=days - 1)
+
+    per_template = (db.session.query(DocumentTemplate.id, DocumentTemplate.name,
+                                     func.coalesce(DocumentStatsTotal.count, 0))
+                    .outerjoin(DocumentStatsTotal, DocumentStatsTotal.template_id == DocumentTemplate.id)
+                    .order_by(func.coalesce(DocumentStatsTotal.count, 0).desc(), DocumentTemplate.id)
+                    .all())
+    daily = dict(db.session.query(DocumentStatsDaily.day, func.sum(DocumentStatsDaily.count))
+                 .filter(DocumentStatsDaily.day >= since)
+                 .group_by(DocumentStatsDaily.day)
+                 .all())
+    per_day = [(since + timedelta(days=i), daily.get(since + timedelta(days=i), 0)) for i in range(days)]
+    total = db.session.query(func.coalesce(func.sum(DocumentStatsTotal.count), 0)).scalar()
+
+    return {
+        "templates": len(per_template),
+        "documents": total,
+        "today": per_day[-1][1],
+        "per_template": [{"id": tid, "name": name, "count": count} for tid, name, count in per_template],
+        "per_day": per_day,
+    }
+
+
+def summary(days=None):
+    """Сводка для дашборда; пересчитывается не чаще раза в STATS_CACHE_TTL секунд."""
+    days = days or Config.STATS_DAYS
+    now = time.monotonic()
+    with _cache_lock:
+        if _cache["value"] is not None and _cache["expires"] > now and _cache["days"] == days:
+            return _cache["value"]
+    value = _collect(days)
+    with _cache_lock:
+        _cache.update(value=value, days=days, expires=now + Config.STATS_CACHE_TTL)
+    return value
@@ -0,0 +1,171 @@
+# storage.py
+"""
+Контентно-адресуемое хранилище файлов. Подписи хранятся под хешем своих байтов,
+PDF — под хешем (версия шаблона + данные + подпись). Один и тот же файл
+пишется один раз; удаляется он, только когда на него не ссылается ни одна запись.
+"""
+import hashlib
+import io
+import json
+import os
+import uuid
+import zipfile
+from pathlib import Path
+from config import Config
+from models import db, GeneratedDocument, GenerationJob
+from template_cache import template_cache
+
+SIGNATURE_EXTENSIONS = (".png", ".jpg")
+
+
+class SignatureError(ValueError):
+    """Файл подписи не является допустимым изображением."""
+
+
+def hash_bytes(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+def store_signature(uploaded):
+    """
+    Сохраняет подготовленную копию подписи (см. signatures.preprocess) под
+    именем <sha256 загруженных байтов><расширение копии>. Если подпись с таким
+    хешем уже есть, повторно она не обрабатывается. Возвращает путь или None.
+    Для файла, который не является изображением, бросает SignatureError.
+    """
+    if not uploaded or not uploaded.filename:
+        return None
+    raw = uploaded.read()
+    if not raw:
+        return None
+    digest = hash_bytes(raw)
+    for ext in SIGNATURE_EXTENSIONS:
+        existing = Config.SIGN_FOLDER / f"{digest}{ext}"
+        if existing.exists():
+            return str(existing)
+    # Pillow и reportlab загружаются при первой загрузке подписи, а не при импорте
+    import signatures
+    from utils import atomic_write
+    data, ext = signatures.preprocess(raw)
+    saved = Config.SIGN_FOLDER / f"{digest}{ext}"
+    with atomic_write(saved) as out:
+        out.write(data)
+    return str(saved)
+
+
+def document_key(tpl, data, signature_path=None):
+    """Ключ содержимого PDF: одинаковые входные данные дают одинаковый ключ."""
+    h = hashlib.sha256()
+    h.update(template_cache.get(tpl).version.encode("ascii"))
+    h.update(b"\x00")
+    h.update(json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    h.update(b"\x00")
+    # Имя подписи само является хешем её содержимого
+    h.update(Path(signature_path).name.encode("utf-8") if signature_path else b"")
+    return h.hexdigest()
+
+
+def pdf_filename_for(key):
+    return f"{key}.pdf"
+
+
+def open_pdf(doc):
+    """
+    Возвращает путь к PDF документа или BytesIO с его содержимым, если файл
+    перенесён в архив (см. retention.py). None — файла нет ни там, ни там.
+    """
+    path = Config.PDF_FOLDER / doc.filename
+    if path.exists():
+        return path
+    for _ in range(2):
+        if not doc.archived_in:
+            return None
+        try:
+            with zipfile.ZipFile(Config.ARCHIVE_FOLDER / doc.archived_in) as zf:
+                return io.BytesIO(zf.read(doc.filename))
+        except (FileNotFoundError, KeyError):
+            # Сегмент мог быть только что уплотнён: перечитываем ссылку на архив
+            db.session.refresh(doc)
+    return None
+
+
+def _pdf_referenced(filename, hot_only=False):
+    query = db.session.query(GeneratedDocument.id).filter_by(filename=filename)
+    if hot_only:
+        query = query.filter(GeneratedDocument.archived_in.is_(None))
+    return query.first() is not None
+
+
+def _unlink_unreferenced(path, referenced):
+    """
+    Удаляет файл, если referenced() и после переименования возвращает False.
+    Файл сначала переименовывается, а ссылки проверяются ещё раз в новой
+    транзакции: если документ успел сослаться на файл, он возвращается на место.
+    """
+    # Точка в начале: для collect_orphans это недописанный временный файл
+    doomed = path.with_name(f".{path.name}.{uuid.uuid4().hex}.released")
+    try:
+        os.replace(path, doomed)
+    except FileNotFoundError:
+        return True
+    db.session.commit()  # следующий запрос видит ссылки, записанные после первой проверки
+    if referenced():
+        os.replace(doomed, path)
+        return False
+    doomed.unlink()
+    return True
+
+
+def release_pdf(filename):
+    """
+    Удаляет PDF с диска, если на него больше не ссылается ни один документ.
+    Копия в архиве остаётся до ближайшего уплотнения (retention.compact_archives).
+
+    Генерация находит готовый файл и вставляет ссылку на него без блокировок,
+    поэтому перед удалением ссылки проверяются ещё раз (см. _unlink_unreferenced).
+    Если ссылка появится уже после удаления, генерация сама отрендерит файл
+    заново (см. ensure_pdf).
+    """
+    if not filename:
+        return False
+    if _pdf_referenced(filename):
+        return False
+    return _unlink_unreferenced(Config.PDF_FOLDER / filename, lambda: _pdf_referenced(filename))
+
+
+def release_archived_pdf(filename):
+    """
+    Удаляет горячую копию PDF, перенесённого в архив, если за это время на
+    неё не сослался новый документ (запись без archived_in).
+    """
+    return _unlink_unreferenced(Config.PDF_FOLDER / filename, lambda: _pdf_referenced(filename, hot_only=True))
+
+
+def ensure_pdf(path, render):
+    """
+    Вызывается после сохранения записи документа: если release_pdf удалил
+    файл до того, как запись на него сослалась, рендерит его заново
+    вызовом render(). Возвращает True, если файл пришлось рендерить.
+    """
+    if path.exists():
+        return False
+    render()
+    return True
+
+
+def release_signature(filename):
+    """Удаляет подпись, если на неё не ссылаются документы и незавершённые задания."""
+    if not filename:
+        return False
+    if db.session.query(GeneratedDocument.id).filter_by(signature_file=filename).first():
+        return False
+    active = GenerationJob.query.filter(
+        GenerationJob.status.in_(("queued", "running")),
+        GenerationJob.payload.contains(filename),
+    ).first()
+    if active:
+        return False
+    path = Config.SIGN_FOLDER / filename
+    if path.exists():
+        path.unlink()
+    return True
@@ -0,0 +1,88 @@
+# template_cache.py
+import hashlib
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from jinja2 import Template
+from config import Config
+
+VARIABLE_PATTERN = re.compile(r"\{\{\s*([a-zA-Zа-яА-ЯёЁ0-9_]+)\s*\}\}")
+
+# plans — планы вёрстки этой версии (layout.plan_for), заполняются при первом рендере
+CompiledTemplate = namedtuple("CompiledTemplate", ["version", "template", "variables", "plans"])
+
+
+def extract_variables(template_text):
+    """Извлекает имена переменных вида {{ имя }} из текста шаблона в порядке первого появления."""
+    return list(dict.fromkeys(VARIABLE_PATTERN.findall(template_text or "")))
+
+
+def template_version(template_text, last_modified=None):
+    """Хеш версии шаблона: меняется при любом изменении текста или даты правки."""
+    raw = f"{last_modified or ''}\x00{template_text or ''}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class TemplateCache:
+    """
+    Ограниченный LRU-кеш скомпилированных Jinja2-шаблонов и списков переменных.
+    Для каждого шаблона хранится только последняя версия; ключ — id шаблона,
+    версия — хеш от last_modified и текста.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tpl):
+        """Возвращает CompiledTemplate для объекта DocumentTemplate."""
+        version = template_version(tpl.template_text, tpl.last_modified)
+        key = tpl.id
+        with self._lock:
+            entry = self._entries.get(key) if key is not None else None
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = CompiledTemplate(
+            version=version,
+            template=Template(tpl.template_text or ""),
+            variables=tuple(extract_variables(tpl.template_text)),
+            plans={},
+        )
+        if key is None:
+            return entry
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, template_id):
+        with self._lock:
+            self._entries.pop(template_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+template_cache = TemplateCache(maxsize=Config.TEMPLATE_CACHE_SIZE)
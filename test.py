@@ -1,19 +1,64 @@
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import zipfile
 import unittest
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from sqlalchemy import event
 from app import create_app
-from models import db, User, DocumentTemplate, GeneratedDocument
+from config import Config
+from models import db, User, DocumentTemplate, GeneratedDocument, GenerationJob, DocumentMeta
+from template_cache import template_cache
+from resources import signature_cache
+from utils import create_pdf_from_template
+import executor
+import jobs
+import stats
+import layout
+import metrics
+import database
+import docmeta
+import auth
+from preview import preview_cache
+from resources import register_fonts
+
+TEST_CONFIG = {
+    'TESTING': True,
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+    'WTF_CSRF_ENABLED': False,  # Disable CSRF for test simplicity
+}
+
 
 class EduDocHelperTestCase(unittest.TestCase):
     def setUp(self):
+        # Keep uploads and generated PDFs out of the working tree
+        self._saved_folders = {name: getattr(Config, name)
+                               for name in ('UPLOAD_FOLDER', 'SIGN_FOLDER', 'PDF_FOLDER', 'JOB_FOLDER',
+                                            'ARCHIVE_FOLDER')}
+        self.tmpdir = Path(tempfile.mkdtemp())
+        Config.UPLOAD_FOLDER = self.tmpdir / "uploads"
+        Config.SIGN_FOLDER = Config.UPLOAD_FOLDER / "signatures"
+        Config.PDF_FOLDER = Config.UPLOAD_FOLDER / "pdfs"
+        Config.JOB_FOLDER = Config.UPLOAD_FOLDER / "jobs"
+        Config.ARCHIVE_FOLDER = Config.UPLOAD_FOLDER / "archive"
+        template_cache.clear()
+        stats.invalidate()
+        metrics.reset()
+        preview_cache.clear()
+
         # Create test app and set up test database (in-memory)
-        self.app = create_app()
-        self.app.config['TESTING'] = True
-        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-        self.app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for test simplicity
+        self.app = create_app(TEST_CONFIG)
         self.client = self.app.test_client()
         with self.app.app_context():
             db.create_all()
             # Create default test user
-            admin = User(username="admin")
+            admin = User.query.filter_by(username="admin").first() or User(username="admin")
             admin.set_password("admin")
             db.session.add(admin)
             db.session.commit()
@@ -21,6 +66,9 @@ class EduDocHelperTestCase(unittest.TestCase):
     def tearDown(self):
         with self.app.app_context():
             db.drop_all()
+        for name, value in self._saved_folders.items():
+            setattr(Config, name, value)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
 
     def login(self, username, password):
         return self.client.post('/login', data=dict(
@@ -72,10 +120,894 @@ class EduDocHelperTestCase(unittest.TestCase):
         self.assertTrue(rv.status_code == 200)
         self.assertTrue(rv.content_type in ['application/pdf', 'application/octet-stream'])
 
+    def test_login_is_throttled_and_rehashes_to_configured_method(self):
+        saved = Config.PASSWORD_HASH_METHOD, Config.LOGIN_MAX_FAILURES
+        Config.PASSWORD_HASH_METHOD, Config.LOGIN_MAX_FAILURES = 'pbkdf2:sha256:1000', 3
+        try:
+            # The stored hash uses a different method and is upgraded on the next successful login
+            rv = self.login('admin', 'admin')
+            self.assertIn("Вход выполнен успешно", rv.data.decode("utf-8"))
+            with self.app.app_context():
+                self.assertTrue(User.query.filter_by(username='admin').one()
+                                .password_hash.startswith('pbkdf2:sha256:1000$'))
+            self.logout()
+
+            for _ in range(3):
+                rv = self.login('admin', 'wrong')
+                self.assertIn("Неверный логин или пароль", rv.data.decode("utf-8"))
+            # Even the right password is refused without computing a hash until the window ends
+            rv = self.login('admin', 'admin')
+            self.assertEqual(rv.status_code, 429)
+            self.assertIn('Retry-After', rv.headers)
+            self.assertEqual(metrics.logins.value(outcome='throttled'), 1)
+            self.assertEqual(metrics.auth_seconds.count(phase='hash'), 4)
+        finally:
+            Config.PASSWORD_HASH_METHOD, Config.LOGIN_MAX_FAILURES = saved
+
+    def test_password_checks_are_bounded(self):
+        release = threading.Event()
+        saved = auth._verify
+        auth._verify = lambda *args: (release.wait(5), (False, None))[1]
+        busy = []
+        try:
+            with self.app.app_context():
+                capacity = Config.AUTH_WORKERS + Config.AUTH_QUEUE_SIZE
+                threads = [threading.Thread(target=auth.verify_password, args=(None, 'x'))
+                           for _ in range(capacity)]
+                for t in threads:
+                    t.start()
+                time.sleep(0.2)
+                try:
+                    auth.verify_password(None, 'x')
+                except auth.AuthBusy:
+                    busy.append(True)
+                release.set()
+                for t in threads:
+                    t.join()
+                self.assertEqual(auth.verify_password(None, 'x'), (False, None))
+        finally:
+            auth._verify = saved
+            release.set()
+        self.assertEqual(busy, [True])
+
     def test_access_control(self):
         # Should redirect to login if not authenticated
         rv = self.client.get('/templates', follow_redirects=True)
         self.assertIn("Требуется вход в систему", rv.data.decode("utf-8"))
 
+    def test_template_cache_reuses_compiled_template(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Cached', description='', template_text='Hello, {{ name }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        for name in ('A', 'B', 'C'):
+            self.client.post(f'/templates/{tplid}/generate', data=dict(name=name))
+        stats = template_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertGreaterEqual(stats['hits'], 2)
+
+        # Editing the template must drop the cached version and the stored variables
+        self.client.post(f'/templates/{tplid}/edit', data=dict(
+            name='Cached', description='', template_text='Hi, {{ who }} and {{ whom }}, {{ who }}'
+        ))
+        rv = self.client.get(f'/templates/{tplid}/generate')
+        self.assertIn('whom', rv.data.decode('utf-8'))
+        with self.app.app_context():
+            self.assertEqual(db.session.get(DocumentTemplate, tplid).get_variables(), ['who', 'whom'])
+        self.client.post(f'/templates/{tplid}/generate', data=dict(who='X', whom='Y'))
+        self.assertEqual(template_cache.stats()['misses'], 2)
+
+    def test_signature_decoded_once(self):
+        from PIL import Image
+        sig_path = self.tmpdir / "sig.png"
+        Image.new("RGBA", (2000, 600), (0, 0, 0, 255)).save(sig_path)
+        signature_cache.clear()
+        first = create_pdf_from_template('Hello, {{ name }}', {'name': 'World'}, str(sig_path))
+        second = create_pdf_from_template('Hello, {{ name }}', {'name': 'World'}, str(sig_path))
+        self.assertTrue(first.getvalue().startswith(b'%PDF'))
+        self.assertTrue(second.getvalue().startswith(b'%PDF'))
+        stats = signature_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+        # Stored pixels are downscaled to the 60 mm draw width, not the source size
+        self.assertLess(stats['bytes'], 2000 * 600 * 4)
+
+    def test_signature_upload_is_oriented_trimmed_and_downscaled(self):
+        from PIL import Image, ImageDraw
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Signed', description='', template_text='Hello, {{ name }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        # Portrait phone photo stored sideways with an EXIF rotation, ink in the middle only
+        photo = Image.new('RGB', (3000, 2000), (255, 255, 255))
+        ImageDraw.Draw(photo).rectangle([900, 500, 2099, 1499], fill=(20, 20, 120))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        raw = io.BytesIO()
+        photo.save(raw, format='JPEG', exif=exif)
+        rv = self.client.post(f'/templates/{tplid}/generate', data={
+            'name': 'World',
+            'signature': (io.BytesIO(raw.getvalue()), 'photo.jpg'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(rv.status_code, 200)
+        rv.close()
+        [stored] = list(Config.SIGN_FOLDER.iterdir())
+        self.assertLess(stored.stat().st_size, len(raw.getvalue()))
+        with Image.open(stored) as img:
+            self.assertNotIn('A', img.getbands())
+            # Trimmed to the 1200x1000 ink box, rotated to portrait, 60 mm at IMAGE_DPI
+            self.assertGreater(img.height, img.width)
+            self.assertLessEqual(img.width, round(60 / 25.4 * Config.IMAGE_DPI))
+
+        rv = self.client.post(f'/templates/{tplid}/generate', data={
+            'name': 'World',
+            'signature': (io.BytesIO(b'not an image'), 'sign.png'),
+        }, content_type='multipart/form-data')
+        self.assertIn('Не удалось прочитать изображение подписи', rv.data.decode('utf-8'))
+
+    def test_preview_returns_layout_and_is_memoised(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Preview', description='',
+                                   template_text='**Справка**\n{{ ФИО }} учится на {{ курс }} курсе')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        rv = self.client.post(f'/templates/{tplid}/preview', json={'data': {'ФИО': 'Иванов'}})
+        self.assertEqual(rv.status_code, 200)
+        body = rv.get_json()
+        self.assertEqual(body['missing'], ['курс'])
+        runs = body['pages'][0]['runs']
+        self.assertEqual(runs[0]['text'], 'Справка')
+        self.assertTrue(runs[0]['bold'])
+        self.assertEqual(runs[1]['text'], 'Иванов учится на [курс] курсе')
+
+        self.client.post(f'/templates/{tplid}/preview', json={'data': {'ФИО': 'Иванов'}})
+        self.assertEqual(preview_cache.stats()['hits'], 1)
+        # Preview never creates documents or files
+        with self.app.app_context():
+            self.assertEqual(GeneratedDocument.query.count(), 0)
+        self.assertFalse(Config.PDF_FOLDER.exists() and any(Config.PDF_FOLDER.iterdir()))
+
+        with self.app.app_context():
+            db.session.get(DocumentTemplate, tplid).template_text = '{{ broken'
+            db.session.commit()
+        rv = self.client.post(f'/templates/{tplid}/preview', json={'data': {}})
+        self.assertEqual(rv.status_code, 422)
+        self.logout()
+        rv = self.client.post(f'/templates/{tplid}/preview', json={'data': {}})
+        self.assertEqual(rv.status_code, 401)
+
+    def test_provision_command_prepares_database_once(self):
+        uri = f"sqlite:///{self.tmpdir / 'lazy.sqlite'}"
+        app = create_app(dict(TEST_CONFIG, SQLALCHEMY_DATABASE_URI=uri, AUTO_PROVISION=False))
+        with app.app_context():
+            self.assertNotIn('user', db.inspect(db.engine).get_table_names())
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['provision'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Админ создан', result.output)
+        result = runner.invoke(args=['provision'])
+        self.assertNotIn('Демо-шаблоны добавлены', result.output)
+        with app.app_context():
+            self.assertEqual(User.query.count(), 1)
+            self.assertEqual(DocumentTemplate.query.count(), 3)
+            db.engine.dispose()
+
+    def test_batch_generation_reports_bad_rows(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Batch', description='', template_text='{{ ФИО }}, курс {{ курс }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        csv_data = "ФИО;курс\nИванов И.И.;1\nПетров П.П.;\nСидоров С.С.;3\n".encode('utf-8')
+        rv = self.client.post(f'/templates/{tplid}/batch', data={
+            'rows_file': (io.BytesIO(csv_data), 'rows.csv'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.content_type, 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(rv.data)) as zf:
+            names = zf.namelist()
+            self.assertEqual(len([n for n in names if n.endswith('.pdf')]), 2)
+            self.assertIn('errors.csv', names)
+            self.assertIn('строка', zf.read('errors.csv').decode('utf-8-sig'))
+        with self.app.app_context():
+            self.assertEqual(GeneratedDocument.query.filter_by(template_id=tplid).count(), 2)
+        # CSV в UTF-16 с BOM разбирается, а нераспознаваемая кодировка — сообщение, а не 500
+        rv = self.client.post(f'/templates/{tplid}/batch', data={
+            'rows_file': (io.BytesIO("ФИО;курс\nКузнецов К.К.;2\n".encode('utf-16')), 'rows.csv'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(rv.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(rv.data)) as zf:
+            self.assertEqual(len([n for n in zf.namelist() if n.endswith('.pdf')]), 1)
+            self.assertNotIn('errors.csv', zf.namelist())
+        rv = self.client.post(f'/templates/{tplid}/batch', data={
+            'rows_file': (io.BytesIO(b'\xc6\xc8\xce;\xea\xf3\xf0\xf1\n\x98;1\n'), 'rows.csv'),
+        }, content_type='multipart/form-data', follow_redirects=True)
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn('кодировку CSV', rv.get_data(as_text=True))
+        with self.app.app_context():
+            self.assertEqual(GeneratedDocument.query.filter_by(template_id=tplid).count(), 3)
+        # Повреждённый XLSX — сообщение пользователю, а не 500
+        rv = self.client.post(f'/templates/{tplid}/batch', data={
+            'rows_file': (io.BytesIO(b'not a zip'), 'rows.xlsx'),
+        }, content_type='multipart/form-data', follow_redirects=True)
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn('как CSV', rv.get_data(as_text=True))
+
+    def test_merged_batch_shares_resources_across_records(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Merged', description='', template_text='**Справка**\n{{ ФИО }}, курс {{ курс }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        lines = ['ФИО;курс'] + [f'Студент {i};{i % 4 + 1}' for i in range(40)] + ['Без курса;']
+        rv = self.client.post(f'/templates/{tplid}/batch', data={
+            'rows_file': (io.BytesIO('\n'.join(lines).encode('utf-8')), 'rows.csv'),
+            'output': 'merged',
+        }, content_type='multipart/form-data')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.content_type, 'application/pdf')
+        merged = rv.data
+        rv.close()
+        single = create_pdf_from_template('**Справка**\n{{ ФИО }}, курс {{ курс }}',
+                                          {'ФИО': 'Студент 0', 'курс': '1'}).getvalue()
+        # One page per valid record, but the logo and font subsets are embedded only once
+        self.assertEqual(len(re.findall(rb'/Type /Page\b', merged)), 40)
+        self.assertEqual(merged.count(b'/Subtype /Image'), single.count(b'/Subtype /Image'))
+        self.assertEqual(merged.count(b'/FontFile2'), single.count(b'/FontFile2'))
+        self.assertLess(len(merged), len(single) * 5)
+        with self.app.app_context():
+            docs = GeneratedDocument.query.filter_by(template_id=tplid).all()
+            self.assertEqual(len(docs), 1)
+            self.assertEqual(docs[0].meta_dict['записей'], '40')
+            # Only a bounded sample of values, kept out of the per-field reports
+            self.assertEqual(docs[0].meta_dict['записи']['ФИО'],
+                             'Студент 0; Студент 1; Студент 2; Студент 3; Студент 4; … (+35)')
+            self.assertEqual(docmeta.count_by('ФИО', since=datetime(2000, 1, 1)), [])
+
+            # A background merged job advances its heartbeat while the records render
+            tpl = db.session.get(DocumentTemplate, tplid)
+            job = jobs.enqueue(tpl, [{'ФИО': f'Фон {i}', 'курс': '2'} for i in range(30)], None, merged=True)
+            heartbeats = []
+            def record(mapper, connection, target):
+                if target.status == 'running':
+                    heartbeats.append(target.processed)
+            event.listen(GenerationJob, 'before_update', record)
+            saved = jobs.PROGRESS_EVERY
+            jobs.PROGRESS_EVERY = 10
+            try:
+                jobs.run_worker(once=True, log=lambda msg: None)
+            finally:
+                jobs.PROGRESS_EVERY = saved
+                event.remove(GenerationJob, 'before_update', record)
+            self.assertEqual(heartbeats, [10, 20, 30])
+            self.assertEqual(db.session.get(GenerationJob, job.id).status, 'done')
+
+    def test_render_many_keeps_order_on_thread_pool(self):
+        jobs = [executor.RenderJob(1, 'Номер {{ n }}', None, {'n': str(i)}, None) for i in range(6)]
+        jobs.append(executor.RenderJob(2, '{{ broken', None, {}, None))
+        pool = executor.create_executor('thread', 3)
+        saved, executor._executor = executor._executor, pool
+        try:
+            results = list(executor.render_many(jobs, max_pending=2))
+        finally:
+            executor._executor = saved
+            pool.shutdown()
+        self.assertEqual([job for job, _, _ in results], jobs)
+        self.assertTrue(all(pdf.startswith(b'%PDF') for _, pdf, _ in results[:-1]))
+        self.assertIsNotNone(results[-1][2])
+
+    def test_background_job_lifecycle(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Async', description='', template_text='{{ ФИО }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        rows = '[{"ФИО": "Иванов"}, {"ФИО": "Петров"}, {"ФИО": ""}]'.encode('utf-8')
+        rv = self.client.post(f'/templates/{tplid}/batch', data={
+            'rows_file': (io.BytesIO(rows), 'rows.json'),
+            'background': '1',
+        }, content_type='multipart/form-data')
+        self.assertEqual(rv.status_code, 302)
+        job_url = rv.headers['Location']
+        status = self.client.get(job_url, headers={'Accept': 'application/json'}).get_json()
+        self.assertEqual(status['status'], 'queued')
+        self.assertEqual(status['total'], 3)
+        self.assertEqual(self.client.get(job_url).status_code, 200)
+
+        with self.app.app_context():
+            jobs.run_worker(once=True, log=lambda msg: None)
+        status = self.client.get(job_url, headers={'Accept': 'application/json'}).get_json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['failed'], 1)
+        self.assertEqual(status['progress'], 100)
+        rv = self.client.get(job_url + '/result')
+        self.assertEqual(rv.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(rv.data)) as zf:
+            self.assertEqual(len([n for n in zf.namelist() if n.endswith('.pdf')]), 2)
+
+    def test_generated_pdf_written_to_disk_and_served_by_range(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Stream', description='', template_text='Hello, {{ name }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        rv = self.client.post(f'/templates/{tplid}/generate', data=dict(name='World'))
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(rv.data.startswith(b'%PDF'))
+        # Only the final file is left in the folder, no temporary leftovers
+        files = list(Config.PDF_FOLDER.iterdir())
+        self.assertEqual(len(files), 1)
+        self.assertEqual(files[0].read_bytes(), rv.data)
+
+        with self.app.app_context():
+            doc_id = GeneratedDocument.query.first().id
+        rv = self.client.get(f'/generated/{doc_id}/download', headers={'Range': 'bytes=0-3'})
+        self.assertEqual(rv.status_code, 206)
+        self.assertEqual(rv.data, b'%PDF')
+
+    def test_generated_download_is_cacheable_and_offloadable(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Cache', description='', template_text='Hello, {{ name }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        self.client.post(f'/templates/{tplid}/generate', data=dict(name='World'))
+        with self.app.app_context():
+            doc = GeneratedDocument.query.first()
+            doc_id, content_hash, filename = doc.id, doc.content_hash, doc.filename
+
+        rv = self.client.get(f'/generated/{doc_id}/download')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.headers['ETag'], f'"{content_hash}"')
+        self.assertIn('immutable', rv.headers['Cache-Control'])
+        self.assertIn('private', rv.headers['Cache-Control'])
+        last_modified = rv.headers['Last-Modified']
+
+        # Revalidation does not touch the file: it is answered even after the file is gone
+        (Config.PDF_FOLDER / filename).unlink()
+        rv = self.client.get(f'/generated/{doc_id}/download', headers={'If-None-Match': f'"{content_hash}"'})
+        self.assertEqual(rv.status_code, 304)
+        self.assertEqual(rv.data, b'')
+        rv = self.client.get(f'/generated/{doc_id}/download', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(rv.status_code, 304)
+
+        self.client.post(f'/templates/{tplid}/generate', data=dict(name='World'))
+        Config.SENDFILE_MODE = 'x-accel'
+        try:
+            rv = self.client.get(f'/generated/{doc_id}/download')
+        finally:
+            Config.SENDFILE_MODE = ''
+        self.assertEqual(rv.headers['X-Accel-Redirect'], Config.SENDFILE_PREFIX + filename)
+        self.assertEqual(rv.data, b'')
+        self.assertEqual(rv.headers['ETag'], f'"{content_hash}"')
+
+    def test_identical_inputs_share_one_pdf_and_signature(self):
+        from PIL import Image
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Dedup', description='', template_text='Hello, {{ name }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        sig = io.BytesIO()
+        Image.new("RGB", (100, 40), (0, 0, 0)).save(sig, format="PNG")
+        for _ in range(2):
+            rv = self.client.post(f'/templates/{tplid}/generate', data={
+                'name': 'World',
+                'signature': (io.BytesIO(sig.getvalue()), 'sign.png'),
+            }, content_type='multipart/form-data')
+            self.assertEqual(rv.status_code, 200)
+        self.assertEqual(len(list(Config.PDF_FOLDER.iterdir())), 1)
+        self.assertEqual(len(list(Config.SIGN_FOLDER.iterdir())), 1)
+
+        with self.app.app_context():
+            docs = GeneratedDocument.query.order_by(GeneratedDocument.id).all()
+            self.assertEqual(len(docs), 2)
+            self.assertEqual(docs[0].filename, docs[1].filename)
+            doc_ids = [d.id for d in docs]
+        # The blob survives until the last referencing row is deleted
+        self.client.post(f'/generated/{doc_ids[0]}/delete')
+        self.assertEqual(len(list(Config.PDF_FOLDER.iterdir())), 1)
+        self.client.post(f'/generated/{doc_ids[1]}/delete')
+        self.assertEqual(list(Config.PDF_FOLDER.iterdir()), [])
+        self.assertEqual(list(Config.SIGN_FOLDER.iterdir()), [])
+
+    def test_deduplicated_pdf_survives_concurrent_release(self):
+        import storage
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Race', description='', template_text='Hello, {{ name }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        self.client.post(f'/templates/{tplid}/generate', data={'name': 'World'})
+        with self.app.app_context():
+            doc = GeneratedDocument.query.one()
+            filename, doc_id = doc.filename, doc.id
+        path = Config.PDF_FOLDER / filename
+
+        # release_pdf другого запроса удаляет файл после проверки exists(), но до вставки записи
+        saved = database.insert_document
+
+        def insert_after_release(record):
+            path.unlink()
+            return saved(record)
+        database.insert_document = insert_after_release
+        try:
+            rv = self.client.post(f'/templates/{tplid}/generate', data={'name': 'World'})
+            self.assertEqual(rv.status_code, 200)
+            rv.close()
+        finally:
+            database.insert_document = saved
+        self.assertTrue(path.exists())
+
+        # Ссылка появилась между проверкой и удалением: файл возвращается на место
+        with self.app.app_context():
+            checks = iter([False, True])
+            saved = storage._pdf_referenced
+            storage._pdf_referenced = lambda name: next(checks)
+            try:
+                self.assertFalse(storage.release_pdf(filename))
+            finally:
+                storage._pdf_referenced = saved
+        self.assertEqual(list(Config.PDF_FOLDER.iterdir()), [path])
+        rv = self.client.get(f'/generated/{doc_id}/download')
+        self.assertEqual(rv.status_code, 200)
+        rv.close()
+
+    def test_maintenance_expires_archives_and_collects_orphans(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            kept = DocumentTemplate(name='Kept', description='', template_text='Hello, {{ name }}')
+            short = DocumentTemplate(name='Short', description='', template_text='Bye, {{ name }}',
+                                     retention_days=30)
+            db.session.add_all([kept, short])
+            db.session.commit()
+            kept_id, short_id = kept.id, short.id
+        for tplid, name in ((kept_id, 'Old'), (kept_id, 'New'), (short_id, 'Expired')):
+            rv = self.client.post(f'/templates/{tplid}/generate', data=dict(name=name))
+            self.assertEqual(rv.status_code, 200)
+        with self.app.app_context():
+            docs = {json.loads(d.meta)['name']: d for d in GeneratedDocument.query}
+            docs['Old'].created_at -= timedelta(days=200)
+            docs['Expired'].created_at -= timedelta(days=40)
+            db.session.commit()
+            old_id, old_file = docs['Old'].id, docs['Old'].filename
+            new_file, expired_file = docs['New'].filename, docs['Expired'].filename
+            old_bytes = (Config.PDF_FOLDER / old_file).read_bytes()
+        # A stale file nobody references, and a fresh one that may still be in flight
+        orphan, fresh = Config.PDF_FOLDER / 'orphan.pdf', Config.PDF_FOLDER / 'fresh.pdf'
+        orphan.write_bytes(b'%PDF'), fresh.write_bytes(b'%PDF')
+        hour_ago = datetime.now().timestamp() - 7200
+        os.utime(orphan, (hour_ago, hour_ago))
+
+        result = self.app.test_cli_runner().invoke(args=['maintenance'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(sorted(p.name for p in Config.PDF_FOLDER.iterdir()), sorted([new_file, 'fresh.pdf']))
+        with self.app.app_context():
+            self.assertEqual(GeneratedDocument.query.filter_by(filename=expired_file).count(), 0)
+            archived_in = db.session.get(GeneratedDocument, old_id).archived_in
+        self.assertTrue((Config.ARCHIVE_FOLDER / archived_in).exists())
+
+        # Archived documents are still downloadable
+        rv = self.client.get(f'/generated/{old_id}/download')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.data, old_bytes)
+        rv = self.client.get(f'/generated/{old_id}/download', headers={'Range': 'bytes=0-3'})
+        self.assertEqual((rv.status_code, rv.data), (206, b'%PDF'))
+
+        # Once the last reference is gone, compaction drops the segment
+        self.client.post(f'/generated/{old_id}/delete')
+        result = self.app.test_cli_runner().invoke(args=['maintenance', '--stage', 'compact'])
+        self.assertIn('compacted_partitions: 1', result.output)
+        self.assertEqual(list(Config.ARCHIVE_FOLDER.rglob('*.zip')), [])
+
+    def test_compaction_streams_segments_in_bounded_batches(self):
+        import retention
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Month', description='', template_text='Hello, {{ name }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        for i in range(6):
+            self.client.post(f'/templates/{tplid}/generate', data={'name': f'Student {i}'})
+        saved = Config.MAINTENANCE_BATCH
+        Config.MAINTENANCE_BATCH = 2
+        try:
+            with self.app.app_context():
+                for i, doc in enumerate(GeneratedDocument.query.order_by(GeneratedDocument.id)):
+                    doc.created_at = datetime(2025, 3, 1) + timedelta(hours=i)
+                db.session.commit()
+                self.assertEqual(retention.archive_cold()['archived'], 6)
+                segments = sorted({d.archived_in for d in GeneratedDocument.query})
+                self.assertEqual(len(segments), 3)
+                # One dead member in every segment
+                for name in segments:
+                    doc = GeneratedDocument.query.filter_by(archived_in=name).first()
+                    db.session.delete(doc)
+                db.session.commit()
+                kept = {d.id: d.filename for d in GeneratedDocument.query}
+
+                self.assertEqual(retention.compact_archives(dry_run=True, limit=2)['copied_members'], 2)
+                self.assertEqual(len(list(Config.ARCHIVE_FOLDER.rglob('*.zip'))), 3)
+                # The first run stops after the per-run budget: two segments merged into one
+                report = retention.compact_archives(limit=2)
+                self.assertEqual((report['compacted_segments'], report['copied_members'],
+                                  report['dropped_members']), (2, 2, 2))
+                self.assertEqual(len(list(Config.ARCHIVE_FOLDER.rglob('*.zip'))), 2)
+                report = retention.compact_archives(limit=2)
+                self.assertEqual(report['dropped_members'], 1)
+                self.assertEqual(retention.compact_archives(limit=2), {})
+        finally:
+            Config.MAINTENANCE_BATCH = saved
+        members = []
+        for segment in Config.ARCHIVE_FOLDER.rglob('*.zip'):
+            with zipfile.ZipFile(segment) as zf:
+                members += zf.namelist()
+        self.assertEqual(sorted(members), sorted(kept.values()))
+        for doc_id in kept:
+            rv = self.client.get(f'/generated/{doc_id}/download')
+            self.assertEqual(rv.status_code, 200)
+            self.assertTrue(rv.data.startswith(b'%PDF'))
+
+    def test_archive_keeps_hot_copy_referenced_during_archiving(self):
+        import retention
+        import storage
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Cold', description='', template_text='Hello, {{ name }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        self.client.post(f'/templates/{tplid}/generate', data={'name': 'Old'})
+        with self.app.app_context():
+            doc = GeneratedDocument.query.one()
+            doc.created_at -= timedelta(days=200)
+            db.session.commit()
+            filename = doc.filename
+
+            # Generation reuses the file after the archive segment is written
+            saved = storage.release_archived_pdf
+            def release_after_reuse(name):
+                db.session.add(GeneratedDocument(template_id=tplid, filename=name, meta='{}'))
+                db.session.commit()
+                return saved(name)
+            storage.release_archived_pdf = release_after_reuse
+            try:
+                report = retention.archive_cold()
+            finally:
+                storage.release_archived_pdf = saved
+        self.assertEqual(report['archived'], 1)
+        self.assertNotIn('bytes_moved', report)
+        self.assertTrue((Config.PDF_FOLDER / filename).exists())
+
+    def test_meta_fields_indexed_for_reports(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Report', description='',
+                                   template_text='{{ ФИО }}, {{ факультет }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        for fio, faculty in (('Иванов', 'ФИТ'), ('Петров', 'ФИТ'), ('Сидоров', 'Экономический')):
+            self.client.post(f'/templates/{tplid}/generate', data={'ФИО': fio, 'факультет': faculty})
+        with self.app.app_context():
+            last_month = GeneratedDocument.query.filter(
+                GeneratedDocument.id == db.session.query(db.func.max(GeneratedDocument.id)).scalar_subquery()
+            ).one()
+            last_month.created_at = docmeta.month_start() - timedelta(days=1)
+            db.session.commit()
+
+        rv = self.client.get('/reports/fields/факультет')
+        self.assertEqual(rv.get_json()['counts'], [{'value': 'ФИТ', 'count': 2}])
+        rv = self.client.get('/reports/fields/факультет?since=2000-01-01')
+        self.assertEqual([c['count'] for c in rv.get_json()['counts']], [2, 1])
+
+        with self.app.app_context():
+            petrov_id = GeneratedDocument.query.filter(GeneratedDocument.meta.contains('Петров')).one().id
+        rv = self.client.get('/generated?field=ФИО&value=Петров')
+        self.assertEqual(re.findall(r'/generated/(\d+)/download', rv.data.decode('utf-8')), [str(petrov_id)])
+        # The template list keeps only templates that have such a document
+        rv = self.client.get('/templates?field=ФИО&value=Петров')
+        self.assertEqual(re.findall(r'/templates/(\d+)/generate', rv.data.decode('utf-8')), [str(tplid)])
+        rv = self.client.get('/templates?field=ФИО&value=Никто')
+        self.assertEqual(re.findall(r'/templates/(\d+)/generate', rv.data.decode('utf-8')), [])
+
+        # Deleting a document removes its fields; the backfill rebuilds them for old databases
+        with self.app.app_context():
+            GeneratedDocument.query.filter(GeneratedDocument.meta.contains('Петров')).delete()
+            db.session.commit()
+            self.assertEqual(docmeta.count_by('ФИО', since=datetime(2000, 1, 1))[0][1], 1)
+            DocumentMeta.query.delete()
+            db.session.commit()
+            docmeta.install()
+            self.assertEqual(DocumentMeta.query.count(), 4)
+
+    def test_export_streams_csv_and_jsonl_with_filters(self):
+        import csv
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            cert = DocumentTemplate(name='Справка', description='', template_text='{{ ФИО }} {{ курс }} {{ ФИО }}')
+            other = DocumentTemplate(name='Другой', description='', template_text='{{ тема }}')
+            db.session.add_all([cert, other])
+            db.session.commit()
+            now = datetime.utcnow()
+            db.session.execute(db.insert(GeneratedDocument), [
+                {'template_id': cert.id, 'filename': 'a.pdf', 'created_at': now,
+                 'meta': json.dumps({'ФИО': 'Иванов, И.', 'курс': '2'}, ensure_ascii=False)},
+                {'template_id': cert.id, 'filename': 'b.pdf', 'created_at': now - timedelta(days=40),
+                 'meta': json.dumps({'ФИО': 'Петров', 'курс': '3'}, ensure_ascii=False)},
+                {'template_id': other.id, 'filename': 'c.pdf', 'created_at': now, 'meta': '{"тема": "x"}'},
+            ])
+            db.session.commit()
+            cert_id = cert.id
+
+        since = (datetime.utcnow() - timedelta(days=7)).strftime('%Y-%m-%d')
+        rv = self.client.get(f'/generated/export.csv?template_id={cert_id}&since={since}')
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(rv.is_streamed)
+        rows = list(csv.reader(io.StringIO(rv.data.decode('utf-8-sig'))))
+        self.assertEqual(rows[0], ['id', 'created_at', 'template_id', 'template', 'filename', 'ФИО', 'курс'])
+        self.assertEqual([r[4:] for r in rows[1:]], [['a.pdf', 'Иванов, И.', '2']])
+
+        rv = self.client.get('/generated/export?format=jsonl')
+        records = [json.loads(line) for line in rv.data.decode('utf-8').splitlines()]
+        self.assertEqual([r['filename'] for r in records], ['a.pdf', 'b.pdf', 'c.pdf'])
+        self.assertEqual(records[2]['fields'], {'тема': 'x'})
+        self.assertEqual(records[1]['template'], 'Справка')
+
+        self.assertEqual(self.client.get('/generated/export.csv?since=вчера').status_code, 400)
+        self.assertEqual(self.client.get('/generated/export.xml').status_code, 404)
+
+    def test_generated_list_keyset_pages_without_n_plus_one(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpls = [DocumentTemplate(name=f'Шаблон {i}', description='', template_text='x') for i in range(3)]
+            db.session.add_all(tpls)
+            db.session.flush()
+            base = datetime(2025, 9, 1)
+            for i in range(7):
+                # Two documents share a timestamp to exercise the id tie-breaker
+                db.session.add(GeneratedDocument(template_id=tpls[i % 3].id, filename=f'{i}.pdf',
+                                                 created_at=base + timedelta(minutes=i // 2), meta='{}'))
+            # Документы без даты идут после всех остальных, курсор по ним тоже работает
+            for i in range(4):
+                db.session.add(GeneratedDocument(template_id=tpls[0].id, filename=f'n{i}.pdf', meta='{}'))
+            db.session.commit()
+            GeneratedDocument.query.filter(GeneratedDocument.filename.startswith('n')) \
+                .update({'created_at': None}, synchronize_session=False)
+            db.session.commit()
+            undated = [d.id for d in GeneratedDocument.query.filter(GeneratedDocument.created_at.is_(None))]
+            engine = db.engine
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', count)
+        saved_per_page, Config.PER_PAGE = Config.PER_PAGE, 3
+        try:
+            seen, url = [], '/generated'
+            while url:
+                statements.clear()
+                html = self.client.get(url).data.decode('utf-8')
+                # Страница на стыке датированных и недатированных строк — один лишний запрос
+                self.assertLessEqual(len(statements), 3)
+                self.assertIn('Шаблон', html)
+                seen += [int(x) for x in re.findall(r'/generated/(\d+)/download', html)]
+                nxt = re.search(r'href="(/generated\?after=[^"]+)"', html)
+                url = nxt.group(1).replace('&amp;', '&') if nxt else None
+        finally:
+            Config.PER_PAGE = saved_per_page
+            event.remove(engine, 'before_cursor_execute', count)
+        dated = seen[:7]
+        self.assertEqual(dated, sorted(dated, reverse=True))
+        self.assertEqual(seen[7:], sorted(undated, reverse=True))
+        self.assertEqual(len(set(seen)), 11)
+
+    def test_full_text_search_over_meta_and_templates(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Справка об обучении', description='Для магистрантов',
+                                   template_text='Выдана {{ ФИО }}')
+            other = DocumentTemplate(name='Приказ', description='', template_text='{{ ФИО }}')
+            db.session.add_all([tpl, other])
+            db.session.flush()
+            db.session.add_all([
+                GeneratedDocument(template_id=tpl.id, filename='a.pdf', meta='{"ФИО": "Иванов Пётр"}'),
+                GeneratedDocument(template_id=other.id, filename='b.pdf', meta='{"ФИО": "Сидоров"}'),
+            ])
+            db.session.commit()
+            tplid = tpl.id
+
+        html = self.client.get('/generated?q=иванов').data.decode('utf-8')
+        self.assertIn('a.pdf', html)
+        self.assertNotIn('b.pdf', html)
+        # Prefix query, case folding and ё/е folding
+        html = self.client.get('/generated?q=ИВАН петр').data.decode('utf-8')
+        self.assertIn('a.pdf', html)
+        html = self.client.get('/templates?q=магистрант').data.decode('utf-8')
+        self.assertIn('Для магистрантов', html)
+        self.assertNotIn('<strong>Приказ</strong>', html)
+
+        # Renaming the template re-indexes its documents; deleting it drops them
+        self.client.post(f'/templates/{tplid}/edit', data=dict(
+            name='Сертификат', description='', template_text='Выдана {{ ФИО }}'))
+        self.assertIn('a.pdf', self.client.get('/generated?q=сертификат').data.decode('utf-8'))
+        self.client.post(f'/templates/{tplid}/delete')
+        self.assertNotIn('a.pdf', self.client.get('/generated?q=иванов').data.decode('utf-8'))
+
+    def test_dashboard_counters_follow_inserts_and_deletes(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Счётчик', description='', template_text='x')
+            db.session.add(tpl)
+            db.session.flush()
+            db.session.add_all([
+                GeneratedDocument(template_id=tpl.id, filename='a.pdf', created_at=datetime.utcnow()),
+                GeneratedDocument(template_id=tpl.id, filename='b.pdf', created_at=datetime.utcnow()),
+                GeneratedDocument(template_id=tpl.id, filename='c.pdf', created_at=datetime.utcnow() - timedelta(days=3)),
+            ])
+            db.session.commit()
+            tplid = tpl.id
+            stats.invalidate()
+            summary = stats.summary()
+            self.assertEqual(summary['documents'], 3)
+            self.assertEqual(summary['today'], 2)
+            self.assertEqual(summary['per_template'][0], {'id': tplid, 'name': 'Счётчик', 'count': 3})
+            self.assertEqual(sum(count for _, count in summary['per_day']), 3)
+
+        with self.app.app_context():
+            doc_id = GeneratedDocument.query.filter_by(filename='a.pdf').first().id
+        self.client.post(f'/generated/{doc_id}/delete')
+        html = self.client.get('/').data.decode('utf-8')
+        self.assertIn('Счётчик', html)
+        with self.app.app_context():
+            summary = stats.summary()
+            self.assertEqual((summary['documents'], summary['today']), (2, 1))
+        # Deleting the template removes its documents from the counters as well
+        self.client.post(f'/templates/{tplid}/delete')
+        with self.app.app_context():
+            self.assertEqual(stats.summary()['documents'], 0)
+
+    def test_layout_wraps_long_paragraph_within_margins(self):
+        register_fonts()
+        words = ['студент', 'факультета', 'информационных', 'технологий'] * 300
+        pages = layout.layout_text('**Приказ**\n' + ' '.join(words), has_logo=True)
+        g = layout.A4_GEOMETRY
+        max_width = g.width - g.left_margin - g.right_margin
+        runs = [run for page in pages for run in page.runs]
+        self.assertGreater(len(pages), 1)
+        self.assertEqual(runs[0].text, 'Приказ')
+        self.assertEqual(runs[0].size, layout.HEADING_SIZE)
+        body = runs[1:]
+        self.assertEqual(' '.join(run.text for run in body).split(), words)
+        for run in body:
+            self.assertLessEqual(layout.text_width(run.text, run.font, run.size), max_width)
+            self.assertGreaterEqual(run.y, g.bottom_margin)
+        # Only the first page reserves space for the logo when a paragraph spills over
+        self.assertTrue(pages[0].draw_logo)
+        self.assertFalse(pages[1].draw_logo)
+
+    def test_layout_plan_matches_full_layout_and_follows_template_version(self):
+        from provision import DEMO_TEMPLATES
+        register_fonts()
+        static = ' '.join(['Настоящим подтверждается соблюдение правил внутреннего распорядка'] * 8)
+        text = DEMO_TEMPLATES[0]['template_text'] + ('\n' + static) * 30 + '\n**{{ курс }}**'
+        tpl = DocumentTemplate(id=1, template_text=text, last_modified=datetime(2026, 1, 1))
+        cached = template_cache.get(tpl)
+        plan = layout.plan_for(cached, text)
+        self.assertGreater(plan.static_lines, 30)
+        for data in ({}, {'ФИО_студента': 'Иванов\nИван', 'факультет': 'очень ' * 200, 'курс': '\x00'}):
+            expected = layout.layout_text(cached.template.render(**data), has_logo=True)
+            pages = layout.layout_plan(plan, plan.render(data), has_logo=True)
+            self.assertEqual([(p.draw_logo, p.runs) for p in pages], [(p.draw_logo, p.runs) for p in expected])
+        self.assertIs(layout.plan_for(template_cache.get(tpl), text), plan)
+
+        # Editing the template drops the plan together with the cached version
+        tpl.template_text = text.replace('Справка', 'Справка №{{ номер }}')
+        self.assertIsNot(layout.plan_for(template_cache.get(tpl), tpl.template_text), plan)
+        self.assertIsNone(layout.compile_plan('{% if a %}{{ a }}{% endif %}', cached.template.environment))
+
+        # Whitespace control joins lines, so such templates are laid out as a whole
+        trimmed = DocumentTemplate(id=2, template_text='Hello {{- name -}}\nWorld', last_modified=datetime(2026, 1, 1))
+        trimmed_cached = template_cache.get(trimmed)
+        self.assertIsNone(layout.plan_for(trimmed_cached, trimmed.template_text))
+        pages = layout.layout_text(trimmed_cached.template.render(name='N'), has_logo=True)
+        self.assertEqual([run.text for run in pages[0].runs], ['HelloNWorld'])
+
+    def test_metrics_endpoint_reports_stages_and_counters(self):
+        self.login('admin', 'admin')
+        with self.app.app_context():
+            tpl = DocumentTemplate(name='Metrics', description='', template_text='Студент {{ ФИО }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+        for _ in range(2):
+            rv = self.client.post(f'/templates/{tplid}/generate', data={'ФИО': 'Иванов'})
+            self.assertEqual(rv.status_code, 200)
+            rv.close()
+
+        body = self.client.get('/metrics').data.decode('utf-8')
+        self.assertIn('edudoc_documents_generated_total{source="single"} 2', body)
+        self.assertIn('edudoc_documents_deduplicated_total 1', body)
+        for stage in ('jinja', 'layout', 'draw', 'save', 'render', 'db_commit'):
+            self.assertIn(f'edudoc_stage_seconds_count{{stage="{stage}"}}', body)
+        self.assertEqual(metrics.stage_seconds.count(stage='layout'), 1)
+        self.assertGreater(metrics.pdf_bytes_written.value(), 0)
+        self.assertIn('edudoc_template_cache_hits_total', body)
+
+        # Profiling is opt-in: the header alone does nothing
+        rv = self.client.get('/health', headers={'X-Profile': '1'})
+        self.assertNotIn('X-Profile-File', rv.headers)
+        saved = Config.PROFILE_REQUESTS, Config.PROFILE_FOLDER, Config.PROFILE_MAX_FILES
+        Config.PROFILE_REQUESTS, Config.PROFILE_FOLDER, Config.PROFILE_MAX_FILES = True, self.tmpdir / 'profiles', 2
+        try:
+            for _ in range(3):
+                rv = self.client.get('/health', headers={'X-Profile': '1'})
+            # Without a session the header is ignored
+            anonymous = self.app.test_client().get('/health', headers={'X-Profile': '1'})
+        finally:
+            Config.PROFILE_REQUESTS, Config.PROFILE_FOLDER, Config.PROFILE_MAX_FILES = saved
+        self.assertTrue((self.tmpdir / 'profiles' / rv.headers['X-Profile-File']).exists())
+        self.assertEqual(len(list((self.tmpdir / 'profiles').glob('*.prof'))), 2)
+        self.assertNotIn('X-Profile-File', anonymous.headers)
+
+    def test_sqlite_wal_and_group_commit_under_parallel_generation(self):
+        app = create_app(dict(TEST_CONFIG, SQLALCHEMY_DATABASE_URI=f"sqlite:///{self.tmpdir / 'wal.sqlite'}"))
+        with app.app_context():
+            pragmas = {name: db.session.execute(db.text(f'PRAGMA {name}')).scalar()
+                       for name in ('journal_mode', 'busy_timeout', 'synchronous')}
+            self.assertEqual(pragmas['journal_mode'], 'wal')
+            self.assertEqual(pragmas['busy_timeout'], Config.DB_BUSY_TIMEOUT_MS)
+            self.assertEqual(pragmas['synchronous'], 1)  # NORMAL
+            tpl = DocumentTemplate(name='Parallel', description='', template_text='Студент {{ ФИО }}')
+            db.session.add(tpl)
+            db.session.commit()
+            tplid = tpl.id
+
+        saved = Config.DB_GROUP_COMMIT, Config.DB_GROUP_COMMIT_DELAY_MS
+        Config.DB_GROUP_COMMIT, Config.DB_GROUP_COMMIT_DELAY_MS = True, 50
+        errors = []
+
+        def worker(n):
+            client = app.test_client()
+            client.post('/login', data={'username': 'admin', 'password': 'admin'})
+            for i in range(3):
+                rv = client.post(f'/templates/{tplid}/generate', data={'ФИО': f'Студент {n}-{i}'})
+                if rv.status_code != 200:
+                    errors.append(rv.status_code)
+                rv.close()
+
+        try:
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            with app.app_context():
+                writer = database.get_writer()
+                self.assertEqual(GeneratedDocument.query.filter_by(template_id=tplid).count(), 18)
+                # Parallel requests shared transactions instead of committing one by one
+                self.assertLess(writer.batches, 18)
+                writer.stop()
+        finally:
+            Config.DB_GROUP_COMMIT, Config.DB_GROUP_COMMIT_DELAY_MS = saved
+            with app.app_context():
+                db.engine.dispose()
+        self.assertEqual(errors, [])
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,155 +1,130 @@
 # utils.py
 import io
+import os
+import tempfile
 import uuid
+from contextlib import contextmanager
 from pathlib import Path
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from jinja2 import Template
-from PIL import Image
+from resources import register_fonts, get_logo, get_signature
+from layout import A4_GEOMETRY, layout_text, layout_plan, plan_for
+from metrics import span
 
-BASE_DIR = Path(__file__).resolve().parent
-FONT_PATH = BASE_DIR / "fonts" / "DejaVuSans.ttf"
-FONT_BOLD_PATH = BASE_DIR / "fonts" / "DejaVuSans-Bold.ttf"
-FONT_ITALIC_PATH = BASE_DIR / "fonts" / "DejaVuSans-Oblique.ttf"
+def create_pdf_from_template(template_text, data_dict, signature_path=None, compiled=None, output=None,
+                             cached=None):
+    """
+    Рендерит шаблон в PDF. Если передан compiled (готовый jinja2.Template)
+    или cached (запись template_cache), повторная компиляция текста не
+    выполняется; с cached статические строки берутся из плана вёрстки.
+    output — открытый файл, куда пишется PDF; без него возвращается BytesIO.
+    """
+    return create_merged_pdf(template_text, [data_dict], signature_path, compiled=compiled, output=output,
+                             cached=cached)
 
-def register_font():
-    try:
-        if FONT_PATH.exists():
-            pdfmetrics.registerFont(TTFont("DejaVuSans", str(FONT_PATH)))
-        if FONT_BOLD_PATH.exists():
-            pdfmetrics.registerFont(TTFont("DejaVuSans-Bold", str(FONT_BOLD_PATH)))
-        else:
-            # fallback к обычному шрифту, если нет жирного
-            pdfmetrics.registerFont(TTFont("DejaVuSans-Bold", str(FONT_PATH)))
-        if FONT_ITALIC_PATH.exists():
-            pdfmetrics.registerFont(TTFont("DejaVuSans-Italic", str(FONT_ITALIC_PATH)))
-        else:
-            # fallback к обычному шрифту, если нет курсива
-            pdfmetrics.registerFont(TTFont("DejaVuSans-Italic", str(FONT_PATH)))
-    except Exception as e:
-        print(f"Ошибка загрузки шрифта: {e}")
 
-def create_pdf_from_template(template_text, data_dict, signature_path=None):
-    register_font()
-    jinja_tpl = Template(template_text or "")
-    rendered = jinja_tpl.render(**(data_dict or {}))
+def create_merged_pdf(template_text, rows, signature_path=None, compiled=None, output=None, cached=None,
+                      progress=None):
+    """
+    Рендерит шаблон для каждой строки данных в один PDF: каждая запись
+    начинается с новой страницы. Логотип, подпись и подмножества шрифтов
+    встраиваются в документ один раз и используются всеми страницами.
+    progress(готово, всего) вызывается после каждой записи.
+    """
+    with span("fonts"):
+        register_fonts()
+    if cached is not None:
+        compiled = cached.template
+    jinja_tpl = compiled or Template(template_text or "")
+    plan = plan_for(cached, template_text) if cached is not None else None
 
-    buffer = io.BytesIO()
+    buffer = output if output is not None else io.BytesIO()
     p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
+    g = A4_GEOMETRY
+    logo = get_logo()
 
-    # Отступы
-    left_margin = 25 * mm
-    right_margin = 25 * mm
-    top_margin = height - 30 * mm
-    bottom_margin = 30 * mm
-
-    # --- ВСТАВКА ЛОГОТИПА В ШАПКУ ---
-    logo_path = BASE_DIR / "static" / "img" / "logo.png"  # можно .jpg
-    if logo_path.exists():
-        # Вставляем логотип в левый верхний угол
-        p.drawImage(str(logo_path), left_margin, height - 30 * mm, width=50 * mm, height=50 * mm, preserveAspectRatio=True, mask='auto')
-        y = top_margin - 60 * mm  # сдвигаем текст ниже, чтобы он не перекрывал логотип
-    else:
-        y = top_margin  # если логотипа нет — начинаем с верхнего отступа
-
-    # Устанавливаем шрифт по умолчанию
-    try:
-        p.setFont("DejaVuSans", 12)
-    except:
-        p.setFont("Helvetica", 12)
+    sig = None
+    if signature_path:
+        try:
+            # Подпись уже декодирована и уменьшена до ширины не более 60 мм
+            sig = get_signature(signature_path)
+        except Exception as e:
+            print(f"Ошибка вставки подписи: {e}")
 
-    # Разбиваем текст на строки
-    lines = rendered.splitlines()
+    for index, data_dict in enumerate(rows):
+        if index:
+            p.showPage()
+        if plan is not None:
+            with span("jinja"):
+                rendered = plan.render(data_dict or {})
+            with span("layout"):
+                pages = layout_plan(plan, rendered, has_logo=logo is not None)
+        else:
+            with span("jinja"):
+                rendered = jinja_tpl.render(**(data_dict or {}))
+            with span("layout"):
+                pages = layout_text(rendered, has_logo=logo is not None, geometry=g)
+        with span("draw"):
+            draw_layout(p, pages, logo, g)
 
-    for line in lines:
-        # Пропускаем пустые строки
-        if not line.strip():
-            y -= 6 * mm
-            continue
+        # Добавляем подпись внизу справа на последней странице записи
+        if sig is not None:
+            try:
+                with span("signature"):
+                    x = g.width - g.left_margin - sig.draw_width
+                    y_sig = g.bottom_margin + 10 * mm
+                    p.drawImage(sig.reader, x, y_sig, width=sig.draw_width, height=sig.draw_height, preserveAspectRatio=True, mask='auto')
+            except Exception as e:
+                print(f"Ошибка вставки подписи: {e}")
+        if progress:
+            progress(index + 1, len(rows))
 
-        # Обработка стилей: **жирный**, *курсив*, _подчёркнутый_
-        line = line.strip()
+    # Сериализация PDF и, если передан output, запись на диск
+    with span("save"):
+        p.save()
+    if output is None:
+        buffer.seek(0)
+    return buffer
 
-        # Проверка на заголовок: строка вида "**Текст**"
-        if line.startswith("**") and line.endswith("**"):
-            content = line[2:-2]
-            try:
-                p.setFont("DejaVuSans-Bold", 14)
-            except:
-                p.setFont("Helvetica-Bold", 14)
-            # Центрируем заголовок
-            text_width = p.stringWidth(content, p._fontname, p._fontsize)
-            x_pos = (width - text_width) / 2
-            p.drawString(x_pos, y, content)
-            p.setFont("DejaVuSans", 12)  # возвращаем обычный шрифт
-        else:
-            # Обычная строка
-            # Простая обработка переноса строк, если строка слишком длинная
-            max_width = width - left_margin - right_margin
-            text_width = p.stringWidth(line, p._fontname, p._fontsize)
-            if text_width > max_width:
-                # Разбиваем на слова и переносим
-                words = line.split()
-                current_line = ""
-                for word in words:
-                    test_line = current_line + " " + word if current_line else word
-                    test_width = p.stringWidth(test_line, p._fontname, p._fontsize)
-                    if test_width <= max_width:
-                        current_line = test_line
-                    else:
-                        p.drawString(left_margin, y, current_line)
-                        current_line = word
-                        y -= 6 * mm
-                        if y < bottom_margin:
-                            p.showPage()
-                            y = top_margin
-                            if logo_path.exists():
-                                y -= 60 * mm  # если на новой странице тоже нужен логотип, сдвигаем
-                            try:
-                                p.setFont("DejaVuSans", 12)
-                            except:
-                                p.setFont("Helvetica", 12)
-                if current_line:
-                    p.drawString(left_margin, y, current_line)
-            else:
-                p.drawString(left_margin, y, line)
 
-        y -= 6 * mm
-        if y < bottom_margin:
+def draw_layout(p, pages, logo, g=A4_GEOMETRY):
+    """Рисует свёрстанные страницы на canvas. Шрифт переключается только при смене."""
+    for index, page in enumerate(pages):
+        if index:
             p.showPage()
-            y = top_margin
-            if logo_path.exists():
-                # Вставляем логотип и на новой странице (опционально)
-                p.drawImage(str(logo_path), left_margin, height - 30 * mm, width=50 * mm, height=50 * mm, preserveAspectRatio=True, mask='auto')
-                y -= 60 * mm
-            try:
-                p.setFont("DejaVuSans", 12)
-            except:
-                p.setFont("Helvetica", 12)
+        if page.draw_logo and logo is not None:
+            # Логотип в левом верхнем углу
+            p.drawImage(logo, g.left_margin, g.height - 30 * mm, width=50 * mm, height=50 * mm,
+                        preserveAspectRatio=True, mask='auto')
+        current_font = None
+        for run in page.runs:
+            if (run.font, run.size) != current_font:
+                p.setFont(run.font, run.size)
+                current_font = (run.font, run.size)
+            p.drawString(run.x, run.y, run.text)
 
-    # Добавляем подпись внизу справа (если есть)
-    if signature_path:
-        try:
-            img = Image.open(signature_path)
-            img_w, img_h = img.size
-            # Ограничиваем ширину
-            max_w_pt = 60 * mm
-            scale = min(max_w_pt / img_w, 1.0)
-            draw_w = img_w * scale
-            draw_h = img_h * scale
-            x = width - left_margin - draw_w
-            y_sig = bottom_margin + 10 * mm
-            p.drawImage(str(signature_path), x, y_sig, width=draw_w, height=draw_h, preserveAspectRatio=True, mask='auto')
-        except Exception as e:
-            print(f"Ошибка вставки подписи: {e}")
 
-    p.save()
-    buffer.seek(0)
-    return buffer
+@contextmanager
+def atomic_write(target_path):
+    """
+    Открывает временный файл рядом с target_path и по успешному завершению
+    блока атомарно переименовывает его в target_path. При ошибке файл удаляется,
+    так что недописанный PDF никогда не виден под итоговым именем.
+    """
+    target_path = Path(target_path)
+    fd, tmp_name = tempfile.mkstemp(dir=target_path.parent, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            yield tmp
+        os.replace(tmp_name, target_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
 
 def secure_unique_filename(original_name):
     ext = Path(original_name).suffix